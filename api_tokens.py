@@ -0,0 +1,53 @@
+"""Manage tokens for the JSON API (/api/v1/).
+
+    python api_tokens.py create USERNAME NAME    prints the token once
+    python api_tokens.py list
+    python api_tokens.py revoke TOKEN_ID
+
+Clients send the token as ``Authorization: Bearer <token>`` and pick a
+branch with the ``X-Branch`` header.
+"""
+import argparse
+import sys
+from datetime import datetime
+
+import app as app_module
+from app import db, ApiToken, User, create_api_token
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage JSON API tokens.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser('create')
+    create_parser.add_argument('username')
+    create_parser.add_argument('name', help='what the token is for, e.g. "counter 2 POS"')
+    commands.add_parser('list')
+    revoke_parser = commands.add_parser('revoke')
+    revoke_parser.add_argument('token_id', type=int)
+    args = parser.parse_args()
+
+    with app_module.app.app_context():
+        app_module.upgrade_schema(db.engine)
+        if args.command == 'create':
+            user = User.query.filter_by(username=args.username).first()
+            if user is None:
+                sys.exit(f'Unknown user: {args.username}')
+            token = create_api_token(user, args.name)
+            db.session.commit()
+            print(token)
+        elif args.command == 'list':
+            for api_token in ApiToken.query.order_by(ApiToken.id):
+                status = f'revoked {api_token.revoked_at:%Y-%m-%d}' if api_token.revoked_at else 'active'
+                print(f'{api_token.id:>4} {api_token.user.username:<20} {api_token.name:<30} '
+                      f'{api_token.created_at:%Y-%m-%d} {status}')
+        else:
+            api_token = db.session.get(ApiToken, args.token_id)
+            if api_token is None:
+                sys.exit(f'Unknown token id: {args.token_id}')
+            api_token.revoked_at = datetime.utcnow()
+            db.session.commit()
+            print(f'Token {api_token.id} ({api_token.name}) revoked')
+
+
+if __name__ == '__main__':
+    main()
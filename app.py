@@ -1,13 +1,48 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, make_response, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, make_response, send_file, g, session, has_app_context, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from flask_sqlalchemy.pagination import Pagination
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-from sqlalchemy import func, extract
+from werkzeug.datastructures import MultiDict
+from jinja2 import FileSystemBytecodeCache
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, extract, event, inspect as sa_inspect, text, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+from sqlalchemy.schema import CreateColumn
 import os
 import csv
+import heapq
+import random
+import json
+import re
+from collections import deque
 from io import StringIO
+from types import SimpleNamespace
 import base64
+import copy
+import hashlib
+import secrets
+import threading
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+
+import backups
+import branch_reports
+import cache
+import compression
+import images
+import profiler
+import sales_archive
+
+# Optional NumPy-backed forecasting: reorder suggestions are unavailable without it.
+try:
+    import forecasting
+except ImportError:
+    forecasting = None
 
 # Optional Pillow imports: try to import for image generation, otherwise fall back.
 try:
@@ -18,27 +53,192 @@ except Exception:
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-123'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medical_store.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///medical_store.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# Medicine images: resized variants are stored under their SHA-256 in
+# UPLOAD_FOLDER and served with far-future cache headers; the uploaded
+# originals (EXIF and all) stay private, for re-rendering by rethumbnail_images.py
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(app.root_path, 'static', 'uploads'))
+app.config['IMAGE_ORIGINALS_FOLDER'] = os.environ.get('IMAGE_ORIGINALS_FOLDER',
+                                                      os.path.join(app.instance_path, 'image_originals'))
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
+# name -> (width, height, 'crop' to fill the box or 'fit' inside it); each
+# name is a Medicine.image_<name> column
+app.config['IMAGE_VARIANTS'] = {'thumb': (96, 96, 'crop'), 'preview': (640, 640, 'fit')}
+app.config['IMAGE_QUALITY'] = 82  # JPEG quality of the variants
+app.config['IMAGE_MAX_BYTES'] = 20 * 1024 * 1024
+app.config['IMAGE_WORKERS'] = 2  # processes resizing uploads
+app.config['IMAGE_CACHE_SECONDS'] = 365 * 24 * 3600
+app.config['BRANCHES_FILE'] = os.environ.get('BRANCHES_FILE', os.path.join(app.instance_path, 'branches.json'))
+app.config['DEFAULT_BRANCH'] = 'main'
+# Demand forecasting / reorder suggestions
+app.config['FORECAST_HISTORY_DAYS'] = 56
+app.config['FORECAST_METHOD'] = 'ema'  # 'ema' (exponential smoothing) or 'sma' (moving average)
+app.config['FORECAST_ALPHA'] = 0.3
+app.config['FORECAST_SMA_WINDOW'] = 14
+app.config['REORDER_LEAD_TIME_DAYS'] = 7
+app.config['REORDER_COVER_DAYS'] = 14
+app.config['REORDER_SAFETY_DAYS'] = 3
+# Sales older than this many days are moved to yearly archives by archive_sales.py
+app.config['ARCHIVE_AFTER_DAYS'] = 365
+app.config['ARCHIVE_FOLDER'] = os.environ.get('ARCHIVE_FOLDER', os.path.join(app.instance_path, 'archive'))
+# Online backups (backup_db.py): snapshots kept per branch, pages copied per step
+app.config['BACKUP_FOLDER'] = os.environ.get('BACKUP_FOLDER', os.path.join(app.instance_path, 'backups'))
+app.config['BACKUP_RETENTION'] = 14
+app.config['BACKUP_PAGES_PER_STEP'] = 256
+# Reporting reads: a replica URL (per branch: "reporting_uri" in the registry),
+# otherwise a read-only connection to the SQLite file in WAL mode
+app.config['REPORTING_DATABASE_URL'] = os.environ.get('REPORTING_DATABASE_URL')
+app.config['REPORTING_SQLITE_WAL'] = True
+app.config['REPORTING_MAX_STALENESS'] = 60  # seconds a replica may lag; None = never check
+app.config['REPORTING_LAG_CHECK_INTERVAL'] = 5
+# Barcode scans look for catalog writes of other worker processes at most
+# this often (seconds); this process's own commits are seen at once
+app.config['BARCODE_REFRESH_SECONDS'] = 1
+# Live dashboard stream: a medicine below this quantity counts as low stock
+app.config['LOW_STOCK_THRESHOLD'] = 10
+app.config['DASHBOARD_EVENT_RETENTION'] = 1000  # logged events kept for catching up
+app.config['DASHBOARD_POLL_SECONDS'] = 2  # how often new events are looked for
+app.config['DASHBOARD_MAX_CLIENTS'] = 50  # open streams per branch and process (asgi.py)
+app.config['DASHBOARD_QUEUE_SIZE'] = 100  # undelivered events before a viewer is dropped
+app.config['DASHBOARD_HEARTBEAT'] = 15  # seconds between keep-alive comments (asgi.py)
+app.config['DASHBOARD_STREAM_SECONDS'] = 300  # streams end after this; the browser reconnects (asgi.py)
+# Response compression (gzip, or brotli when installed and accepted)
+app.config['COMPRESSION_LEVEL'] = 6  # gzip 1-9
+app.config['COMPRESSION_BROTLI_QUALITY'] = 5  # brotli 0-11
+app.config['COMPRESSION_MIN_SIZE'] = 500  # bytes; smaller bodies are sent as is
+app.config['COMPRESSION_SKIP_TYPES'] = compression.DEFAULT_SKIP_TYPES
+
+# Request profiler (admin page): where profiles are stored, how many are kept
+app.config['PROFILE_FOLDER'] = os.environ.get('PROFILE_FOLDER', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_RETENTION'] = 200
+app.config['PROFILE_SAMPLING_INTERVAL'] = 0.005  # seconds between stack samples in sampling mode
+# Cache for medicine lookups, dashboard KPIs and reports: 'sqlite' (one file
+# shared by all worker processes on the host) or 'memory' (per process)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite')
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+app.config['CACHE_MAX_ENTRIES'] = 2000
+app.config['CACHE_DEFAULT_TTL'] = 300  # seconds; entries are also invalidated by writes
+# Compiled templates are kept as Jinja bytecode so new workers skip compiling
+# them ("python run_checks.py --precompile" fills it at deploy); empty disables
+app.config['TEMPLATE_CACHE_FOLDER'] = os.environ.get('TEMPLATE_CACHE_FOLDER',
+                                                     os.path.join(app.instance_path, 'template_cache'))
+# None: templates are checked for changes on every render only in debug mode
+app.config['TEMPLATES_AUTO_RELOAD'] = {'1': True, '0': False}.get(os.environ.get('TEMPLATES_AUTO_RELOAD'))
+# Group commit for new sales (off by default): a writer thread per branch
+# commits up to MAX_SALES sales, or those arriving within MAX_WAIT_MS of the
+# first, in one transaction; each request is answered after that commit
+app.config['SALE_GROUP_COMMIT'] = os.environ.get('SALE_GROUP_COMMIT') == '1'
+app.config['SALE_GROUP_COMMIT_MAX_SALES'] = 50
+app.config['SALE_GROUP_COMMIT_MAX_WAIT_MS'] = 5
+# Async lookups (asgi.py): database connections per branch and process, and
+# threads serving the Flask routes next to them
+app.config['ASYNC_MAX_CONNECTIONS'] = 8
+app.config['ASGI_WSGI_THREADS'] = 32
+
+app.wsgi_app = compression.CompressionMiddleware(
+    app.wsgi_app,
+    level=app.config['COMPRESSION_LEVEL'],
+    brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+    min_size=app.config['COMPRESSION_MIN_SIZE'],
+    skip_types=app.config['COMPRESSION_SKIP_TYPES'],
+)
+
+if app.config['TEMPLATE_CACHE_FOLDER']:
+    os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+    app.jinja_options = dict(app.jinja_options,
+                             bytecode_cache=FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_FOLDER']))
 
 # Ensure the upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-db = SQLAlchemy(app)
+
+def load_branch_registry(path):
+    """Read the branch registry: {"code": {"name": ..., "database_uri": ...,
+    "reporting_uri": ...}} (the reporting replica is optional).
+
+    The default database is always registered as the "main" branch, so a
+    single-shop install keeps working without a registry file.
+    """
+    branches = {app.config['DEFAULT_BRANCH']: {'name': 'Main Branch',
+                                               'database_uri': app.config['SQLALCHEMY_DATABASE_URI'],
+                                               'reporting_uri': app.config['REPORTING_DATABASE_URL']}}
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for code, entry in json.load(f).items():
+                if isinstance(entry, str):
+                    entry = {'name': code, 'database_uri': entry}
+                branches[code] = {'name': entry.get('name', code), 'database_uri': entry['database_uri'],
+                                  'reporting_uri': entry.get('reporting_uri')}
+    return branches
+
+
+app.config['BRANCHES'] = load_branch_registry(app.config['BRANCHES_FILE'])
+# Every non-default branch gets its own engine; BranchSession picks one per request.
+app.config['SQLALCHEMY_BINDS'] = {
+    code: entry['database_uri']
+    for code, entry in app.config['BRANCHES'].items()
+    if code != app.config['DEFAULT_BRANCH']
+}
+
+
+class BranchSession(FlaskSQLAlchemySession):
+    """Session that routes queries to the database of the branch bound to the
+    current request (``g.branch``). Models flagged ``__branch_shared__`` such as
+    users always live in the default database."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            branch = g.get('branch')
+            shared = mapper is not None and getattr(getattr(mapper, 'class_', mapper), '__branch_shared__', False)
+            # SELECTs of @reporting_route views go to the reporting engine
+            if g.get('reporting') and not shared and getattr(clause, 'is_select', False):
+                engine = request_reporting_engine()
+                if engine is not None:
+                    return engine
+            if branch and not shared and branch in self._db.engines:
+                return self._db.engines[branch]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': BranchSession})
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 # Database Models
 class User(UserMixin, db.Model):
+    __branch_shared__ = True
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(120), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
 
+class ApiToken(db.Model):
+    """Bearer token for the JSON API. Only the SHA-256 of the token is stored."""
+    __branch_shared__ = True
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(80), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    revoked_at = db.Column(db.DateTime)
+    user = db.relationship('User')
+
 class Medicine(db.Model):
+    __table_args__ = (
+        # Medicine list filters: one covering index led by each facet column,
+        # so every facet count is a range scan that never reads the table and
+        # each sortable column has an index to page through
+        db.Index('ix_medicine_supplier_facets', 'supplier_id', 'quantity', 'expiry_date', 'price'),
+        db.Index('ix_medicine_quantity_facets', 'quantity', 'expiry_date', 'price', 'supplier_id'),
+        db.Index('ix_medicine_expiry_facets', 'expiry_date', 'price', 'quantity', 'supplier_id'),
+        db.Index('ix_medicine_price_facets', 'price', 'quantity', 'expiry_date', 'supplier_id'),
+        db.Index('ix_medicine_name', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -48,6 +248,21 @@ class Medicine(db.Model):
     batch_number = db.Column(db.String(50))
     expiry_date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # SHA-256 digests of the uploaded original and its variants (see images.py);
+    # the variants stay empty while they are being rendered
+    image_source = db.Column(db.String(64), index=True)
+    image_thumb = db.Column(db.String(64))
+    image_preview = db.Column(db.String(64))
+    image_error = db.Column(db.String(200))  # why the last rendering failed
+    barcodes = db.relationship('Barcode', backref='medicine', lazy=True, cascade='all, delete-orphan')
+
+class Barcode(db.Model):
+    """A scannable code (EAN/GTIN or shop label) for a medicine. A medicine
+    can have several, e.g. one per pack size; scanning adds ``pack_size`` units."""
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(32), unique=True, nullable=False, index=True)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicine.id'), nullable=False, index=True)
+    pack_size = db.Column(db.Integer, nullable=False, default=1)
 
 class Supplier(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,19 +285,34 @@ class Purchase(db.Model):
     payment_status = db.Column(db.String(20), default='Pending')
     items = db.relationship('PurchaseItem', backref='purchase', lazy=True, cascade='all, delete-orphan')
 
+class Customer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    # Normalized with normalize_phone(); the unique index makes lookups O(1)
+    phone = db.Column(db.String(20), unique=True, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sales = db.relationship('Sale', backref='customer', lazy='dynamic')
+
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
     customer_name = db.Column(db.String(100), nullable=False)
     customer_contact = db.Column(db.String(20))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
     total_amount = db.Column(db.Float, nullable=False)
     discount = db.Column(db.Float, default=0.0)
     tax_amount = db.Column(db.Float, default=0.0)
     payment_method = db.Column(db.String(20), default='Cash')
-    sale_date = db.Column(db.DateTime, default=datetime.utcnow)
-    items = db.relationship('SaleItem', backref='sale_ref', lazy=True, cascade='all, delete-orphan')
+    sale_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    items = db.relationship('SaleItem', backref='sale_ref', lazy=True, cascade='all, delete-orphan',
+                            order_by='SaleItem.id')
 
 class PurchaseItem(db.Model):
+    # Covering index for the grouped per-medicine sums in expected_stock();
+    # the second finds the lots with stock left for FIFO costing
+    __table_args__ = (db.Index('ix_purchase_item_medicine_quantity', 'medicine_id', 'quantity'),
+                      db.Index('ix_purchase_item_medicine_remaining', 'medicine_id', 'remaining_quantity'))
+
     id = db.Column(db.Integer, primary_key=True)
     purchase_id = db.Column(db.Integer, db.ForeignKey('purchase.id'), nullable=False)
     medicine_id = db.Column(db.Integer, db.ForeignKey('medicine.id'), nullable=False)
@@ -90,10 +320,16 @@ class PurchaseItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     expiry_date = db.Column(db.Date, nullable=False)
+    # Units of this lot not yet sold (FIFO costing); NULL until backfill_costs.py
+    # has run on lots recorded before the column existed
+    remaining_quantity = db.Column(db.Integer, default=lambda context: context.get_current_parameters()['quantity'])
     # Relationship for easy access in templates
     medicine = db.relationship('Medicine', foreign_keys=[medicine_id], lazy='joined')
 
 class SaleItem(db.Model):
+    __table_args__ = (db.Index('ix_sale_item_medicine_quantity', 'medicine_id', 'quantity'),
+                      db.Index('ix_sale_item_sale_quantity', 'sale_id', 'quantity'))
+
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
     medicine_id = db.Column(db.Integer, db.ForeignKey('medicine.id'), nullable=False)
@@ -101,13 +337,1072 @@ class SaleItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
+    # Purchase cost of the units sold, matched FIFO to purchase lots; NULL for
+    # lines recorded before costing existed (see backfill_costs.py)
+    cost_amount = db.Column(db.Float)
+    # Units not covered by any lot, costed at the medicine's last purchase price
+    unmatched_quantity = db.Column(db.Integer, default=0)
     # Relationship for easy access in templates
     medicine = db.relationship('Medicine', foreign_keys=[medicine_id], lazy='joined')
 
+class CatalogChange(db.Model):
+    """Append-only change log behind the catalog delta feed. The id doubles as
+    the monotonically increasing catalog version."""
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False, index=True)
+    change_type = db.Column(db.String(10), nullable=False)  # upsert / delete
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class DashboardEvent(db.Model):
+    """Append-only log of committed dashboard deltas, one row per transaction
+    that changed a figure. The id is the dashboard version of the branch, the
+    same in every worker process; the newest DASHBOARD_EVENT_RETENTION rows
+    are kept."""
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(10), nullable=False)  # delta / reload
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class StockMovement(db.Model):
+    """Append-only stock ledger. ``quantity`` is the signed change applied to
+    Medicine.quantity in the same transaction."""
+    __table_args__ = (db.Index('ix_stock_movement_medicine_created', 'medicine_id', 'created_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    movement_type = db.Column(db.String(20), nullable=False)  # purchase / sale / adjustment / write-off
+    quantity = db.Column(db.Integer, nullable=False)
+    reference = db.Column(db.String(50))
+    note = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class StockSnapshot(db.Model):
+    __table_args__ = (db.Index('ix_stock_snapshot_medicine_taken', 'medicine_id', 'taken_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+
+# 'reconciliation' rows record corrections made by reconcile_stock(); unlike
+# manual adjustments they are not part of the expected stock they correct to.
+STOCK_MOVEMENT_TYPES = ('purchase', 'sale', 'adjustment', 'write-off', 'reconciliation')
+
+class SaleArchive(db.Model):
+    """Manifest of the yearly archive files written by archive_sales(); lets
+    queries skip the archives entirely when their date range is all hot."""
+    year = db.Column(db.Integer, primary_key=True)
+    first_sale = db.Column(db.DateTime, nullable=False)
+    last_sale = db.Column(db.DateTime, nullable=False)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SupplierStats(db.Model):
+    """Per-supplier aggregates, kept current incrementally by
+    update_supplier_stats() whenever medicines or purchases are flushed."""
+    supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'), primary_key=True)
+    sku_count = db.Column(db.Integer, nullable=False, default=0)
+    stock_value = db.Column(db.Float, nullable=False, default=0.0)
+    total_purchased = db.Column(db.Float, nullable=False, default=0.0)
+    outstanding_amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReorderSuggestion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicine.id'), nullable=False, index=True)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'), index=True)
+    current_stock = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False)
+    days_of_cover = db.Column(db.Float)  # NULL when there is no demand
+    reorder_quantity = db.Column(db.Integer, nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    medicine = db.relationship('Medicine', lazy='joined')
+    supplier = db.relationship('Supplier', lazy='joined')
+
+# Change tracking: every flushed Medicine insert/update/delete (including the
+# stock decrements of a sale) is recorded in the same transaction.
+@event.listens_for(BranchSession, 'after_flush')
+def record_catalog_changes(session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Medicine):
+            rows.append({'medicine_id': obj.id, 'change_type': 'upsert', 'changed_at': now})
+    # Barcode edits change the scan index of their medicine
+    deleted_ids = {obj.id for obj in session.deleted if isinstance(obj, Medicine)}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Barcode) and obj.medicine_id and obj.medicine_id not in deleted_ids:
+            rows.append({'medicine_id': obj.medicine_id, 'change_type': 'upsert', 'changed_at': now})
+    for obj in session.dirty:
+        if isinstance(obj, Medicine) and session.is_modified(obj, include_collections=False):
+            rows.append({'medicine_id': obj.id, 'change_type': 'upsert', 'changed_at': now})
+    for obj in session.deleted:
+        if isinstance(obj, Medicine):
+            rows.append({'medicine_id': obj.id, 'change_type': 'delete', 'changed_at': now})
+    if rows:
+        session.connection().execute(CatalogChange.__table__.insert(), rows)
+
+def record_bulk_catalog_changes(connection, medicine_ids, change_type='upsert'):
+    """Catalog change rows for bulk SQL updates, which bypass the flush hook."""
+    mark_dashboard_stale()
+    invalidate_cache('catalog')
+    now = datetime.utcnow()
+    rows = [{'medicine_id': medicine_id, 'change_type': change_type, 'changed_at': now}
+            for medicine_id in medicine_ids]
+    if rows:
+        connection.execute(CatalogChange.__table__.insert(), rows)
+
+# Shared cache: entries are grouped per branch into a "catalog" namespace
+# (medicines, barcodes, suppliers) and a "sales" namespace. A committed write
+# bumps the version of its namespaces, which invalidates the entries built
+# from them in every worker process sharing the cache.
+CACHE_KINDS = {Medicine: 'catalog', Barcode: 'catalog', Supplier: 'catalog', Sale: 'sales', SaleItem: 'sales'}
+_app_cache = None
+
+def app_cache():
+    global _app_cache
+    if _app_cache is None:
+        _app_cache = cache.create_cache(app.config['CACHE_BACKEND'], app.config['CACHE_PATH'],
+                                        max_entries=app.config['CACHE_MAX_ENTRIES'],
+                                        default_ttl=app.config['CACHE_DEFAULT_TTL'])
+    return _app_cache
+
+def cache_namespaces(*kinds, branch=None):
+    code = branch or (g.get('branch') if has_app_context() else None) or app.config['DEFAULT_BRANCH']
+    return [f'{code}:{kind}' for kind in kinds]
+
+def invalidate_cache(*kinds):
+    """Invalidate cached ``kinds`` once the current transaction commits; bulk
+    SQL writes bypass the flush hook and call this themselves."""
+    if has_app_context():
+        db.session.info.setdefault('cache_bumps', set()).update(kinds)
+
+@event.listens_for(BranchSession, 'after_flush')
+def collect_cache_bumps(session, flush_context):
+    kinds = {CACHE_KINDS[type(obj)] for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+             if type(obj) in CACHE_KINDS}
+    if kinds:
+        session.info.setdefault('cache_bumps', set()).update(kinds)
+
+# Registered before the dashboard hooks: a dashboard reloading on a published
+# event must not be served the entry from before the commit
+@event.listens_for(BranchSession, 'after_commit')
+def bump_cache_versions(session):
+    kinds = session.info.pop('cache_bumps', None)
+    if kinds and has_app_context():
+        app_cache().bump(*cache_namespaces(*sorted(kinds)))
+        if 'catalog' in kinds:
+            barcode_index().mark_stale()
+
+@event.listens_for(BranchSession, 'after_soft_rollback')
+def discard_cache_bumps(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('cache_bumps', None)
+
+@event.listens_for(BranchSession, 'after_flush')
+def maintain_supplier_stats(session, flush_context):
+    update_supplier_stats(session)
+
+def record_stock_movement(medicine, quantity, movement_type, reference=None, note=None):
+    """Change a medicine's stock and append the movement to the ledger.
+
+    Nothing is committed here, so the ledger row is written in the same
+    transaction as the quantity change.
+    """
+    medicine.quantity += quantity
+    movement = StockMovement(
+        medicine_id=medicine.id,
+        movement_type=movement_type,
+        quantity=quantity,
+        reference=reference,
+        note=note
+    )
+    db.session.add(movement)
+    return movement
+
+def expected_stock():
+    """Stock per medicine according to history, in one grouped pass over the
+    line items: purchased - sold + manual adjustments and write-offs.
+    Archived sales are subtracted as well."""
+    lines = db.union_all(
+        db.select(PurchaseItem.medicine_id, PurchaseItem.quantity),
+        db.select(SaleItem.medicine_id, -SaleItem.quantity),
+        db.select(StockMovement.medicine_id, StockMovement.quantity).where(
+            StockMovement.movement_type.in_(('adjustment', 'write-off'))),
+    ).subquery()
+    expected = dict(db.session.execute(
+        db.select(lines.c.medicine_id, func.sum(lines.c.quantity)).group_by(lines.c.medicine_id)
+    ).all())
+    store = archive_store()
+    for year, _ in archived_years():
+        for medicine_id, sold in store.sold_quantities(year):
+            expected[medicine_id] = expected.get(medicine_id, 0) - sold
+    return expected
+
+def reconcile_stock(apply=False, medicine_ids=None):
+    """Compare Medicine.quantity with expected_stock().
+
+    Returns ``(drift, orphans)``: one row per medicine whose stock differs
+    (optionally limited to ``medicine_ids``) and the ids that line items
+    still reference after their medicine was deleted. With ``apply`` the
+    drifted medicines are corrected; the caller commits.
+    """
+    expected = expected_stock()
+    drift = []
+    known = set()
+    for medicine_id, name, quantity, supplier_id in db.session.execute(
+            db.select(Medicine.id, Medicine.name, Medicine.quantity, Medicine.supplier_id).order_by(Medicine.name)):
+        known.add(medicine_id)
+        target = expected.get(medicine_id, 0)
+        if target != quantity and (medicine_ids is None or medicine_id in medicine_ids):
+            drift.append(SimpleNamespace(medicine_id=medicine_id, name=name, supplier_id=supplier_id,
+                                         actual=quantity, expected=target, difference=target - quantity))
+    orphans = sorted(set(expected) - known)
+    if apply and drift:
+        apply_stock_corrections(drift)
+    return drift, orphans
+
+def apply_stock_corrections(drift):
+    """Set every drifted medicine to its expected stock with one executemany
+    UPDATE, and write the matching ledger, catalog and supplier stats rows."""
+    conn = db.session.connection()
+    now = datetime.utcnow()
+    medicine = Medicine.__table__
+    conn.execute(
+        medicine.update().where(medicine.c.id == bindparam('b_id')).values(quantity=bindparam('b_quantity')),
+        [{'b_id': row.medicine_id, 'b_quantity': row.expected} for row in drift]
+    )
+    conn.execute(StockMovement.__table__.insert(), [
+        {'medicine_id': row.medicine_id, 'movement_type': 'reconciliation', 'quantity': row.difference,
+         'note': f'Reconciled from {row.actual} to {row.expected}', 'created_at': now}
+        for row in drift
+    ])
+    # No lots are released: the corrected stock is what the history (and so
+    # the lots, which every removal path drains) already says, and
+    # rebuild_sale_costs() does not replay reconciliation rows either
+    record_bulk_catalog_changes(conn, [row.medicine_id for row in drift])
+    rebuild_supplier_stats({row.supplier_id for row in drift if row.supplier_id is not None}, conn)
+    # Medicines already loaded in this session still hold the old quantity
+    db.session.expire_all()
+
+def take_stock_snapshot(taken_at=None):
+    """Record the current quantity of every medicine in one INSERT ... SELECT."""
+    taken_at = taken_at or datetime.utcnow()
+    snapshot = db.select(
+        Medicine.id,
+        db.literal(taken_at, db.DateTime),
+        Medicine.quantity
+    )
+    result = db.session.execute(
+        StockSnapshot.__table__.insert().from_select(['medicine_id', 'taken_at', 'quantity'], snapshot)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def existed_at(as_of):
+    """Condition on Medicine: it had been added by ``as_of``."""
+    return (Medicine.created_at <= as_of) | (Medicine.created_at.is_(None))
+
+def stock_as_of(as_of):
+    """Quantity of every medicine at ``as_of`` as ``{medicine_id: quantity}``.
+
+    Uses the latest snapshot at or before ``as_of`` plus the ledger movements
+    between that snapshot and ``as_of``. Medicines without such a snapshot are
+    rolled back from their current quantity instead.
+    """
+    latest = db.session.query(
+        StockSnapshot.medicine_id,
+        func.max(StockSnapshot.taken_at).label('taken_at')
+    ).filter(
+        StockSnapshot.taken_at <= as_of
+    ).group_by(StockSnapshot.medicine_id).subquery()
+
+    snapshots = dict(db.session.query(
+        StockSnapshot.medicine_id,
+        StockSnapshot.quantity
+    ).join(
+        latest,
+        (latest.c.medicine_id == StockSnapshot.medicine_id) & (latest.c.taken_at == StockSnapshot.taken_at)
+    ).all())
+
+    since_snapshot = dict(db.session.query(
+        StockMovement.medicine_id,
+        func.sum(StockMovement.quantity)
+    ).join(
+        latest, latest.c.medicine_id == StockMovement.medicine_id
+    ).filter(
+        StockMovement.created_at > latest.c.taken_at,
+        StockMovement.created_at <= as_of
+    ).group_by(StockMovement.medicine_id).all())
+
+    after_as_of = dict(db.session.query(
+        StockMovement.medicine_id,
+        func.sum(StockMovement.quantity)
+    ).filter(
+        StockMovement.created_at > as_of
+    ).group_by(StockMovement.medicine_id).all())
+
+    stock = {}
+    current = db.session.query(Medicine.id, Medicine.quantity).filter(existed_at(as_of))
+    for medicine_id, quantity in current:
+        if medicine_id in snapshots:
+            stock[medicine_id] = snapshots[medicine_id] + (since_snapshot.get(medicine_id) or 0)
+        else:
+            stock[medicine_id] = quantity - (after_as_of.get(medicine_id) or 0)
+    return stock
+
+# FIFO cost of goods: a sale takes its units out of the oldest purchase lots
+# with stock left and stores their cost on the sale line, so margin reports
+# sum stored rows instead of replaying the purchase and sales history.
+def open_lots(medicine_ids):
+    """Purchase lots with units left, oldest first, per medicine."""
+    lots = {}
+    if medicine_ids:
+        query = PurchaseItem.query.options(lazyload(PurchaseItem.medicine)).join(Purchase).filter(
+            PurchaseItem.medicine_id.in_(medicine_ids),
+            PurchaseItem.remaining_quantity > 0
+        ).order_by(Purchase.purchase_date, PurchaseItem.id)
+        for lot in query:
+            lots.setdefault(lot.medicine_id, []).append(lot)
+    return lots
+
+def consume_lots(lots, quantity):
+    """Take ``quantity`` units out of ``lots`` in order. Returns the cost of
+    the units taken and how many units no lot could cover."""
+    cost = 0.0
+    for lot in lots:
+        if quantity <= 0:
+            break
+        taken = min(lot.remaining_quantity, quantity)
+        lot.remaining_quantity -= taken
+        cost += taken * lot.unit_price
+        quantity -= taken
+    return cost, quantity
+
+def last_purchase_costs(medicine_ids):
+    """Unit price of the most recently recorded lot of each medicine."""
+    latest = db.select(func.max(PurchaseItem.id)).where(
+        PurchaseItem.medicine_id.in_(medicine_ids)).group_by(PurchaseItem.medicine_id)
+    return dict(db.session.execute(
+        db.select(PurchaseItem.medicine_id, PurchaseItem.unit_price).where(PurchaseItem.id.in_(latest))).all())
+
+def assign_sale_costs(sale_items):
+    """Cost new sale lines FIFO and take their units out of the lots. Units
+    no lot covers (stock added by manual adjustments) are costed at the last
+    purchase price and counted in ``unmatched_quantity``. Nothing is committed."""
+    lots = open_lots({item.medicine_id for item in sale_items})
+    for item in sale_items:
+        item.cost_amount, item.unmatched_quantity = consume_lots(lots.get(item.medicine_id, []), item.quantity)
+    short = {item.medicine_id for item in sale_items if item.unmatched_quantity}
+    if short:
+        fallback = last_purchase_costs(short)
+        for item in sale_items:
+            item.cost_amount += item.unmatched_quantity * fallback.get(item.medicine_id, 0.0)
+
+def release_lots(medicine_id, quantity):
+    """Stock written off or counted away leaves the oldest lots too."""
+    consume_lots(open_lots({medicine_id}).get(medicine_id, []), quantity)
+
+def release_lots_statement(removals):
+    """An UPDATE doing release_lots() in SQL for every medicine in
+    ``removals``, a subquery of ``(medicine_id, quantity)`` rows: each lot
+    gives up what the removal still needs after the older lots."""
+    lot, purchase = PurchaseItem.__table__, Purchase.__table__
+    older = func.coalesce(func.sum(lot.c.remaining_quantity).over(
+        partition_by=lot.c.medicine_id, order_by=(purchase.c.purchase_date, lot.c.id), rows=(None, -1)), 0)
+    needed = db.select(lot.c.id, lot.c.remaining_quantity.label('remaining'),
+                       (removals.c.quantity - older).label('wanted')) \
+        .join(purchase, purchase.c.id == lot.c.purchase_id) \
+        .join(removals, removals.c.medicine_id == lot.c.medicine_id) \
+        .where(lot.c.remaining_quantity > 0).subquery()
+    taken = db.select(db.case((needed.c.wanted >= needed.c.remaining, needed.c.remaining), else_=needed.c.wanted)) \
+        .where(needed.c.id == lot.c.id).scalar_subquery()
+    return lot.update().where(lot.c.id.in_(db.select(needed.c.id).where(needed.c.wanted > 0))) \
+        .values(remaining_quantity=lot.c.remaining_quantity - taken)
+
+def rebuild_sale_costs(chunk_size=1000):
+    """Replay the live sale lines and stock removals in date order against
+    the purchase lots, recomputing every line cost and lot balance. A lot is
+    only drawn from once its purchase date has passed. Archived sale lines
+    are replayed too, so their units stay out of the lots, but keep the cost
+    they were archived with. Used by backfill_costs.py for history recorded
+    before costing existed; returns the number of sale lines costed. The
+    caller commits.
+    """
+    upcoming = {}  # medicine_id -> lots not yet purchased at the replay time
+    lots = []
+    for row in db.session.execute(
+            db.select(PurchaseItem.id, PurchaseItem.medicine_id, PurchaseItem.quantity, PurchaseItem.unit_price,
+                      Purchase.purchase_date)
+            .join(Purchase, Purchase.id == PurchaseItem.purchase_id)
+            .order_by(Purchase.purchase_date, PurchaseItem.id)):
+        lot = SimpleNamespace(id=row.id, remaining_quantity=row.quantity, unit_price=row.unit_price,
+                              purchase_date=row.purchase_date)
+        upcoming.setdefault(row.medicine_id, deque()).append(lot)
+        lots.append(lot)
+    available = {}
+    last_cost = {}
+
+    def lots_on(medicine_id, day):
+        waiting = upcoming.get(medicine_id, ())
+        stocked = available.setdefault(medicine_id, deque())
+        while waiting and (day is None or waiting[0].purchase_date <= day):
+            lot = waiting.popleft()
+            stocked.append(lot)
+            last_cost[medicine_id] = lot.unit_price
+        while stocked and not stocked[0].remaining_quantity:
+            stocked.popleft()
+        return stocked
+
+    sale_lines = db.session.execute(
+        db.select(Sale.sale_date, SaleItem.id, SaleItem.medicine_id, SaleItem.quantity)
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .order_by(Sale.sale_date, SaleItem.id)
+    ).all()
+    removals = db.session.execute(
+        db.select(StockMovement.created_at, db.literal(None), StockMovement.medicine_id, -StockMovement.quantity)
+        .where(StockMovement.movement_type.in_(('adjustment', 'write-off')), StockMovement.quantity < 0)
+        .order_by(StockMovement.created_at, StockMovement.id)
+    ).all()
+    store = archive_store()
+    archived = [(when, None, medicine_id, quantity)
+                for year, _ in reversed(archived_years())
+                for when, medicine_id, quantity in store.sale_lines(year)]
+
+    item_table = SaleItem.__table__
+    update_items = item_table.update().where(item_table.c.id == bindparam('b_id')).values(
+        cost_amount=bindparam('b_cost'), unmatched_quantity=bindparam('b_unmatched'))
+    updates = []
+    costed = 0
+    for when, item_id, medicine_id, quantity in heapq.merge(
+            archived, sale_lines, removals, key=lambda event: event[0] or datetime.min):
+        cost, unmatched = consume_lots(lots_on(medicine_id, when.date() if when else None), quantity)
+        if item_id is None:
+            continue
+        if unmatched:
+            fallback = last_cost.get(medicine_id)
+            if fallback is None:
+                waiting = upcoming.get(medicine_id)
+                fallback = waiting[0].unit_price if waiting else 0.0
+            cost += unmatched * fallback
+        updates.append({'b_id': item_id, 'b_cost': cost, 'b_unmatched': unmatched})
+        if len(updates) >= chunk_size:
+            db.session.execute(update_items, updates)
+            costed += len(updates)
+            updates = []
+    if updates:
+        db.session.execute(update_items, updates)
+        costed += len(updates)
+
+    lot_table = PurchaseItem.__table__
+    for start in range(0, len(lots), chunk_size):
+        db.session.execute(
+            lot_table.update().where(lot_table.c.id == bindparam('b_id')).values(
+                remaining_quantity=bindparam('b_remaining')),
+            [{'b_id': lot.id, 'b_remaining': lot.remaining_quantity} for lot in lots[start:start + chunk_size]])
+    db.session.expire_all()
+    return costed
+
+# Supplier statistics
+def _supplier_key(value):
+    return int(value) if value not in (None, '') else None
+
+def _old_value(obj, attr):
+    """Value of ``attr`` before the pending changes of ``obj``."""
+    history = sa_inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+def _supplier_deltas(session):
+    deltas = {}
+
+    def add(supplier_id, **changes):
+        supplier_id = _supplier_key(supplier_id)
+        if supplier_id is None:
+            return
+        entry = deltas.setdefault(supplier_id, {'sku_count': 0, 'stock_value': 0.0,
+                                                'total_purchased': 0.0, 'outstanding_amount': 0.0})
+        for key, value in changes.items():
+            entry[key] += value
+
+    def medicine_value(quantity, price):
+        return (quantity or 0) * (price or 0)
+
+    def outstanding(status, amount):
+        return (amount or 0) if (status or 'Pending') == 'Pending' else 0
+
+    for obj in session.new:
+        if isinstance(obj, Medicine):
+            add(obj.supplier_id, sku_count=1, stock_value=medicine_value(obj.quantity, obj.price))
+        elif isinstance(obj, Purchase):
+            add(obj.supplier_id, total_purchased=obj.total_amount or 0,
+                outstanding_amount=outstanding(obj.payment_status, obj.total_amount))
+    for obj in session.dirty:
+        if isinstance(obj, Medicine) and session.is_modified(obj, include_collections=False):
+            add(_old_value(obj, 'supplier_id'), sku_count=-1,
+                stock_value=-medicine_value(_old_value(obj, 'quantity'), _old_value(obj, 'price')))
+            add(obj.supplier_id, sku_count=1, stock_value=medicine_value(obj.quantity, obj.price))
+        elif isinstance(obj, Purchase) and session.is_modified(obj, include_collections=False):
+            old_amount = _old_value(obj, 'total_amount')
+            add(_old_value(obj, 'supplier_id'), total_purchased=-(old_amount or 0),
+                outstanding_amount=-outstanding(_old_value(obj, 'payment_status'), old_amount))
+            add(obj.supplier_id, total_purchased=obj.total_amount or 0,
+                outstanding_amount=outstanding(obj.payment_status, obj.total_amount))
+    for obj in session.deleted:
+        if isinstance(obj, Medicine):
+            add(_old_value(obj, 'supplier_id'), sku_count=-1,
+                stock_value=-medicine_value(_old_value(obj, 'quantity'), _old_value(obj, 'price')))
+        elif isinstance(obj, Purchase):
+            old_amount = _old_value(obj, 'total_amount')
+            add(_old_value(obj, 'supplier_id'), total_purchased=-(old_amount or 0),
+                outstanding_amount=-outstanding(_old_value(obj, 'payment_status'), old_amount))
+    return {k: v for k, v in deltas.items() if any(v.values())}
+
+def rebuild_supplier_stats(supplier_ids=None, connection=None):
+    """Recompute supplier statistics from scratch with two grouped queries.
+
+    Used for suppliers without a stats row yet and after bulk SQL updates that
+    bypass the ORM. ``supplier_ids=None`` rebuilds every supplier.
+    """
+    conn = connection if connection is not None else db.session.connection()
+    medicine_query = db.select(
+        Medicine.supplier_id,
+        func.count(Medicine.id),
+        func.coalesce(func.sum(Medicine.quantity * Medicine.price), 0)
+    ).where(Medicine.supplier_id.isnot(None)).group_by(Medicine.supplier_id)
+    purchase_query = db.select(
+        Purchase.supplier_id,
+        func.coalesce(func.sum(Purchase.total_amount), 0),
+        func.coalesce(func.sum(db.case((Purchase.payment_status == 'Pending', Purchase.total_amount), else_=0)), 0)
+    ).group_by(Purchase.supplier_id)
+    supplier_query = db.select(Supplier.id)
+    if supplier_ids is not None:
+        supplier_ids = list(supplier_ids)
+        if not supplier_ids:
+            return
+        medicine_query = medicine_query.where(Medicine.supplier_id.in_(supplier_ids))
+        purchase_query = purchase_query.where(Purchase.supplier_id.in_(supplier_ids))
+        supplier_query = supplier_query.where(Supplier.id.in_(supplier_ids))
+
+    medicine_stats = {row[0]: row[1:] for row in conn.execute(medicine_query)}
+    purchase_stats = {row[0]: row[1:] for row in conn.execute(purchase_query)}
+    now = datetime.utcnow()
+    rows = []
+    for (supplier_id,) in conn.execute(supplier_query):
+        sku_count, stock_value = medicine_stats.get(supplier_id, (0, 0.0))
+        total_purchased, outstanding_amount = purchase_stats.get(supplier_id, (0.0, 0.0))
+        rows.append({'supplier_id': supplier_id, 'sku_count': sku_count, 'stock_value': stock_value,
+                     'total_purchased': total_purchased, 'outstanding_amount': outstanding_amount,
+                     'updated_at': now})
+
+    table = SupplierStats.__table__
+    delete = table.delete()
+    if supplier_ids is not None:
+        delete = delete.where(table.c.supplier_id.in_(supplier_ids))
+    conn.execute(delete)
+    if rows:
+        conn.execute(table.insert(), rows)
+
+def update_supplier_stats(session):
+    """Apply the flushed medicine/purchase changes to SupplierStats as deltas."""
+    deltas = _supplier_deltas(session)
+    if not deltas:
+        return
+    conn = session.connection()
+    table = SupplierStats.__table__
+    missing = []
+    for supplier_id, delta in deltas.items():
+        result = conn.execute(
+            table.update().where(table.c.supplier_id == supplier_id).values(
+                sku_count=table.c.sku_count + delta['sku_count'],
+                stock_value=table.c.stock_value + delta['stock_value'],
+                total_purchased=table.c.total_purchased + delta['total_purchased'],
+                outstanding_amount=table.c.outstanding_amount + delta['outstanding_amount'],
+                updated_at=datetime.utcnow()
+            )
+        )
+        if result.rowcount == 0:
+            missing.append(supplier_id)
+    # No row yet (e.g. data from before stats existed): the flush has already
+    # happened, so a full recompute includes the new changes.
+    if missing:
+        rebuild_supplier_stats(missing, connection=conn)
+
+def get_supplier_stats(supplier_id):
+    stats = db.session.get(SupplierStats, supplier_id)
+    if stats is None:
+        rebuild_supplier_stats([supplier_id])
+        db.session.commit()
+        stats = db.session.get(SupplierStats, supplier_id)
+    return stats
+
+# Customers
+def normalize_phone(raw):
+    """Digits-only phone number; Indian numbers lose their 0 / +91 prefix.
+    Returns None for values too short to identify a customer."""
+    digits = re.sub(r'\D', '', raw or '')
+    digits = digits.lstrip('0')
+    if len(digits) == 12 and digits.startswith('91'):
+        digits = digits[2:]
+    return digits if len(digits) >= 6 else None
+
+def get_or_create_customer(name, contact):
+    """Find the customer by normalized phone via the unique index, or create one."""
+    phone = normalize_phone(contact)
+    if not phone:
+        return None
+    customer = Customer.query.filter_by(phone=phone).first()
+    if customer:
+        return customer
+    try:
+        # Savepoint so a concurrent insert of the same phone doesn't abort the sale
+        with db.session.begin_nested():
+            customer = Customer(name=name or 'Customer', phone=phone)
+            db.session.add(customer)
+    except IntegrityError:
+        customer = Customer.query.filter_by(phone=phone).first()
+    return customer
+
+# Hot/cold sales partitioning
+_archive_stores = {}
+
+def archive_folder(code):
+    """Folder of the yearly sales archives of the branch ``code``."""
+    return os.path.join(app.config['ARCHIVE_FOLDER'], code)
+
+def archive_store():
+    """Yearly sales archives of the current branch."""
+    branch = g.get('branch') or app.config['DEFAULT_BRANCH']
+    if branch not in _archive_stores:
+        _archive_stores[branch] = sales_archive.ArchiveStore(archive_folder(branch))
+    return _archive_stores[branch]
+
+def archived_years(start=None, end=None):
+    """Archive years holding sales in [start, end], newest first. Empty when
+    the range only covers the live tables, so callers skip the archives."""
+    query = SaleArchive.query
+    if start is not None:
+        query = query.filter(SaleArchive.last_sale >= start)
+    if end is not None:
+        query = query.filter(SaleArchive.first_sale <= end)
+    return [(archive.year, archive.sale_count) for archive in query.order_by(SaleArchive.year.desc())]
+
+def archive_sales(older_than_days=None, chunk_size=500):
+    """Move sales older than ``older_than_days`` (default ARCHIVE_AFTER_DAYS)
+    from the live tables into the yearly archives, ``chunk_size`` sales per
+    transaction. Returns ``{year: sales moved}``.
+
+    Each chunk is written to its archive before it is deleted here; archive
+    inserts ignore rows already present, so an interrupted run is safely
+    repeated. The newest sale always stays live so SQLite never hands out
+    an archived sale id again. Years wholly before the cutoff are compressed.
+    """
+    if older_than_days is None:
+        older_than_days = app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    newest_id = db.session.query(func.max(Sale.id)).scalar()
+    if newest_id is None:
+        return {}
+    store = archive_store()
+    sale_table, item_table = Sale.__table__, SaleItem.__table__
+    moved = {}
+    while True:
+        sales = db.session.execute(
+            db.select(sale_table)
+            .where(sale_table.c.sale_date < cutoff, sale_table.c.id < newest_id)
+            .order_by(sale_table.c.sale_date)
+            .limit(chunk_size)
+        ).mappings().all()
+        if not sales:
+            break
+        sale_ids = [row['id'] for row in sales]
+        items = db.session.execute(
+            db.select(item_table, Medicine.name.label('medicine_name'))
+            .outerjoin(Medicine, Medicine.id == item_table.c.medicine_id)
+            .where(item_table.c.sale_id.in_(sale_ids))
+        ).mappings().all()
+
+        item_counts = {}
+        for item in items:
+            item_counts[item['sale_id']] = item_counts.get(item['sale_id'], 0) + item['quantity']
+        by_year = {}
+        for row in sales:
+            by_year.setdefault(row['sale_date'].year, []).append(
+                dict(row, item_count=item_counts.get(row['id'], 0)))
+        year_of = {row['id']: row['sale_date'].year for row in sales}
+        for year, year_sales in by_year.items():
+            store.write(year, year_sales, [
+                {column.name: item[column.name] for column in sales_archive.sale_item.columns}
+                for item in items if year_of[item['sale_id']] == year
+            ])
+            archive = db.session.get(SaleArchive, year)
+            first_sale = min(row['sale_date'] for row in year_sales)
+            last_sale = max(row['sale_date'] for row in year_sales)
+            if archive is None:
+                archive = SaleArchive(year=year, first_sale=first_sale, last_sale=last_sale, sale_count=0)
+                db.session.add(archive)
+            archive.first_sale = min(archive.first_sale, first_sale)
+            archive.last_sale = max(archive.last_sale, last_sale)
+            archive.sale_count += len(year_sales)
+            archive.archived_at = datetime.utcnow()
+            moved[year] = moved.get(year, 0) + len(year_sales)
+
+        db.session.execute(item_table.delete().where(item_table.c.sale_id.in_(sale_ids)))
+        mark_dashboard_stale()
+        invalidate_cache('sales')
+        db.session.execute(sale_table.delete().where(sale_table.c.id.in_(sale_ids)))
+        db.session.commit()
+
+    # Years before the cutoff's can no longer receive sales: they are gzipped
+    # (a backdated sale archived later reopens its year)
+    for year in moved:
+        if year >= cutoff.year:
+            store.compact(year)
+    for year, _ in archived_years():
+        if year < cutoff.year and not store.compressed(year):
+            store.compress(year)
+    return moved
+
+def find_sale(id):
+    """A live sale, or the archived copy when it has been moved out."""
+    sale = db.session.get(Sale, id, options=[selectinload(Sale.items)])
+    if sale is None:
+        store = archive_store()
+        for year, _ in archived_years():
+            sale = store.get(year, id)
+            if sale is not None:
+                break
+    return sale
+
+class SalesPagination(Pagination):
+    """Live sales followed by the matching archived ones, newest first.
+    Archives only hold sales older than every live one, so paging through
+    the live query first keeps the order; archive files are only opened once
+    a page reaches past the live rows."""
+
+    def _archive_counts(self):
+        if 'archive_counts' not in self._query_args:
+            filters = self._query_args['filters']
+            store = archive_store()
+            self._query_args['archive_counts'] = [
+                (year, store.count(year, **filters) if any(v is not None for v in filters.values()) else count)
+                for year, count in self._query_args['archives']
+            ]
+        return self._query_args['archive_counts']
+
+    def _live_count(self):
+        if 'live_count' not in self._query_args:
+            self._query_args['live_count'] = self._query_args['query'].order_by(None).count()
+        return self._query_args['live_count']
+
+    def _query_items(self):
+        offset = self._query_offset
+        items = []
+        if offset < self._live_count():
+            items = self._query_args['query'].limit(self.per_page).offset(offset).all()
+        offset = max(0, offset - self._live_count())
+        for year, count in self._archive_counts() if len(items) < self.per_page else ():
+            if offset >= count:
+                offset -= count
+                continue
+            items.extend(archive_store().sales(year, offset=offset, limit=self.per_page - len(items),
+                                               with_items=True, **self._query_args['filters']))
+            offset = 0
+            if len(items) >= self.per_page:
+                break
+        return items
+
+    def _query_count(self):
+        return self._live_count() + sum(count for _, count in self._archive_counts())
+
+# Read-only records for pages that only print medicines
+class MedicineRecord:
+    """Read-only stand-in for a Medicine holding the columns a page selected
+    (the others are None). Rows are plain column values, so they never enter
+    the session's identity map or change tracking."""
+    __slots__ = ('id', 'name', 'description', 'batch_number', 'quantity', 'price', 'expiry_date',
+                 'image_thumb', 'supplier_name')
+
+    def __init__(self, row):
+        get = row._mapping.get
+        self.id, self.name, self.description = get('id'), get('name'), get('description')
+        self.batch_number, self.quantity, self.price = get('batch_number'), get('quantity'), get('price')
+        self.expiry_date, self.image_thumb = get('expiry_date'), get('image_thumb')
+        self.supplier_name = get('supplier_name')
+
+    @property
+    def supplier_ref(self):
+        # Same shape as Medicine.supplier_ref for the templates
+        return SimpleNamespace(name=self.supplier_name) if self.supplier_name is not None else None
+
+def medicine_select(*fields):
+    """A select of the MedicineRecord ``fields``; asking for ``supplier_name``
+    outer-joins the supplier."""
+    columns = [Supplier.name.label('supplier_name') if field == 'supplier_name' else getattr(Medicine, field)
+               for field in fields]
+    statement = db.select(*columns).select_from(Medicine)
+    if 'supplier_name' in fields:
+        statement = statement.outerjoin(Supplier, Supplier.id == Medicine.supplier_id)
+    return statement
+
+def medicine_records(statement):
+    """MedicineRecords for a ``medicine_select`` statement, fetched in
+    batches so long exports can stream them."""
+    for row in db.session.execute(statement.execution_options(yield_per=1000)):
+        yield MedicineRecord(row)
+
+class RecordPagination(Pagination):
+    """Pagination over a ``medicine_select`` statement."""
+
+    def _query_items(self):
+        statement = self._query_args['select'].limit(self.per_page).offset(self._query_offset)
+        return [MedicineRecord(row) for row in db.session.execute(statement)]
+
+    def _query_count(self):
+        counted = self._query_args['select'].order_by(None).subquery()
+        return db.session.execute(db.select(func.count()).select_from(counted)).scalar()
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# Reporting engine: heavy reads kept off the checkout write path
+_reporting_engines = {}
+_replica_lag = {}
+
+def reporting_engine(branch):
+    """Engine for reporting reads on ``branch`` (None = default branch).
+
+    A configured replica URL is used as is. Otherwise a SQLite database is
+    switched to WAL mode and opened a second time read-only, so report
+    queries read a consistent snapshot without blocking sales writes. Other
+    databases without a replica return None (reports use the primary).
+    """
+    if branch not in _reporting_engines:
+        code = branch or app.config['DEFAULT_BRANCH']
+        primary = db.engines[branch]
+        replica_uri = app.config['BRANCHES'].get(code, {}).get('reporting_uri')
+        engine = None
+        if replica_uri:
+            engine = db.create_engine(replica_uri)
+        elif primary.url.get_backend_name() == 'sqlite' and primary.url.database not in (None, '', ':memory:'):
+            path = primary.url.database
+            if app.config['REPORTING_SQLITE_WAL']:
+                with primary.connect() as conn:
+                    conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+            engine = db.create_engine(f'sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true')
+        _reporting_engines[branch] = engine
+    return _reporting_engines[branch]
+
+def replica_lag(branch):
+    """Seconds the reporting replica is behind the primary, measured on the
+    newest catalog change (every sale and stock edit writes one) and cached
+    for REPORTING_LAG_CHECK_INTERVAL seconds."""
+    checked_at, lag = _replica_lag.get(branch, (None, 0.0))
+    now = datetime.utcnow()
+    if checked_at is None or (now - checked_at).total_seconds() >= app.config['REPORTING_LAG_CHECK_INTERVAL']:
+        newest = db.select(func.max(CatalogChange.changed_at))
+        with db.engines[branch].connect() as conn:
+            primary = conn.execute(newest).scalar()
+        with reporting_engine(branch).connect() as conn:
+            replica = conn.execute(newest).scalar()
+        lag = (primary - (replica or datetime.min)).total_seconds() if primary else 0.0
+        _replica_lag[branch] = (now, max(lag, 0.0))
+    return _replica_lag[branch][1]
+
+def fresh_reporting_engine(branch):
+    """The reporting engine, or None when reads should stay on the primary:
+    there is none, or the replica lags more than REPORTING_MAX_STALENESS."""
+    engine = reporting_engine(branch)
+    max_staleness = app.config['REPORTING_MAX_STALENESS']
+    code = branch or app.config['DEFAULT_BRANCH']
+    if engine is not None and app.config['BRANCHES'].get(code, {}).get('reporting_uri') \
+            and max_staleness is not None and replica_lag(branch) > max_staleness:
+        return None
+    return engine
+
+def request_reporting_engine():
+    # Decided once per request so a report never mixes replica and primary reads
+    if 'reporting_engine' not in g:
+        g.reporting_engine = fresh_reporting_engine(g.get('branch'))
+    return g.reporting_engine
+
+def reporting_route(view):
+    """Serve a read-only view's queries from the reporting engine."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.reporting = True
+        return view(*args, **kwargs)
+    return wrapper
+
+# Branch binding
+def branch_database_url(code):
+    """Fully resolved database URL for a branch (relative SQLite paths are
+    resolved against the instance folder, as Flask-SQLAlchemy does)."""
+    engine = db.engines[None if code == app.config['DEFAULT_BRANCH'] else code]
+    return engine.url.render_as_string(hide_password=False)
+
+def branch_database_path(code):
+    """Path of a branch's SQLite file (backups only support SQLite)."""
+    url = db.engines[None if code == app.config['DEFAULT_BRANCH'] else code].url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise backups.BackupError(f'{code}: only file-based SQLite databases can be backed up')
+    return url.database
+
+def backup_branch(code):
+    """Take a verified online snapshot of a branch database and apply the
+    retention policy. Returns ``(snapshot path, pruned paths)``."""
+    folder = os.path.join(app.config['BACKUP_FOLDER'], code)
+    path = backups.backup_database(branch_database_path(code), folder, code,
+                                   pages=app.config['BACKUP_PAGES_PER_STEP'])
+    return path, backups.prune_backups(folder, code, app.config['BACKUP_RETENTION'])
+
+def restore_branch(code, backup_path):
+    """Restore a branch database from a snapshot, after snapshotting the
+    current state so the restore itself can be undone."""
+    backups.verify_backup(backup_path)
+    safety = backups.backup_database(branch_database_path(code),
+                                     os.path.join(app.config['BACKUP_FOLDER'], code), code + '-pre-restore')
+    backups.restore_backup(backup_path, branch_database_path(code), pages=app.config['BACKUP_PAGES_PER_STEP'])
+    app_cache().bump(*cache_namespaces('catalog', 'sales', branch=code))
+    return safety
+
+API_PREFIX = '/api/v1/'
+
+@app.before_request
+def bind_branch():
+    branches = app.config['BRANCHES']
+    if request.path.startswith(API_PREFIX):
+        # API clients pick the branch per request and never get a session cookie
+        branch = request.headers.get('X-Branch') or app.config['DEFAULT_BRANCH']
+        if branch not in branches:
+            return jsonify({'error': f'Unknown branch: {branch}'}), 400
+        g.branch = None if branch == app.config['DEFAULT_BRANCH'] else branch
+        g.branch_code = branch
+        return
+    requested = request.args.get('branch')
+    if requested in branches:
+        session['branch'] = requested
+    branch = session.get('branch', app.config['DEFAULT_BRANCH'])
+    if branch not in branches:
+        branch = app.config['DEFAULT_BRANCH']
+    g.branch = None if branch == app.config['DEFAULT_BRANCH'] else branch
+    g.branch_code = branch
+
+def upgrade_schema(engine):
+    """Create missing tables, then add the columns and indexes that models
+    gained after the database was created. New columns on existing tables
+    must be nullable, since SQLite cannot add NOT NULL columns without a default.
+    """
+    db.metadata.create_all(bind=engine)
+    inspector = sa_inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {ddl}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+# Schema changes made after a database was first created (e.g. the tracked
+# SQLite file or a new branch) are applied on the first request that uses it.
+_schema_ready = set()
+
+@app.before_request
+def ensure_schema():
+    if g.branch not in _schema_ready:
+        upgrade_schema(db.engines[g.branch])
+        # Warm the scanner index while we're here, before the first scan
+        barcode_index().refresh()
+        _schema_ready.add(g.branch)
+
+# On-demand profiling, switched on from the admin profiler page
+PROFILER_DEFAULTS = {'endpoints': [], 'sample_percent': 0.0, 'mode': 'cprofile'}
+_profiler_settings = {'mtime': None, 'settings': PROFILER_DEFAULTS}
+
+def profiler_settings():
+    """Profiler settings from PROFILE_FOLDER/settings.json, re-read when the
+    file changes so every worker process follows the admin page."""
+    path = os.path.join(app.config['PROFILE_FOLDER'], 'settings.json')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return PROFILER_DEFAULTS
+    if mtime != _profiler_settings['mtime']:
+        try:
+            with open(path) as f:
+                settings = dict(PROFILER_DEFAULTS, **json.load(f))
+        except (OSError, ValueError):
+            settings = PROFILER_DEFAULTS
+        _profiler_settings.update(mtime=mtime, settings=settings)
+    return _profiler_settings['settings']
+
+def save_profiler_settings(settings):
+    folder = app.config['PROFILE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    partial = os.path.join(folder, 'settings.json.partial')
+    with open(partial, 'w') as f:
+        json.dump(settings, f)
+    os.replace(partial, os.path.join(folder, 'settings.json'))
+
+def should_profile():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == 'static' or endpoint.startswith('profiler'):
+        return False
+    settings = profiler_settings()
+    if endpoint in settings['endpoints']:
+        return True
+    if settings['sample_percent'] and random.random() * 100 < settings['sample_percent']:
+        return True
+    # Admins can profile a single request by adding ?_profile=1
+    return bool(request.args.get('_profile')) and current_user.is_authenticated and current_user.is_admin
+
+@app.before_request
+def start_profiler():
+    if should_profile():
+        g.profiler = profiler.RequestProfiler(profiler_settings()['mode'],
+                                              interval=app.config['PROFILE_SAMPLING_INTERVAL'])
+        g.profiler.start()
+
+def _save_profile(request_profiler, details):
+    request_profiler.stop()
+    request_profiler.save(app.config['PROFILE_FOLDER'], **details)
+    profiler.prune_profiles(app.config['PROFILE_FOLDER'], app.config['PROFILE_RETENTION'])
+
+@app.after_request
+def finish_profiler(response):
+    request_profiler = g.pop('profiler', None)
+    if request_profiler is not None:
+        details = {'method': request.method, 'path': request.full_path.rstrip('?'),
+                   'endpoint': request.endpoint, 'status': response.status_code, 'branch': g.get('branch_code')}
+        if response.is_streamed:
+            # Streamed bodies are produced after this hook; stop once sent
+            response.call_on_close(lambda: _save_profile(request_profiler, details))
+        else:
+            _save_profile(request_profiler, details)
+    return response
+
+@app.teardown_request
+def abandon_profiler(exc):
+    # The request failed before after_request; keep what was measured
+    request_profiler = g.pop('profiler', None)
+    if request_profiler is not None:
+        _save_profile(request_profiler, {'method': request.method, 'path': request.full_path.rstrip('?'),
+                                         'endpoint': request.endpoint, 'status': 500,
+                                         'branch': g.get('branch_code')})
+
+@app.context_processor
+def inject_branches():
+    return {
+        'branches': app.config['BRANCHES'],
+        'current_branch': g.get('branch_code', app.config['DEFAULT_BRANCH']),
+    }
+
 # Routes
 @app.route('/')
 def index():
@@ -130,15 +1425,181 @@ def login():
 
 @app.route('/dashboard')
 @login_required
+@reporting_route
 def dashboard():
-    total_medicines = Medicine.query.count()
-    total_sales = db.session.query(db.func.sum(Sale.total_amount)).scalar() or 0
-    low_stock_medicines = Medicine.query.filter(Medicine.quantity < 10).count()
-    
+    threshold = app.config['LOW_STOCK_THRESHOLD']
+    kpis = app_cache().cached(cache_namespaces('catalog', 'sales'), f'dashboard:{threshold}',
+                              lambda: dict(feed_version=dashboard_version(), **dashboard_kpis(threshold)))
     return render_template('dashboard.html', 
-                         total_medicines=total_medicines,
-                         total_sales=total_sales,
-                         low_stock_medicines=low_stock_medicines)
+                         **kpis,
+                         low_stock_threshold=threshold)
+
+DASHBOARD_FIGURES = ('total_medicines', 'total_sales', 'low_stock_medicines')
+
+def dashboard_kpi_selects(threshold):
+    """The dashboard figures (single values) and lists as statements, shared
+    with the async lookups."""
+    return {
+        'total_medicines': db.select(func.count(Medicine.id)),
+        'total_sales': db.select(func.coalesce(func.sum(Sale.total_amount), 0)),
+        'low_stock_medicines': db.select(func.count(Medicine.id)).where(Medicine.quantity < threshold),
+        'low_stock_items': db.select(Medicine.id, Medicine.name, Medicine.quantity)
+            .where(Medicine.quantity < threshold).order_by(Medicine.quantity).limit(10),
+        'recent_sales': db.select(Sale.id, Sale.invoice_number, Sale.customer_name, Sale.total_amount,
+                                  Sale.sale_date).order_by(Sale.sale_date.desc()).limit(5),
+    }
+
+def dashboard_kpis(threshold):
+    """Dashboard figures as plain data, so they can be cached."""
+    kpis = {}
+    for name, statement in dashboard_kpi_selects(threshold).items():
+        result = db.session.execute(statement)
+        kpis[name] = result.scalar() if name in DASHBOARD_FIGURES else \
+            [SimpleNamespace(**row._mapping) for row in result]
+    return kpis
+
+# Live dashboard: each committed transaction that changes a dashboard figure
+# logs one KPI delta, which open dashboards receive from the stream
+def dashboard_version():
+    """Id of the newest logged dashboard event of the branch. Read before
+    the figures, so the stream resends nothing the page already counts."""
+    return db.session.query(func.coalesce(func.max(DashboardEvent.id), 0)).scalar()
+
+def dashboard_events_select(since, limit):
+    """The stream's catch-up query: logged events after ``since``, plus the
+    oldest id still retained and the newest one. Shared with asgi.py."""
+    return (db.select(DashboardEvent.id, DashboardEvent.event, DashboardEvent.data)
+            .where(DashboardEvent.id > since).order_by(DashboardEvent.id).limit(limit),
+            db.select(func.min(DashboardEvent.id), func.max(DashboardEvent.id)))
+
+def dashboard_catch_up(since, rows, bounds):
+    """SSE messages for the logged events after ``since``, or None when the
+    page must reload instead: events it missed were pruned, there are more
+    than DASHBOARD_QUEUE_SIZE of them, or the log is behind its version
+    (the database was restored)."""
+    oldest, newest = bounds
+    if since > (newest or 0) or (oldest is not None and since < oldest - 1) or \
+            len(rows) > app.config['DASHBOARD_QUEUE_SIZE']:
+        return None
+    return [dashboard_message(*row) for row in rows]
+
+def dashboard_message(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+def mark_dashboard_stale():
+    """Bulk SQL writes bypass the flush hook; open dashboards reload after
+    the transaction commits."""
+    if has_app_context():
+        db.session.info['dashboard_stale'] = True
+
+def _empty_dashboard_delta():
+    return {'sales_total': 0.0, 'medicines': 0, 'low_stock': 0, 'sales': [], 'low_items': {}, 'restocked': set()}
+
+@event.listens_for(BranchSession, 'after_flush')
+def collect_dashboard_delta(session, flush_context):
+    threshold = app.config['LOW_STOCK_THRESHOLD']
+    delta = session.info.setdefault('dashboard_delta', _empty_dashboard_delta())
+
+    def low(medicine, quantity):
+        delta['low_items'][medicine.id] = {'id': medicine.id, 'name': medicine.name, 'quantity': quantity}
+        delta['restocked'].discard(medicine.id)
+
+    def restocked(medicine_id):
+        delta['low_items'].pop(medicine_id, None)
+        delta['restocked'].add(medicine_id)
+
+    for obj in session.new:
+        if isinstance(obj, Sale):
+            delta['sales_total'] += obj.total_amount or 0
+            delta['sales'].append({'id': obj.id, 'invoice_number': obj.invoice_number,
+                                   'customer_name': obj.customer_name, 'total_amount': obj.total_amount,
+                                   'sale_date': (obj.sale_date or datetime.utcnow()).strftime('%Y-%m-%d %H:%M')})
+        elif isinstance(obj, Medicine):
+            delta['medicines'] += 1
+            if obj.quantity < threshold:
+                delta['low_stock'] += 1
+                low(obj, obj.quantity)
+    for obj in session.dirty:
+        if isinstance(obj, Medicine) and sa_inspect(obj).attrs.quantity.history.has_changes():
+            was_low = _old_value(obj, 'quantity') < threshold
+            if obj.quantity < threshold:
+                delta['low_stock'] += not was_low
+                low(obj, obj.quantity)
+            elif was_low:
+                delta['low_stock'] -= 1
+                restocked(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Sale):
+            delta['sales_total'] -= _old_value(obj, 'total_amount') or 0
+        elif isinstance(obj, Medicine):
+            delta['medicines'] -= 1
+            if _old_value(obj, 'quantity') < threshold:
+                delta['low_stock'] -= 1
+                restocked(obj.id)
+
+# A savepoint that rolls back takes its part of the delta with it
+@event.listens_for(BranchSession, 'after_transaction_create')
+def snapshot_dashboard_delta(session, transaction):
+    if transaction.nested:
+        session.info.setdefault('dashboard_savepoints', {})[transaction] = (
+            copy.deepcopy(session.info.get('dashboard_delta')), session.info.get('dashboard_stale', False))
+
+@event.listens_for(BranchSession, 'after_soft_rollback')
+def discard_dashboard_delta(session, previous_transaction):
+    if previous_transaction.nested:
+        delta, stale = session.info.get('dashboard_savepoints', {}).pop(previous_transaction, (None, False))
+        session.info.pop('dashboard_delta', None)
+        if delta is not None:
+            session.info['dashboard_delta'] = delta
+        session.info['dashboard_stale'] = stale
+        return
+    for key in ('dashboard_delta', 'dashboard_stale', 'dashboard_savepoints'):
+        session.info.pop(key, None)
+
+@event.listens_for(BranchSession, 'after_transaction_end')
+def drop_dashboard_snapshot(session, transaction):
+    if transaction.nested:
+        session.info.get('dashboard_savepoints', {}).pop(transaction, None)
+
+@event.listens_for(BranchSession, 'before_commit')
+def log_dashboard_delta(session):
+    if session.in_nested_transaction():
+        return  # logged with the outer transaction
+    session.flush()  # the commit's own flush belongs to this delta
+    delta = session.info.pop('dashboard_delta', None)
+    stale = session.info.pop('dashboard_stale', False)
+    if stale:
+        event_name, data = 'reload', {}
+    elif delta and (delta['sales'] or delta['sales_total'] or delta['medicines'] or delta['low_stock']
+                    or delta['low_items'] or delta['restocked']):
+        event_name, data = 'delta', dict(delta, low_items=list(delta['low_items'].values()),
+                                         restocked=sorted(delta['restocked']))
+    else:
+        return
+    conn = session.connection()
+    event_id = conn.execute(DashboardEvent.__table__.insert(), {
+        'event': event_name, 'data': json.dumps(data), 'created_at': datetime.utcnow()}).inserted_primary_key[0]
+    if event_id % 100 == 0:
+        conn.execute(DashboardEvent.__table__.delete().where(
+            DashboardEvent.id <= event_id - app.config['DASHBOARD_EVENT_RETENTION']))
+
+@app.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """Server-Sent Events for the dashboard page, without holding a thread.
+
+    Served this way the response carries the events logged since the
+    browser's last one and ends; EventSource comes back with Last-Event-ID
+    after DASHBOARD_POLL_SECONDS. Behind asgi.py the same URL is a
+    long-lived stream kept on the event loop instead.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since', '0')
+    since = int(since) if since.isdigit() else -1
+    events, bounds = dashboard_events_select(since, app.config['DASHBOARD_QUEUE_SIZE'] + 1)
+    messages = dashboard_catch_up(since, db.session.execute(events).all(), db.session.execute(bounds).one())
+    body = f'retry: {int(app.config["DASHBOARD_POLL_SECONDS"] * 1000)}\n\n'
+    body += 'event: reload\ndata: {}\n\n' if messages is None else ''.join(messages)
+    return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/medicines')
 @login_required
@@ -146,18 +1607,291 @@ def medicines():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
     per_page = 10
+    filters = medicine_filters(request.args)
+    sort = request.args.get('sort', 'name')
+    if sort not in MEDICINE_SORTS:
+        sort = 'name'
+    descending = request.args.get('dir') == 'desc'
     
-    query = Medicine.query
-    
+    conditions = medicine_conditions(filters)
+    total, facets = medicine_facets(filters)
+    order = MEDICINE_SORTS[sort].desc() if descending else MEDICINE_SORTS[sort]
+    query = Medicine.query.filter(*[condition for parts in conditions.values() for condition in parts])
+    # The facet query already counted the matches
+    medicines_pagination = query.order_by(order, Medicine.id).paginate(page=page, per_page=per_page,
+                                                                       error_out=False, count=False)
+    medicines_pagination.total = total
+
+    def link(**changes):
+        """This list's URL with some arguments changed (None removes one)."""
+        args = {key: [value for value in request.args.getlist(key) if value] for key in MEDICINE_FILTER_ARGS}
+        args.update(sort=sort, dir='desc' if descending else None)
+        args.update(changes)
+        return url_for('medicines', **{key: value for key, value in args.items() if value not in (None, '', [])})
+
+    return render_template('medicines.html', medicines=medicines_pagination, search=search, filters=filters,
+                           facets=facets, sort=sort, descending=descending, link=link,
+                           supplier_values=['none' if value is None else str(value) for value in filters['supplier']])
+
+# Medicine list filters. Supplier, stock, expiry and price are facets: the
+# list shows how many medicines each choice would match, counted for all
+# facets in one grouped query.
+MEDICINE_SORTS = {'id': Medicine.id, 'name': Medicine.name, 'quantity': Medicine.quantity,
+                  'price': Medicine.price, 'expiry_date': Medicine.expiry_date}
+MEDICINE_FILTER_ARGS = ('search', 'supplier', 'stock_min', 'stock_max', 'expiry_from', 'expiry_to',
+                        'price_min', 'price_max', 'batch')
+STOCK_BANDS = [('Out of stock', 0, 0), ('1 to 19', 1, 19), ('20 to 99', 20, 99), ('100 or more', 100, None)]
+PRICE_BANDS = [('Under ₹50', None, 49.99), ('₹50 to ₹199.99', 50, 199.99), ('₹200 to ₹499.99', 200, 499.99),
+               ('₹500 or more', 500, None)]
+
+def medicine_filters(args):
+    """Filter values from the query string; values that do not parse are ignored."""
+    def parsed(name, parse):
+        value = args.get(name, '').strip()
+        try:
+            return parse(value) if value else None
+        except ValueError:
+            return None
+
+    def day(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    suppliers = [None if value == 'none' else int(value) for value in args.getlist('supplier')
+                 if value == 'none' or value.isdigit()]
+    return {
+        'search': args.get('search', '').strip(),
+        'supplier': suppliers,
+        'stock_min': parsed('stock_min', int),
+        'stock_max': parsed('stock_max', int),
+        'expiry_from': parsed('expiry_from', day),
+        'expiry_to': parsed('expiry_to', day),
+        'price_min': parsed('price_min', float),
+        'price_max': parsed('price_max', float),
+        'batch': args.get('batch', '').strip(),
+    }
+
+def _between(column, low, high):
+    return ([column >= low] if low is not None else []) + ([column <= high] if high is not None else [])
+
+def medicine_conditions(filters, columns=Medicine):
+    """``{facet: [conditions]}`` for the filters that are set. 'search' and
+    'batch' narrow every count; the others are facets. ``columns`` may be a
+    CTE's columns instead of the Medicine table."""
+    conditions = {}
+    search = filters['search']
     if search:
-        query = query.filter(
-            (Medicine.name.ilike(f'%{search}%')) |
-            (Medicine.description.ilike(f'%{search}%')) |
-            (Medicine.id == search)
-        )
-    
-    medicines_pagination = query.order_by(Medicine.name).paginate(page=page, per_page=per_page, error_out=False)
-    return render_template('medicines.html', medicines=medicines_pagination, search=search)
+        conditions['search'] = [(columns.name.ilike(f'%{search}%')) |
+                                (columns.description.ilike(f'%{search}%')) |
+                                (columns.id == search)]
+    if filters['batch']:
+        conditions['batch'] = [columns.batch_number.like(filters['batch'] + '%')]
+    if filters['supplier']:
+        ids = [supplier_id for supplier_id in filters['supplier'] if supplier_id is not None]
+        condition = columns.supplier_id.in_(ids)
+        if None in filters['supplier']:
+            condition = condition | columns.supplier_id.is_(None)
+        conditions['supplier'] = [condition]
+    for facet, column, low, high in (('stock', columns.quantity, 'stock_min', 'stock_max'),
+                                     ('expiry', columns.expiry_date, 'expiry_from', 'expiry_to'),
+                                     ('price', columns.price, 'price_min', 'price_max')):
+        if filters[low] is not None or filters[high] is not None:
+            conditions[facet] = _between(column, filters[low], filters[high])
+    return conditions
+
+def medicine_facet_bands(columns=Medicine):
+    """``{facet: [(label, query args, conditions)]}`` for the range facets."""
+    today = datetime.utcnow().date()
+    expiry = [('Expired', None, today - timedelta(days=1)),
+              ('Within 30 days', today, today + timedelta(days=30)),
+              ('In 31 to 90 days', today + timedelta(days=31), today + timedelta(days=90)),
+              ('Later', today + timedelta(days=91), None)]
+    return {
+        'stock': [(label, {'stock_min': low, 'stock_max': high}, _between(columns.quantity, low, high))
+                  for label, low, high in STOCK_BANDS],
+        'expiry': [(label, {'expiry_from': low and low.strftime('%Y-%m-%d'),
+                            'expiry_to': high and high.strftime('%Y-%m-%d')},
+                    _between(columns.expiry_date, low, high)) for label, low, high in expiry],
+        'price': [(label, {'price_min': low, 'price_max': high}, _between(columns.price, low, high))
+                  for label, low, high in PRICE_BANDS],
+    }
+
+def medicine_facets(filters):
+    """Number of matches and the facet counts, in one statement.
+
+    Each facet's counts apply every filter except that facet's own, so they
+    show what picking another value would return. The statement is a UNION
+    ALL of plain counts (one grouped by supplier, one per band), each a
+    range that SQLite answers from the medicine indexes; computing bands
+    with CASE in a single scan is several times slower. Text and batch
+    filters, which no index serves, are applied once in a CTE that the
+    counts read instead of the table. Returns
+    ``(total, {'supplier': [(id, name, count)], 'stock': [(label, args, count)], ...})``.
+    """
+    source = Medicine.__table__
+    text_filters = [condition for name, parts in medicine_conditions(filters).items()
+                    if name in ('search', 'batch') for condition in parts]
+    if text_filters:
+        source = db.select(Medicine.id, Medicine.supplier_id, Medicine.quantity, Medicine.expiry_date,
+                           Medicine.price).where(*text_filters).cte('matches')
+    conditions = medicine_conditions(dict(filters, search='', batch=''), source.c)
+
+    def others(facet):
+        return [condition for name, parts in conditions.items() if name != facet for condition in parts]
+
+    def band_count(facet, key, band=()):
+        return db.select(db.literal(facet), db.literal(key, db.Integer), db.literal(None, db.String),
+                         func.count()).select_from(source).where(*others(facet), *band)
+
+    bands = medicine_facet_bands(source.c)
+    by_supplier = db.select(source.c.supplier_id, func.count().label('matches')).where(
+        *others('supplier')).group_by(source.c.supplier_id).subquery()
+    branches = [
+        band_count('total', None),
+        db.select(db.literal('supplier'), by_supplier.c.supplier_id, Supplier.name, by_supplier.c.matches)
+        .select_from(by_supplier.outerjoin(Supplier, Supplier.id == by_supplier.c.supplier_id)),
+    ]
+    for facet, entries in bands.items():
+        branches += [band_count(facet, n, band) for n, (_, _, band) in enumerate(entries)]
+    counts = {}
+    suppliers = []
+    for facet, key, name, matches in db.session.execute(db.union_all(*branches)):
+        if facet == 'supplier':
+            suppliers.append((key, name or 'No supplier', matches))
+        else:
+            counts[facet, key] = matches
+
+    result = {'supplier': sorted(suppliers, key=lambda entry: (entry[0] is None, entry[1].lower()))}
+    for facet, entries in bands.items():
+        result[facet] = [(label, {key: value for key, value in args.items() if value is not None},
+                          counts.get((facet, n), 0))
+                         for n, (label, args, _) in enumerate(entries)]
+    return counts.get(('total', None), 0), result
+
+# Medicine images. The request only checks and stores the upload; resizing
+# runs in images.py's process pool, driven by one thread that records the
+# variants when they are ready, so a large photo never holds up the request.
+_image_renderer = ThreadPoolExecutor(1, thread_name_prefix='image-renderer')
+
+def image_originals():
+    return images.ContentStore(app.config['IMAGE_ORIGINALS_FOLDER'])
+
+def image_variants():
+    return images.ContentStore(app.config['UPLOAD_FOLDER'], '.jpg')
+
+def allowed_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+def read_image_upload(upload):
+    """The bytes of an uploaded image; raises images.ImageError for files
+    that are not an allowed, readable image of acceptable size."""
+    if not images.available():
+        raise images.ImageError('Image uploads need Pillow installed')
+    if not allowed_image(upload.filename):
+        raise images.ImageError(f'Images must be {", ".join(sorted(app.config["ALLOWED_EXTENSIONS"]))} files')
+    data = upload.read(app.config['IMAGE_MAX_BYTES'] + 1)
+    if len(data) > app.config['IMAGE_MAX_BYTES']:
+        raise images.ImageError(f'Images must be under {app.config["IMAGE_MAX_BYTES"] // (1024 * 1024)} MB')
+    images.probe(data)
+    return data
+
+def set_medicine_image(medicine, data):
+    """Store the original and point ``medicine`` at it. Variants already
+    rendered for the same picture are reused; returns True when they still
+    have to be rendered (``queue_medicine_image`` after the commit)."""
+    source = image_originals().put(data)
+    medicine.image_source, medicine.image_error = source, None
+    rendered = db.session.query(Medicine.image_thumb, Medicine.image_preview).filter(
+        Medicine.image_source == source, Medicine.image_preview.isnot(None)).first()
+    medicine.image_thumb, medicine.image_preview = rendered or (None, None)
+    return rendered is None
+
+def render_medicine_image(branch, medicine_id, source):
+    """Render and store the variants of original ``source`` and record them
+    on the medicine, unless its image changed meanwhile. Unreadable images
+    are dropped. Other failures (a worker that died, an error in Pillow)
+    keep the original for ``rethumbnail_images.py --missing``; either way
+    the reason is logged and kept in ``image_error``. Returns the variant
+    digests."""
+    error = None
+    try:
+        rendered = images.render_in_pool(image_originals().get(source), app.config['IMAGE_VARIANTS'],
+                                         app.config['IMAGE_QUALITY'], app.config['IMAGE_WORKERS']).result()
+    except (images.ImageError, OSError) as e:
+        app.logger.warning('Image %s of medicine %s not rendered: %s', source, medicine_id, e)
+        rendered, error = None, str(e)
+    except Exception as e:
+        app.logger.exception('Rendering image %s of medicine %s failed', source, medicine_id)
+        rendered, error = {}, f'Rendering failed: {e!r}'
+    digests = {name: image_variants().put(data) for name, data in (rendered or {}).items()}
+    with app.app_context():
+        g.branch = branch
+        medicine = db.session.get(Medicine, medicine_id)
+        if medicine is not None and medicine.image_source == source:
+            if rendered is None:
+                medicine.image_source = None
+            medicine.image_error = error[:200] if error else None
+            for name, digest in digests.items():
+                setattr(medicine, f'image_{name}', digest)
+            db.session.commit()
+    return digests
+
+def queue_medicine_image(medicine):
+    """Render the medicine's variants in the background; returns the Future
+    of ``render_medicine_image``."""
+    return _image_renderer.submit(render_medicine_image, g.get('branch'), medicine.id, medicine.image_source)
+
+def rethumbnail_images(missing_only=False):
+    """Render the variants of every stored original again with the current
+    IMAGE_VARIANTS and IMAGE_QUALITY (only those still missing variants
+    with ``missing_only``), all in the process pool at once. Medicines
+    sharing an original are updated together; returns ``(rendered, failed)``
+    counts of originals. The caller commits."""
+    query = db.session.query(Medicine.image_source).filter(Medicine.image_source.isnot(None))
+    if missing_only:
+        query = query.filter(Medicine.image_preview.is_(None))
+    sources = [source for source, in query.distinct()]
+    store = image_originals()
+    futures = {}
+    for source in sources:
+        try:
+            futures[source] = images.render_in_pool(store.get(source), app.config['IMAGE_VARIANTS'],
+                                                     app.config['IMAGE_QUALITY'], app.config['IMAGE_WORKERS'])
+        except OSError as e:
+            app.logger.warning('Original image %s is missing: %s', source, e)
+    rendered_count, failed = 0, len(sources) - len(futures)
+    for source, future in futures.items():
+        try:
+            rendered = future.result()
+        except images.ImageError as e:
+            app.logger.warning('Image %s not rendered: %s', source, e)
+            error, rendered = str(e), None
+        except Exception as e:
+            app.logger.exception('Rendering image %s failed', source)
+            error, rendered = f'Rendering failed: {e!r}', None
+        if rendered is None:
+            Medicine.query.filter_by(image_source=source).update({'image_error': error[:200]})
+            failed += 1
+            continue
+        digests = {f'image_{name}': image_variants().put(data) for name, data in rendered.items()}
+        # Per medicine, so the catalog log records each changed thumbnail
+        for medicine in Medicine.query.filter_by(image_source=source):
+            for column, digest in digests.items():
+                setattr(medicine, column, digest)
+            medicine.image_error = None
+        rendered_count += 1
+    return rendered_count, failed
+
+@app.route('/images/<digest>.jpg')
+def medicine_image(digest):
+    """A stored variant. Its name is the hash of its content, so it never
+    changes and browsers and proxies may keep it for good."""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        abort(404)
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], f'{digest[:2]}/{digest}.jpg',
+                                   mimetype='image/jpeg', max_age=app.config['IMAGE_CACHE_SECONDS'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/add_medicine', methods=['GET', 'POST'])
 @login_required
@@ -170,6 +1904,12 @@ def add_medicine():
         supplier_id = request.form.get('supplier_id')
         expiry_date = datetime.strptime(request.form.get('expiry_date'), '%Y-%m-%d').date()
         batch_number = request.form.get('batch_number', '')
+        upload = request.files.get('image')
+        try:
+            image = read_image_upload(upload) if upload and upload.filename else None
+        except images.ImageError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('add_medicine'))
         
         medicine = Medicine(
             name=name,
@@ -180,9 +1920,12 @@ def add_medicine():
             expiry_date=expiry_date,
             batch_number=batch_number
         )
+        render_image = image is not None and set_medicine_image(medicine, image)
         
         db.session.add(medicine)
         db.session.commit()
+        if render_image:
+            queue_medicine_image(medicine)
         
         # Create a purchase entry for the initial stock
         if quantity > 0:
@@ -207,7 +1950,7 @@ def add_medicine():
             db.session.add(purchase_item)
             
             # Update medicine quantity
-            medicine.quantity += quantity
+            record_stock_movement(medicine, quantity, 'purchase', purchase.invoice_number)
             db.session.commit()
         
         flash('Medicine added successfully!', 'success')
@@ -219,26 +1962,64 @@ def add_medicine():
 @app.route('/medicine/<int:id>')
 @login_required
 def view_medicine(id):
-    medicine = Medicine.query.get_or_404(id)
-    return render_template('view_medicine.html', medicine=medicine)
+    medicine = Medicine.query.options(joinedload(Medicine.supplier_ref), selectinload(Medicine.barcodes)).get_or_404(id)
+    movements = StockMovement.query.filter_by(medicine_id=id).order_by(StockMovement.created_at.desc()).limit(10).all()
+    return render_template('view_medicine.html', medicine=medicine, movements=movements)
 
 @app.route('/medicine/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_medicine(id):
     medicine = Medicine.query.get_or_404(id)
     if request.method == 'POST':
+        upload = request.files.get('image')
+        try:
+            image = read_image_upload(upload) if upload and upload.filename else None
+        except images.ImageError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('edit_medicine', id=id))
         medicine.name = request.form.get('name')
         medicine.description = request.form.get('description')
         medicine.price = float(request.form.get('price', 0))
         medicine.supplier_id = request.form.get('supplier_id') or None
         medicine.expiry_date = datetime.strptime(request.form.get('expiry_date'), '%Y-%m-%d').date()
         medicine.batch_number = request.form.get('batch_number', '')
+        render_image = False
+        if request.form.get('remove_image'):
+            medicine.image_source = medicine.image_thumb = medicine.image_preview = medicine.image_error = None
+        elif image is not None:
+            render_image = set_medicine_image(medicine, image)
         db.session.commit()
+        if render_image:
+            queue_medicine_image(medicine)
         flash('Medicine updated successfully!', 'success')
         return redirect(url_for('view_medicine', id=medicine.id))
     suppliers = Supplier.query.order_by(Supplier.name).all()
     return render_template('edit_medicine.html', medicine=medicine, suppliers=suppliers)
 
+@app.route('/medicine/<int:id>/adjust', methods=['POST'])
+@login_required
+def adjust_stock(id):
+    medicine = Medicine.query.get_or_404(id)
+    movement_type = request.form.get('movement_type', 'adjustment')
+    quantity = request.form.get('quantity', 0, type=int)
+    if movement_type not in ('adjustment', 'write-off') or quantity == 0:
+        flash('Invalid stock adjustment', 'danger')
+        return redirect(url_for('view_medicine', id=id))
+
+    # Write-offs always reduce stock
+    if movement_type == 'write-off':
+        quantity = -abs(quantity)
+    if medicine.quantity + quantity < 0:
+        flash(f'Cannot remove more than the {medicine.quantity} units in stock', 'danger')
+        return redirect(url_for('view_medicine', id=id))
+
+    record_stock_movement(medicine, quantity, movement_type, note=request.form.get('note') or None)
+    if quantity < 0:
+        release_lots(medicine.id, -quantity)
+    db.session.commit()
+    flash('Stock updated successfully!', 'success')
+    return redirect(url_for('view_medicine', id=id))
+
 @app.route('/medicine/<int:id>/delete', methods=['POST'])
 @login_required
 def delete_medicine(id):
@@ -300,9 +2081,18 @@ def add_supplier():
 @login_required
 def view_supplier(id):
     supplier = Supplier.query.get_or_404(id)
-    medicines = Medicine.query.filter_by(supplier_id=id).all()
+    page = request.args.get('page', 1, type=int)
+    per_page = 20
+    stats = get_supplier_stats(id)
+    # The SKU count is precomputed, so skip the pagination COUNT query
+    medicines = RecordPagination(
+        page=page, per_page=per_page, error_out=False, count=False,
+        select=medicine_select('id', 'name', 'batch_number', 'quantity', 'price', 'expiry_date')
+        .where(Medicine.supplier_id == id).order_by(Medicine.name, Medicine.id),
+    )
+    medicines.total = stats.sku_count
     purchases = Purchase.query.filter_by(supplier_id=id).order_by(Purchase.purchase_date.desc()).limit(5).all()
-    return render_template('view_supplier.html', supplier=supplier, medicines=medicines, purchases=purchases)
+    return render_template('view_supplier.html', supplier=supplier, medicines=medicines, purchases=purchases, stats=stats)
 
 @app.route('/supplier/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -329,11 +2119,11 @@ def delete_supplier(id):
     supplier = Supplier.query.get_or_404(id)
     
     # Check if supplier has associated medicines
-    associated_medicines = Medicine.query.filter_by(supplier_id=id).count()
-    if associated_medicines > 0:
+    if get_supplier_stats(id).sku_count > 0:
         return jsonify({'success': False, 'message': 'Cannot delete supplier with associated medicines. Please reassign or delete the medicines first.'})
     
     try:
+        SupplierStats.query.filter_by(supplier_id=id).delete()
         db.session.delete(supplier)
         db.session.commit()
         return jsonify({'success': True, 'message': 'Supplier deleted successfully!'})
@@ -363,10 +2153,26 @@ def sales():
         end_date = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)  # Include the entire end date
         query = query.filter(Sale.sale_date <= end_date)
     
+    archive_filters = {'start': start_date or None, 'end': end_date or None,
+                       'customer_id': None, 'customer_name': None}
     if customer:
-        query = query.filter(Sale.customer_name.ilike(f'%{customer}%'))
+        # A phone number goes through the indexed customer lookup
+        phone = normalize_phone(customer)
+        matched = Customer.query.filter_by(phone=phone).first() if phone else None
+        if matched:
+            query = query.filter(Sale.customer_id == matched.id)
+            archive_filters['customer_id'] = matched.id
+        else:
+            query = query.filter(Sale.customer_name.ilike(f'%{customer}%'))
+            archive_filters['customer_name'] = customer
     
-    sales_pagination = query.order_by(Sale.sale_date.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    # Archived sales are only read when the date range reaches into them
+    sales_pagination = SalesPagination(
+        page=page, per_page=per_page, error_out=False,
+        query=query.options(selectinload(Sale.items)).order_by(Sale.sale_date.desc()),
+        archives=archived_years(archive_filters['start'], archive_filters['end']),
+        filters=archive_filters,
+    )
     
     return render_template('sales.html', 
                          sales=sales_pagination,
@@ -374,111 +2180,681 @@ def sales():
                          end_date=end_date.strftime('%Y-%m-%d') if end_date else '',
                          customer=customer)
 
-@app.route('/sale/new', methods=['GET', 'POST'])
-@login_required
-def new_sale():
-    if request.method == 'POST':
-        customer_name = request.form.get('customer_name')
-        customer_contact = request.form.get('customer_contact')
-        payment_method = request.form.get('payment_method', 'Cash')
-        discount = float(request.form.get('discount', 0))
-        tax_percentage = float(request.form.get('tax_percentage', 0))
-        
-        # Generate invoice number
-        invoice_number = f'INV-{datetime.utcnow().strftime("%Y%m%d")}-{Sale.query.count() + 1:04d}'
-        
-        # Calculate total amount from items
-        total_amount = 0
-        items = []
-        
-        # Get the items from the form
-        medicine_ids = request.form.getlist('medicine_id[]')
-        quantities = request.form.getlist('quantity[]')
-        prices = request.form.getlist('price[]')
-        
-        for i in range(len(medicine_ids)):
-            medicine_id = int(medicine_ids[i])
-            quantity = int(quantities[i])
-            price = float(prices[i])
-            
-            if quantity <= 0:
-                continue
-                
-            # Check if enough stock is available
-            medicine = Medicine.query.get(medicine_id)
-            if not medicine or medicine.quantity < quantity:
-                flash(f'Not enough stock for {medicine.name if medicine else "selected medicine"}', 'danger')
-                return redirect(url_for('new_sale'))
-            
-            item_total = quantity * price
-            total_amount += item_total
-            
-            items.append({
-                'medicine_id': medicine_id,
-                'quantity': quantity,
-                'unit_price': price,
-                'total_price': item_total,
-                'batch_number': medicine.batch_number
-            })
-        
-        # Apply discount
-        discount_amount = (total_amount * discount) / 100
-        subtotal = total_amount - discount_amount
-        
-        # Calculate tax
-        tax_amount = (subtotal * tax_percentage) / 100
-        
-        # Calculate final total
-        final_total = subtotal + tax_amount
-        
-        # Create sale record
-        sale = Sale(
-            invoice_number=invoice_number,
-            customer_name=customer_name,
-            customer_contact=customer_contact,
-            total_amount=final_total,
-            discount=discount_amount,
-            tax_amount=tax_amount,
-            payment_method=payment_method
-        )
-        
-        db.session.add(sale)
-        db.session.flush()  # To get the sale ID
-        
-        # Add sale items and update stock
-        for item in items:
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                medicine_id=item['medicine_id'],
-                batch_number=item['batch_number'],
-                quantity=item['quantity'],
-                unit_price=item['unit_price'],
-                total_price=item['total_price']
-            )
-            db.session.add(sale_item)
-            
-            # Update medicine stock
-            medicine = Medicine.query.get(item['medicine_id'])
-            medicine.quantity -= item['quantity']
-        
-        db.session.commit()
+class SaleError(ValueError):
+    pass
+
+def sale_items(rows):
+    """``(medicine_id, quantity, unit_price)`` tuples for create_sale() from
+    raw form values; a blank price sells at the list price and lines with a
+    quantity of zero or less are dropped. Raises SaleError for values that
+    are not numbers and for a sale without items."""
+    items = []
+    for medicine_id, quantity, price in rows:
+        try:
+            item = (int(medicine_id), int(quantity), None if price in (None, '') else float(price))
+        except (TypeError, ValueError):
+            raise SaleError('Every item needs a medicine, a whole quantity and a price') from None
+        if item[2] is not None and not 0 <= item[2] < float('inf'):
+            raise SaleError('Prices must be positive numbers')
+        if item[1] > 0:
+            items.append(item)
+    if not items:
+        raise SaleError('A sale needs at least one item')
+    return items
+
+def sale_options(values):
+    """create_sale() keyword arguments from raw form values; raises SaleError
+    for a discount outside 0-100% or a tax that is not a positive number."""
+    try:
+        discount = float(values.get('discount') or 0)
+        tax_percentage = float(values.get('tax_percentage') or 0)
+    except (TypeError, ValueError):
+        raise SaleError('Discount and tax must be numbers') from None
+    if not 0 <= discount <= 100 or not 0 <= tax_percentage <= 100:
+        raise SaleError('Discount and tax must be between 0 and 100%')
+    return dict(payment_method=values.get('payment_method') or 'Cash', discount=discount,
+                tax_percentage=tax_percentage)
+
+def next_invoice_number():
+    # Archived sales still count, so numbers never repeat after archiving
+    archived = db.session.query(func.coalesce(func.sum(SaleArchive.sale_count), 0)).scalar()
+    return f'INV-{datetime.utcnow().strftime("%Y%m%d")}-{Sale.query.count() + archived + 1:04d}'
+
+def create_sale(customer_name, customer_contact, items, payment_method='Cash', discount=0.0, tax_percentage=0.0):
+    """Record a sale and take its items out of stock.
+
+    ``items`` holds ``(medicine_id, quantity, unit_price)`` tuples; a price of
+    None sells at the medicine's list price and lines with a quantity of
+    zero or less are skipped. Raises SaleError when a medicine is unknown or
+    short of stock. Nothing is committed, so a caller can record several
+    sales in one transaction.
+    """
+    items = [(int(medicine_id), int(quantity), price) for medicine_id, quantity, price in items if int(quantity) > 0]
+    # One query for every medicine on the sale
+    medicines = {medicine.id: medicine for medicine in
+                 Medicine.query.filter(Medicine.id.in_({medicine_id for medicine_id, _, _ in items})).all()}
+
+    total_amount = 0
+    lines = []
+    requested = {}
+    for medicine_id, quantity, price in items:
+        medicine = medicines.get(medicine_id)
+        requested[medicine_id] = requested.get(medicine_id, 0) + quantity
+        # Check if enough stock is available
+        if not medicine or medicine.quantity < requested[medicine_id]:
+            raise SaleError(f'Not enough stock for {medicine.name if medicine else "selected medicine"}')
+        price = medicine.price if price is None else float(price)
+        item_total = quantity * price
+        total_amount += item_total
+        lines.append((medicine, quantity, price, item_total))
+
+    # Apply discount
+    discount_amount = (total_amount * discount) / 100
+    subtotal = total_amount - discount_amount
+
+    # Calculate tax
+    tax_amount = (subtotal * tax_percentage) / 100
+
+    invoice_number = next_invoice_number()
+    customer = get_or_create_customer(customer_name, customer_contact)
+    sale = Sale(
+        invoice_number=invoice_number,
+        customer_name=customer_name,
+        customer_contact=customer_contact,
+        customer_id=customer.id if customer else None,
+        total_amount=subtotal + tax_amount,
+        discount=discount_amount,
+        tax_amount=tax_amount,
+        payment_method=payment_method
+    )
+    db.session.add(sale)
+    db.session.flush()  # To get the sale ID
+
+    # Add sale items and update stock
+    sale_items = []
+    for medicine, quantity, price, item_total in lines:
+        sale_items.append(SaleItem(
+            sale_id=sale.id,
+            medicine_id=medicine.id,
+            batch_number=medicine.batch_number,
+            quantity=quantity,
+            unit_price=price,
+            total_price=item_total
+        ))
+        record_stock_movement(medicine, -quantity, 'sale', invoice_number)
+    assign_sale_costs(sale_items)
+    db.session.add_all(sale_items)
+    return sale
+
+class SaleWriter:
+    """Group commit for the new sales of one branch.
+
+    Request threads hand a sale to ``submit`` and wait while a single writer
+    thread records whatever is queued, up to SALE_GROUP_COMMIT_MAX_SALES or
+    what arrives within SALE_GROUP_COMMIT_MAX_WAIT_MS of the first sale, and
+    commits the batch at once: one fsync and one trip through the database
+    lock for many sales. Callers validate their input first (sale_items(),
+    sale_options()); each sale is still recorded in its own savepoint, so a
+    sale that fails is rolled back and fails alone. Only a failing commit
+    fails the whole batch.
+    """
+
+    def __init__(self, branch):
+        self.branch = branch
+        self.jobs = queue.Queue()
+        self.batches = 0
+        self.sales = 0
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'sale-writer-{branch or app.config["DEFAULT_BRANCH"]}')
+        self._thread.start()
+
+    def submit(self, *args, **kwargs):
+        """Record a sale like create_sale() and return its id once the batch
+        holding it is committed; raises what recording or committing raised."""
+        job = Future()
+        self.jobs.put((job, args, kwargs))
+        return job.result()
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + app.config['SALE_GROUP_COMMIT_MAX_WAIT_MS'] / 1000
+        while len(batch) < app.config['SALE_GROUP_COMMIT_MAX_SALES']:
+            try:
+                batch.append(self.jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with app.app_context():
+                g.branch = self.branch
+                self._commit(batch)
+
+    def _commit(self, batch):
+        recorded = []
+        try:
+            if db.session.get_bind().dialect.name == 'sqlite':
+                # pysqlite only begins on the first write, and a customer
+                # savepoint issued before it would commit on its own
+                db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            for job, args, kwargs in batch:
+                try:
+                    with db.session.begin_nested():
+                        sale = create_sale(*args, **kwargs)
+                    recorded.append((job, sale.id))
+                except Exception as e:
+                    job.set_exception(e)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for job, _, _ in batch:
+                if not job.done():
+                    job.set_exception(e)
+            return
+        self.batches += 1
+        self.sales += len(recorded)
+        for job, sale_id in recorded:
+            job.set_result(sale_id)
+
+_sale_writers = {}
+_sale_writers_lock = threading.Lock()
+
+def sale_writer(branch=None):
+    branch = branch if branch is not None else g.get('branch')
+    with _sale_writers_lock:
+        if branch not in _sale_writers:
+            _sale_writers[branch] = SaleWriter(branch)
+        return _sale_writers[branch]
+
+@app.route('/sale/new', methods=['GET', 'POST'])
+@login_required
+def new_sale():
+    if request.method == 'POST':
+        customer = (request.form.get('customer_name'), request.form.get('customer_contact'))
+        try:
+            # Checked here, so only well-formed sales reach the writer thread
+            items = sale_items(zip(request.form.getlist('medicine_id[]'),
+                                   request.form.getlist('quantity[]'),
+                                   request.form.getlist('price[]')))
+            options = sale_options(request.form)
+            if app.config['SALE_GROUP_COMMIT']:
+                # Recorded and committed by the branch's writer thread; the
+                # request's pooled connection is handed back while it waits
+                db.session.rollback()
+                sale_id = sale_writer().submit(*customer, items, **options)
+            else:
+                sale_id = create_sale(*customer, items, **options).id
+                db.session.commit()
+        except SaleError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('new_sale'))
         
         flash('Sale completed successfully!', 'success')
-        return redirect(url_for('view_sale', id=sale.id))
+        return redirect(url_for('view_sale', id=sale_id))
     
-    # For GET request, show the sale form
-    medicines = Medicine.query.filter(Medicine.quantity > 0).order_by(Medicine.name).all()
-    return render_template('new_sale.html', medicines=medicines)
+    # For GET request, show the sale form. The medicine picker is filled from
+    # the terminal's local catalog copy, kept current via catalog_changes().
+    return render_template('new_sale.html')
+
+@app.route('/customers/lookup')
+@login_required
+def lookup_customer():
+    phone = normalize_phone(request.args.get('phone'))
+    customer = Customer.query.filter_by(phone=phone).first() if phone else None
+    if not customer:
+        return jsonify({'found': False})
+    return jsonify({'found': True, 'id': customer.id, 'name': customer.name, 'phone': customer.phone})
+
+@app.route('/customer/<int:id>/history')
+@login_required
+def customer_history(id):
+    customer = Customer.query.get_or_404(id)
+    limit = min(request.args.get('limit', 10, type=int), 100)
+
+    # Both queries use the index on sale.customer_id
+    lifetime_spend, sale_count, last_purchase = db.session.query(
+        func.coalesce(func.sum(Sale.total_amount), 0),
+        func.count(Sale.id),
+        func.max(Sale.sale_date)
+    ).filter(Sale.customer_id == id).one()
+    recent = Sale.query.filter_by(customer_id=id).order_by(Sale.sale_date.desc()).limit(limit).all()
+
+    # Lifetime figures include archived years; the archives index customer_id too
+    store = archive_store()
+    for year, _ in archived_years():
+        spend, count, last = store.customer_totals(year, id)
+        lifetime_spend += spend
+        sale_count += count
+        last_purchase = max(filter(None, (last_purchase, last)), default=None)
+        if len(recent) < limit and count:
+            recent.extend(store.sales(year, limit=limit - len(recent), customer_id=id))
+
+    return jsonify({
+        'id': customer.id,
+        'name': customer.name,
+        'phone': customer.phone,
+        'lifetime_spend': round(float(lifetime_spend), 2),
+        'sale_count': sale_count,
+        'last_purchase': last_purchase.isoformat() if last_purchase else None,
+        'recent_invoices': [
+            {
+                'id': sale.id,
+                'invoice_number': sale.invoice_number,
+                'sale_date': sale.sale_date.isoformat(),
+                'total_amount': sale.total_amount,
+                'payment_method': sale.payment_method,
+            }
+            for sale in recent
+        ],
+    })
 
 @app.route('/sale/<int:id>')
 @login_required
 def view_sale(id):
-    sale = Sale.query.get_or_404(id)
+    sale = find_sale(id)
+    if sale is None:
+        abort(404)
     return render_template('view_sale.html', sale=sale)
 
+# Catalog delta feed for counter terminals
+CATALOG_FIELDS = ['id', 'name', 'batch', 'price', 'stock', 'expiry', 'thumb']
+CATALOG_COLUMNS = ('id', 'name', 'batch_number', 'price', 'quantity', 'expiry_date', 'image_thumb')
+
+def catalog_row(medicine):
+    return [
+        medicine.id,
+        medicine.name,
+        medicine.batch_number or '',
+        medicine.price,
+        medicine.quantity,
+        medicine.expiry_date.strftime('%Y-%m-%d') if medicine.expiry_date else None,
+        medicine.image_thumb,
+    ]
+
+@app.route('/api/catalog/changes')
+@login_required
+def catalog_changes():
+    """Medicines changed since catalog version ``since``.
+
+    ``since=0`` (or a version older than the retained log) returns a full
+    snapshot. Rows are compact arrays in CATALOG_FIELDS order.
+    """
+    since = request.args.get('since', 0, type=int)
+    version = db.session.query(func.max(CatalogChange.id)).scalar() or 0
+    oldest = db.session.query(func.min(CatalogChange.id)).scalar() or 0
+
+    full = since <= 0 or since > version or since < oldest - 1
+    if full:
+        medicines = list(medicine_records(medicine_select(*CATALOG_COLUMNS).order_by(Medicine.id)))
+        deleted = []
+    else:
+        changed_ids = [row[0] for row in db.session.query(CatalogChange.medicine_id).filter(
+            CatalogChange.id > since,
+            CatalogChange.id <= version
+        ).distinct()]
+        medicines = list(medicine_records(medicine_select(*CATALOG_COLUMNS).where(Medicine.id.in_(changed_ids)))) \
+            if changed_ids else []
+        present = {medicine.id for medicine in medicines}
+        deleted = [medicine_id for medicine_id in changed_ids if medicine_id not in present]
+
+    return jsonify({
+        'version': version,
+        'full': full,
+        'fields': CATALOG_FIELDS,
+        'upserts': [catalog_row(medicine) for medicine in medicines],
+        'deletes': deleted,
+    })
+
+# Lookups for counter terminals: medicine search, stock, a sale and the
+# dashboard figures as JSON. asgi.py serves the same statements and JSON
+# asynchronously under /async/lookup/.
+LOOKUP_LIMIT = 20
+
+def lookup_medicines_select(term, limit=LOOKUP_LIMIT):
+    """Medicines matching ``term`` as the medicine list search does."""
+    conditions = medicine_conditions(medicine_filters(MultiDict({'search': term}))).get('search', [])
+    return medicine_select(*CATALOG_COLUMNS).where(*conditions).order_by(Medicine.name, Medicine.id).limit(limit)
+
+def lookup_stock_select(ids):
+    return db.select(Medicine.id, Medicine.quantity).where(Medicine.id.in_(ids))
+
+def lookup_sale_selects(id):
+    """The sale and its lines (live sales only; archived ones are on /sale/<id>)."""
+    return (
+        db.select(Sale.id, Sale.invoice_number, Sale.customer_name, Sale.total_amount, Sale.discount,
+                  Sale.tax_amount, Sale.payment_method, Sale.sale_date).where(Sale.id == id),
+        db.select(SaleItem.medicine_id, Medicine.name, SaleItem.quantity, SaleItem.unit_price, SaleItem.total_price)
+        .outerjoin(Medicine, Medicine.id == SaleItem.medicine_id).where(SaleItem.sale_id == id).order_by(SaleItem.id),
+    )
+
+def lookup_medicines_json(rows):
+    return {'fields': CATALOG_FIELDS, 'rows': [catalog_row(MedicineRecord(row)) for row in rows]}
+
+def lookup_stock_json(ids, rows):
+    stock = {row.id: row.quantity for row in rows}
+    return {'stock': {str(medicine_id): stock[medicine_id] for medicine_id in ids if medicine_id in stock},
+            'missing': [medicine_id for medicine_id in ids if medicine_id not in stock]}
+
+def lookup_sale_json(sale, items):
+    return dict(sale._mapping, sale_date=sale.sale_date.isoformat(), items=[
+        {'medicine_id': item.medicine_id, 'name': item.name, 'quantity': item.quantity,
+         'unit_price': item.unit_price, 'total_price': item.total_price} for item in items])
+
+def lookup_dashboard_json(kpis):
+    """``kpis`` maps the dashboard_kpi_selects names to their result rows."""
+    data = {name: kpis[name][0][0] for name in DASHBOARD_FIGURES}
+    data['low_stock_items'] = [dict(row._mapping) for row in kpis['low_stock_items']]
+    data['recent_sales'] = [dict(row._mapping, sale_date=row.sale_date.isoformat()) for row in kpis['recent_sales']]
+    return data
+
+@app.route('/lookup/medicines')
+@login_required
+def lookup_medicines():
+    limit = min(request.args.get('limit', LOOKUP_LIMIT, type=int), 100)
+    return jsonify(lookup_medicines_json(db.session.execute(
+        lookup_medicines_select(request.args.get('q', ''), limit))))
+
+@app.route('/lookup/stock')
+@login_required
+def lookup_stock():
+    ids = _api_ids([value for value in request.args.get('ids', '').split(',') if value])
+    if ids is None:
+        return api_error(f'ids must be a list of at most {API_BATCH_LIMIT} integers')
+    return jsonify(lookup_stock_json(ids, db.session.execute(lookup_stock_select(ids))))
+
+@app.route('/lookup/sales/<int:id>')
+@login_required
+def lookup_sale(id):
+    sale_select, items_select = lookup_sale_selects(id)
+    sale = db.session.execute(sale_select).first()
+    if sale is None:
+        return api_error('Sale not found', 404)
+    return jsonify(lookup_sale_json(sale, db.session.execute(items_select)))
+
+@app.route('/lookup/dashboard')
+@login_required
+def lookup_dashboard():
+    statements = dashboard_kpi_selects(app.config['LOW_STOCK_THRESHOLD'])
+    return jsonify(lookup_dashboard_json({name: db.session.execute(statement).all()
+                                          for name, statement in statements.items()}))
+
+# Barcode scanning
+BARCODE_PATTERN = re.compile(r'^[0-9A-Za-z-]{1,32}$')
+
+class BarcodeIndex:
+    """In-process barcode lookup for one branch.
+
+    Maps code -> (medicine_id, pack_size) and medicine_id -> (name, batch,
+    price, stock), so a scan is two dict lookups. Every write to medicines or
+    barcodes - forms, sales, bulk SQL edits, other worker processes - lands
+    in the catalog change log from the session hooks; refresh() replays the
+    log since the version the index was built at and reloads just those
+    medicines. The log is looked at once per BARCODE_REFRESH_SECONDS, or on
+    the next scan after a commit in this process marks the index stale.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.checked_at = None
+        self.stale = True
+        # (codes, medicines, codes_by_medicine), replaced whole on every
+        # reload so a scan never sees a half-applied refresh
+        self.index = ({}, {}, {})
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        with self._lock:
+            self.stale = True
+
+    def _load(self, medicine_ids=None):
+        medicines = db.select(Medicine.id, Medicine.name, Medicine.batch_number, Medicine.price, Medicine.quantity)
+        barcodes = db.select(Barcode.code, Barcode.medicine_id, Barcode.pack_size)
+        if medicine_ids is not None:
+            medicines = medicines.where(Medicine.id.in_(medicine_ids))
+            barcodes = barcodes.where(Barcode.medicine_id.in_(medicine_ids))
+            codes, by_id, codes_by_medicine = (dict(part) for part in self.index)
+            for medicine_id in medicine_ids:
+                by_id.pop(medicine_id, None)
+                for code in codes_by_medicine.pop(medicine_id, ()):
+                    codes.pop(code, None)
+        else:
+            codes, by_id, codes_by_medicine = {}, {}, {}
+        for medicine_id, name, batch, price, stock in db.session.execute(medicines):
+            by_id[medicine_id] = (name, batch, price, stock)
+        for code, medicine_id, pack_size in db.session.execute(barcodes):
+            codes[code] = (medicine_id, pack_size)
+            codes_by_medicine.setdefault(medicine_id, []).append(code)
+        self.index = (codes, by_id, codes_by_medicine)
+
+    def refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            if not self.stale and now - self.checked_at < app.config['BARCODE_REFRESH_SECONDS']:
+                return
+            # Cleared before reading, so a commit landing meanwhile is not lost
+            self.stale, self.checked_at = False, now
+            version = db.session.query(func.max(CatalogChange.id)).scalar() or 0
+            if version == self.version:
+                return
+            if self.version is None or version < self.version:
+                self._load()
+            elif version > self.version:
+                oldest = db.session.query(func.min(CatalogChange.id)).scalar() or 0
+                if oldest > self.version + 1:
+                    # The log was trimmed past our version
+                    self._load()
+                else:
+                    self._load({row[0] for row in db.session.query(CatalogChange.medicine_id).filter(
+                        CatalogChange.id > self.version, CatalogChange.id <= version).distinct()})
+            self.version = max(version, self.version or 0)
+
+    def lookup(self, code):
+        self.refresh()
+        codes, medicines, _ = self.index
+        entry = codes.get(code)
+        if entry is None:
+            return None
+        medicine_id, pack_size = entry
+        medicine = medicines.get(medicine_id)
+        if medicine is None:
+            return None
+        name, batch, price, stock = medicine
+        return {'id': medicine_id, 'name': name, 'batch': batch or '', 'price': price,
+                'stock': stock, 'pack_size': pack_size}
+
+_barcode_indexes = {}
+
+def barcode_index():
+    return _barcode_indexes.setdefault(g.get('branch'), BarcodeIndex())
+
+@app.route('/sale/scan')
+@login_required
+def scan_barcode():
+    """Resolve a scanned code for the sale page."""
+    code = (request.args.get('code') or '').strip()
+    medicine = barcode_index().lookup(code) if code else None
+    if medicine is None:
+        return jsonify({'found': False, 'code': code}), 404
+    return jsonify({'found': True, **medicine})
+
+@app.route('/medicine/<int:id>/barcodes', methods=['POST'])
+@login_required
+def add_barcode(id):
+    medicine = Medicine.query.get_or_404(id)
+    code = (request.form.get('code') or '').strip()
+    pack_size = request.form.get('pack_size', 1, type=int)
+    if not BARCODE_PATTERN.match(code) or not pack_size or pack_size < 1:
+        flash('Enter a barcode of up to 32 letters or digits and a pack size of at least 1.', 'danger')
+        return redirect(url_for('view_medicine', id=id))
+    existing = Barcode.query.filter_by(code=code).first()
+    if existing:
+        flash(f'Barcode {code} is already assigned to {existing.medicine.name}.', 'danger')
+        return redirect(url_for('view_medicine', id=id))
+    medicine.barcodes.append(Barcode(code=code, pack_size=pack_size))
+    db.session.commit()
+    flash('Barcode added.', 'success')
+    return redirect(url_for('view_medicine', id=id))
+
+@app.route('/medicine/<int:id>/barcodes/<int:barcode_id>/delete', methods=['POST'])
+@login_required
+def delete_barcode(id, barcode_id):
+    barcode = Barcode.query.filter_by(id=barcode_id, medicine_id=id).first_or_404()
+    db.session.delete(barcode)
+    db.session.commit()
+    flash('Barcode removed.', 'success')
+    return redirect(url_for('view_medicine', id=id))
+
+# JSON API v1: bearer-token auth, batch requests, compact array rows
+SALE_FIELDS = ['id', 'invoice', 'date', 'customer', 'total', 'discount', 'tax', 'payment', 'items']
+SALE_ITEM_FIELDS = ['medicine_id', 'quantity', 'unit_price', 'total']
+API_BATCH_LIMIT = 500
+API_PAGE_LIMIT = 1000
+
+def hash_api_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def create_api_token(user, name):
+    """Issue a token for ``user``; the plain token is only returned here."""
+    token = secrets.token_urlsafe(32)
+    db.session.add(ApiToken(user_id=user.id, name=name, token_hash=hash_api_token(token)))
+    return token
+
+def api_token_required(view):
+    """Authenticate with ``Authorization: Bearer <token>`` instead of the
+    login session."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        api_token = None
+        if scheme.lower() == 'bearer' and token:
+            api_token = ApiToken.query.filter_by(token_hash=hash_api_token(token.strip()), revoked_at=None).first()
+        if api_token is None:
+            return jsonify({'error': 'Invalid or missing API token'}), 401
+        g.api_user_id = api_token.user_id
+        return view(*args, **kwargs)
+    return wrapper
+
+def api_error(message, status=400, **extra):
+    return jsonify({'error': message, **extra}), status
+
+def _api_ids(raw):
+    try:
+        ids = [int(value) for value in raw]
+    except (TypeError, ValueError):
+        return None
+    return ids if len(ids) <= API_BATCH_LIMIT else None
+
+@app.route('/api/v1/medicines', methods=['GET', 'POST'])
+@api_token_required
+def api_medicines():
+    """Medicines by id in one call: ``?ids=1,2,3`` or a JSON body
+    ``{"ids": [...]}``. Rows are arrays in CATALOG_FIELDS order."""
+    if request.method == 'POST':
+        raw = (request.get_json(silent=True) or {}).get('ids', [])
+    else:
+        raw = [value for value in request.args.get('ids', '').split(',') if value]
+    ids = _api_ids(raw)
+    if ids is None:
+        return api_error(f'ids must be a list of at most {API_BATCH_LIMIT} integers')
+
+    def load(missing):
+        return {str(medicine.id): catalog_row(medicine) for medicine in medicine_records(
+            medicine_select(*CATALOG_COLUMNS).where(Medicine.id.in_([int(key) for key in missing])))}
+
+    rows = app_cache().cached_many(cache_namespaces('catalog'), [str(medicine_id) for medicine_id in ids], load)
+    return jsonify({
+        'fields': CATALOG_FIELDS,
+        'rows': [rows[key] for key in sorted(rows, key=int)],
+        'missing': [medicine_id for medicine_id in ids if str(medicine_id) not in rows],
+    })
+
+@app.route('/api/v1/sales', methods=['POST'])
+@api_token_required
+def api_create_sales():
+    """Create several sales in one transaction.
+
+    Body: ``{"sales": [{"customer_name": ..., "customer_contact": ...,
+    "payment_method": ..., "discount": 0, "tax_percentage": 0,
+    "items": [[medicine_id, quantity], [medicine_id, quantity, unit_price]]}]}``.
+    Either every sale is recorded or none is; a failing sale is reported by
+    its index, with 400 for invalid values and 409 when stock is short.
+    """
+    sales = (request.get_json(silent=True) or {}).get('sales')
+    if not isinstance(sales, list) or not sales or len(sales) > API_BATCH_LIMIT:
+        return api_error(f'sales must be a list of 1 to {API_BATCH_LIMIT} sales')
+    created = []
+    for index, data in enumerate(sales):
+        # The same checks as the sale form: a bad value is the client's error
+        try:
+            items = sale_items((item[0], item[1], item[2] if len(item) > 2 else None)
+                               for item in data.get('items') or [])
+            options = sale_options(data)
+        except SaleError as e:
+            db.session.rollback()
+            return api_error(str(e), index=index)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            db.session.rollback()
+            return api_error('Malformed sale', index=index)
+        try:
+            sale = create_sale(data.get('customer_name') or 'Walk-in Customer', data.get('customer_contact'),
+                               items, **options)
+        except SaleError as e:
+            db.session.rollback()
+            return api_error(str(e), 409, index=index)
+        created.append([sale.id, sale.invoice_number, round(sale.total_amount, 2)])
+    db.session.commit()
+    return jsonify({'fields': ['id', 'invoice', 'total'], 'rows': created}), 201
+
+@app.route('/api/v1/sales')
+@api_token_required
+def api_sales():
+    """Sales in a date window with their items, oldest first.
+
+    ``?start=YYYY-MM-DD&end=YYYY-MM-DD&limit=N``; pass the returned
+    ``next_after_id`` as ``after_id`` to fetch the next page. Only live
+    sales are returned; archived years are available from /reports/export.
+    """
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+    except ValueError:
+        return api_error('Dates must be YYYY-MM-DD')
+    limit = max(1, min(request.args.get('limit', API_PAGE_LIMIT, type=int), API_PAGE_LIMIT))
+    after_id = request.args.get('after_id', 0, type=int)
+
+    sale_table, item_table = Sale.__table__, SaleItem.__table__
+    query = db.select(sale_table).where(sale_table.c.id > after_id).order_by(sale_table.c.id).limit(limit)
+    if start:
+        query = query.where(sale_table.c.sale_date >= start)
+    if end:
+        query = query.where(sale_table.c.sale_date < end)
+    sales = db.session.execute(query).all()
+
+    # Items for the whole page in one query
+    items = {}
+    if sales:
+        for item in db.session.execute(db.select(item_table).where(item_table.c.sale_id.in_([sale.id for sale in sales]))
+                                        .order_by(item_table.c.id)):
+            items.setdefault(item.sale_id, []).append([item.medicine_id, item.quantity, item.unit_price, item.total_price])
+
+    return jsonify({
+        'fields': SALE_FIELDS,
+        'item_fields': SALE_ITEM_FIELDS,
+        'rows': [
+            [sale.id, sale.invoice_number, sale.sale_date.strftime('%Y-%m-%dT%H:%M:%S'), sale.customer_name,
+             sale.total_amount, sale.discount, sale.tax_amount, sale.payment_method, items.get(sale.id, [])]
+            for sale in sales
+        ],
+        'next_after_id': sales[-1].id if len(sales) == limit else None,
+    })
+
 # Reports Routes
 @app.route('/reports')
 @login_required
+@reporting_route
 def reports():
     # Get date range for the current month
     today = datetime.utcnow()
@@ -487,7 +2863,20 @@ def reports():
     # Generate dates for the current month
     dates = [(first_day + timedelta(days=i)).strftime('%Y-%m-%d') 
              for i in range((today - first_day).days + 1)]
-    
+    # Writes bump the cache version; the TTL bounds how long a report built
+    # from a lagging replica is served
+    threshold = app.config['LOW_STOCK_THRESHOLD']
+    report = app_cache().cached(cache_namespaces('catalog', 'sales'), f'reports:{today:%Y-%m-%d}:{threshold}',
+                                lambda: report_data(first_day, today, dates, threshold),
+                                ttl=app.config['REPORTING_MAX_STALENESS'] or None)
+    return render_template('reports.html',
+                         start_date=first_day,
+                         end_date=today,
+                         dates=dates,
+                         **report)
+
+def report_data(first_day, today, dates, threshold):
+    """Figures of the reports page as plain data, so they can be cached."""
     # Get sales data for the current month
     sales_data = db.session.query(
         func.date(Sale.sale_date).label('sale_date'),
@@ -500,6 +2889,16 @@ def reports():
         func.date(Sale.sale_date)
     ).all()
     
+    # Months that were archived are merged in from the archive files
+    archives = archived_years(first_day, today)
+    store = archive_store() if archives else None
+    if archives:
+        daily = sales_archive.merge_grouped({}, sales_data)
+        for year, _ in archives:
+            sales_archive.merge_grouped(daily, store.daily_totals(year, first_day, today))
+        sales_data = [SimpleNamespace(sale_date=day, total_amount=amount, sale_count=count)
+                      for day, (amount, count) in daily.items()]
+    
     # Create a dictionary of date to sales data
     sales_dict = {str(date): {'amount': 0, 'count': 0} for date in dates}
     for sale in sales_data:
@@ -531,10 +2930,24 @@ def reports():
         Medicine.id, Medicine.name
     ).order_by(
         func.sum(SaleItem.quantity).desc()
-    ).limit(10).all()
+    )
+    if archives:
+        top = sales_archive.merge_grouped({}, top_medicines.with_entities(
+            Medicine.id, Medicine.name, func.sum(SaleItem.quantity), func.sum(SaleItem.total_price)
+        ), key_len=2)
+        for year, _ in archives:
+            sales_archive.merge_grouped(top, store.top_medicines(year, first_day, today), key_len=2)
+        top_medicines = sorted(
+            (SimpleNamespace(name=name, total_quantity=qty, total_sales=total)
+             for (_, name), (qty, total) in top.items()),
+            key=lambda row: row.total_quantity, reverse=True,
+        )[:10]
+    else:
+        top_medicines = top_medicines.limit(10).all()
     
     # Get low stock medicines
-    low_stock = Medicine.query.filter(Medicine.quantity < 10).all()
+    low_stock = list(medicine_records(medicine_select('id', 'name', 'quantity', 'supplier_name')
+                                      .where(Medicine.quantity < threshold)))
     
     # Get payment methods summary
     payment_methods = db.session.query(
@@ -547,54 +2960,684 @@ def reports():
     ).group_by(
         Sale.payment_method
     ).all()
+    if archives:
+        methods = sales_archive.merge_grouped({}, payment_methods)
+        for year, _ in archives:
+            sales_archive.merge_grouped(methods, store.payment_methods(year, first_day, today))
+        payment_methods = [SimpleNamespace(payment_method=method, sale_count=count, total_amount=total)
+                           for method, (count, total) in methods.items()]
     
-    return render_template('reports.html',
-                         start_date=first_day,
-                         end_date=today,
-                         dates=dates,
-                         amounts=amounts,
-                         counts=counts,
-                         top_medicines=top_medicines,
-                         low_stock=low_stock,
-                         payment_methods=payment_methods)
+    return {
+        'amounts': amounts,
+        'counts': counts,
+        'top_medicines': [SimpleNamespace(name=row.name, total_quantity=row.total_quantity,
+                                          total_sales=row.total_sales) for row in top_medicines],
+        'low_stock': low_stock,
+        'payment_methods': [SimpleNamespace(payment_method=row.payment_method, sale_count=row.sale_count,
+                                            total_amount=row.total_amount) for row in payment_methods],
+    }
+
+# Stock valuation at any date, from snapshots plus the movement ledger
+@app.route('/reports/stock-valuation')
+@login_required
+@reporting_route
+def stock_valuation():
+    date_str = request.args.get('date')
+    as_of_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else datetime.utcnow().date()
+    as_of = datetime.combine(as_of_date, datetime.max.time())
+
+    stock = stock_as_of(as_of)
+    medicines = db.session.query(
+        Medicine.id,
+        Medicine.name,
+        Medicine.batch_number,
+        Medicine.price,
+        Supplier.name.label('supplier_name')
+    ).outerjoin(
+        Supplier, Medicine.supplier_id == Supplier.id
+    ).filter(
+        # The medicines stock_as_of() covers, selected in SQL rather than
+        # binding one parameter per id
+        existed_at(as_of)
+    ).order_by(Medicine.name).all()
+
+    rows = [
+        {
+            'id': med.id,
+            'name': med.name,
+            'batch_number': med.batch_number,
+            'supplier_name': med.supplier_name,
+            'quantity': stock[med.id],
+            'price': med.price,
+            'value': stock[med.id] * med.price,
+        }
+        for med in medicines
+    ]
+    total_value = sum(row['value'] for row in rows)
+
+    if request.args.get('format') == 'csv':
+        si = StringIO()
+        cw = csv.writer(si)
+        cw.writerow(['ID', 'Medicine', 'Batch #', 'Supplier', 'Quantity', 'Price', 'Value'])
+        for row in rows:
+            cw.writerow([row['id'], row['name'], row['batch_number'] or '', row['supplier_name'] or '',
+                         row['quantity'], f"{row['price']:.2f}", f"{row['value']:.2f}"])
+        output = make_response(si.getvalue())
+        output.headers["Content-Disposition"] = f"attachment; filename=stock_valuation_{as_of_date.strftime('%Y%m%d')}.csv"
+        output.headers["Content-type"] = "text/csv"
+        return output
+
+    return render_template('stock_valuation.html',
+                         as_of_date=as_of_date,
+                         rows=rows,
+                         total_value=total_value)
+
+# Margin analytics over the FIFO costs stored on sale lines
+MARGIN_GROUPS = ('medicine', 'supplier', 'day', 'month')
+
+def margin_report(group, start, end):
+    """Revenue, cost and margin of the sale lines sold from ``start`` up to
+    (not including) ``end``, live and archived, one row per medicine,
+    supplier, day or month. Revenue is the line total before sale-level
+    discount and tax; the margin only covers lines that have a cost, and
+    ``uncosted`` counts the others (recorded before costing and not
+    backfilled yet)."""
+    key, label = {
+        'medicine': (SaleItem.medicine_id, Medicine.name),
+        'supplier': (Medicine.supplier_id, Supplier.name),
+        'day': (func.date(Sale.sale_date), func.date(Sale.sale_date)),
+        'month': (func.strftime('%Y-%m', Sale.sale_date), func.strftime('%Y-%m', Sale.sale_date)),
+    }[group]
+    costed = SaleItem.cost_amount.isnot(None)
+    query = db.select(
+        key, label,
+        func.sum(SaleItem.quantity),
+        func.sum(SaleItem.total_price),
+        func.sum(db.case((costed, SaleItem.total_price), else_=0)),
+        func.sum(SaleItem.cost_amount),
+        func.sum(db.case((costed, 0), else_=1)),
+    ).select_from(SaleItem).join(Sale, Sale.id == SaleItem.sale_id)
+    if group in ('medicine', 'supplier'):
+        query = query.outerjoin(Medicine, Medicine.id == SaleItem.medicine_id)
+    if group == 'supplier':
+        query = query.outerjoin(Supplier, Supplier.id == Medicine.supplier_id)
+    query = query.where(Sale.sale_date >= start, Sale.sale_date < end).group_by(key, label)
+
+    sums = {}  # key -> [label, quantity, revenue, costed revenue, cost, uncosted]
+
+    def add(rows):
+        for key_value, name, *values in rows:
+            entry = sums.setdefault(key_value, [name, 0, 0, 0, 0, 0])
+            entry[0] = entry[0] or name
+            for i, value in enumerate(values, 1):
+                entry[i] += value or 0
+
+    add(db.session.execute(query))
+    archives = archived_years(start, end)
+    if archives:
+        store = archive_store()
+        # Archived lines carry the medicine, not its supplier
+        archived = [row for year, _ in archives
+                    for row in store.margins(year, 'medicine' if group == 'supplier' else group, start, end)]
+        if group == 'supplier':
+            suppliers = {medicine_id: (supplier_id, name) for medicine_id, supplier_id, name in db.session.execute(
+                db.select(Medicine.id, Medicine.supplier_id, Supplier.name)
+                .outerjoin(Supplier, Supplier.id == Medicine.supplier_id))}
+            archived = [(*suppliers.get(medicine_id, (None, None)), *values) for medicine_id, _, *values in archived]
+        add(archived)
+
+    rows = []
+    for key_value, (name, quantity, revenue, costed_revenue, cost, uncosted) in sums.items():
+        margin = (costed_revenue or 0) - (cost or 0)
+        rows.append({
+            'key': key_value,
+            'label': name or ('No supplier' if group == 'supplier' else 'Deleted medicine'),
+            'quantity': quantity or 0,
+            'revenue': revenue or 0,
+            'costed_revenue': costed_revenue or 0,
+            'cost': cost or 0,
+            'margin': margin,
+            'margin_percent': margin / costed_revenue * 100 if costed_revenue else None,
+            'uncosted': uncosted or 0,
+        })
+    if group in ('day', 'month'):
+        rows.sort(key=lambda row: row['key'])
+    else:
+        rows.sort(key=lambda row: row['margin'], reverse=True)
+    return rows
+
+@app.route('/reports/margins')
+@login_required
+@reporting_route
+def margin_analysis():
+    group = request.args.get('group', 'medicine')
+    if group not in MARGIN_GROUPS:
+        group = 'medicine'
+    today = datetime.utcnow().date()
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') \
+            else today.replace(day=1)
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'danger')
+        return redirect(url_for('margin_analysis'))
+    rows = margin_report(group, datetime.combine(start, datetime.min.time()),
+                         datetime.combine(end + timedelta(days=1), datetime.min.time()))
+
+    if request.args.get('format') == 'csv':
+        return csv_response(
+            [group.capitalize(), 'Quantity', 'Revenue', 'Cost', 'Margin', 'Margin %', 'Uncosted lines'],
+            ([row['label'], row['quantity'], f"{row['revenue']:.2f}", f"{row['cost']:.2f}", f"{row['margin']:.2f}",
+              '' if row['margin_percent'] is None else f"{row['margin_percent']:.1f}", row['uncosted']]
+             for row in rows),
+            f"margins_{group}_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.csv")
+
+    totals = {name: sum(row[name] for row in rows)
+              for name in ('quantity', 'revenue', 'costed_revenue', 'cost', 'margin', 'uncosted')}
+    totals['margin_percent'] = totals['margin'] / totals['costed_revenue'] * 100 if totals['costed_revenue'] else None
+    return render_template('margins.html', rows=rows, totals=totals, group=group, groups=MARGIN_GROUPS,
+                           start=start, end=end)
+
+# Stock reconciliation against purchase/sale history
+@app.route('/admin/reconciliation', methods=['GET', 'POST'])
+@login_required
+def stock_reconciliation():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        selected = None if request.form.get('apply_all') else {
+            int(medicine_id) for medicine_id in request.form.getlist('medicine_id[]')}
+        drift, _ = reconcile_stock(apply=True, medicine_ids=selected)
+        db.session.commit()
+        flash(f'Corrected stock for {len(drift)} medicines.', 'success')
+        return redirect(url_for('stock_reconciliation'))
+
+    drift, orphans = reconcile_stock()
+    return render_template('reconciliation.html', drift=drift, orphans=orphans)
+
+# Request profiler
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+@login_required
+def profiler_index():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        mode = request.form.get('mode', 'cprofile')
+        save_profiler_settings({
+            'endpoints': [endpoint for endpoint in request.form.getlist('endpoints[]') if endpoint in app.view_functions],
+            'sample_percent': min(max(request.form.get('sample_percent', 0.0, type=float), 0.0), 100.0),
+            'mode': mode if mode in profiler.MODES else 'cprofile',
+        })
+        flash('Profiler settings saved.', 'success')
+        return redirect(url_for('profiler_index'))
+
+    endpoints = sorted(endpoint for endpoint in app.view_functions
+                       if endpoint != 'static' and not endpoint.startswith('profiler'))
+    return render_template('profiler.html', settings=profiler_settings(), endpoints=endpoints,
+                           profiles=profiler.list_profiles(app.config['PROFILE_FOLDER']), modes=profiler.MODES)
+
+@app.route('/admin/profiler/clear', methods=['POST'])
+@login_required
+def profiler_clear():
+    if not current_user.is_admin:
+        abort(403)
+    profiler.prune_profiles(app.config['PROFILE_FOLDER'], 0)
+    flash('Stored profiles deleted.', 'success')
+    return redirect(url_for('profiler_index'))
+
+@app.route('/admin/profiler/<profile_id>')
+@login_required
+def profiler_detail(profile_id):
+    if not current_user.is_admin:
+        abort(403)
+    record = profiler.load_profile(app.config['PROFILE_FOLDER'], profile_id)
+    if record is None:
+        abort(404)
+    has_pstats = os.path.exists(os.path.join(app.config['PROFILE_FOLDER'], record['id'] + '.prof'))
+    return render_template('profile_detail.html', profile=record, has_pstats=has_pstats)
+
+@app.route('/admin/profiler/<profile_id>/collapsed')
+@login_required
+def profiler_collapsed(profile_id):
+    """Collapsed stacks (one "frame;frame value" line per stack, microseconds)
+    for flamegraph.pl, speedscope or inferno."""
+    if not current_user.is_admin:
+        abort(403)
+    record = profiler.load_profile(app.config['PROFILE_FOLDER'], profile_id)
+    if record is None:
+        abort(404)
+    stacks = profiler.collapsed_stacks(app.config['PROFILE_FOLDER'], record)
+    lines = ''.join(f'{stack} {value}\n' for stack, value in sorted(stacks.items()) if value)
+    response = make_response(lines)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['Content-Disposition'] = f'attachment; filename={record["id"]}.collapsed.txt'
+    return response
+
+@app.route('/admin/profiler/<profile_id>/pstats')
+@login_required
+def profiler_pstats(profile_id):
+    if not current_user.is_admin:
+        abort(403)
+    return send_from_directory(app.config['PROFILE_FOLDER'], os.path.basename(profile_id) + '.prof', as_attachment=True)
+
+@app.route('/admin/cache', methods=['GET', 'POST'])
+@login_required
+def cache_stats():
+    """Cache backend, size and hit/miss/eviction counts of this worker;
+    POST empties the cache for every worker."""
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        app_cache().clear()
+    return jsonify(app_cache().info())
+
+# Bulk medicine edits
+BULK_EDIT_FIELDS = ('price', 'supplier_id', 'batch_number', 'expiry_date', 'quantity')
+BULK_FILTER_KEYS = ('ids', 'supplier_id', 'name', 'all')
+# Relative changes for price and quantity: '*1.04', '+4%', '-2.5', '+10'
+_BULK_RELATIVE = re.compile(r'^([*+-])\s*(\d+(?:\.\d+)?)\s*(%?)$')
+
+class BulkEditError(ValueError):
+    pass
+
+def _bulk_value(field, raw):
+    """Parse one bulk edit value into ``(op, value)``.
+
+    ``op`` is None for an absolute value, ``'*'`` for a price factor and
+    ``'+'`` for a signed amount added to the current price or quantity.
+    """
+    if field not in BULK_EDIT_FIELDS:
+        raise BulkEditError(f'Unknown field: {field}')
+    if isinstance(raw, str):
+        raw = raw.strip()
+        match = _BULK_RELATIVE.match(raw) if field in ('price', 'quantity') else None
+        if match:
+            op, amount, percent = match.groups()
+            amount = float(amount)
+            if percent:
+                if op == '*' or field == 'quantity':
+                    raise BulkEditError(f'Invalid {field} change: {raw}')
+                return '*', 1 + amount / 100 if op == '+' else 1 - amount / 100
+            if op == '*':
+                if field == 'quantity':
+                    raise BulkEditError(f'Invalid quantity change: {raw}')
+                return '*', amount
+            amount = amount if op == '+' else -amount
+            if field == 'quantity' and amount != int(amount):
+                raise BulkEditError(f'Invalid quantity change: {raw}')
+            return '+', int(amount) if field == 'quantity' else amount
+    try:
+        if field == 'price':
+            return None, float(raw)
+        if field == 'quantity':
+            return None, int(raw)
+        if field == 'supplier_id':
+            return None, int(raw) if raw not in (None, '') else None
+        if field == 'expiry_date':
+            return None, raw if isinstance(raw, date) else datetime.strptime(raw, '%Y-%m-%d').date()
+        return None, str(raw)
+    except (TypeError, ValueError):
+        raise BulkEditError(f'Invalid {field}: {raw!r}')
+
+def _apply_bulk_value(field, old, op, value):
+    if op == '*':
+        return round(old * value, 2)
+    if op == '+':
+        return round(old + value, 2) if field == 'price' else old + value
+    return value
+
+def _bulk_sql_value(field, op, value):
+    column = getattr(Medicine, field)
+    if op == '*':
+        return func.round(column * value, 2)
+    if op == '+':
+        return func.round(column + value, 2) if field == 'price' else column + value
+    return db.literal(value, column.type)
+
+def bulk_changes_from_csv(text):
+    """Row changes from a CSV with an ``id`` column and any of
+    BULK_EDIT_FIELDS; empty cells leave the field unchanged."""
+    rows = []
+    for line, row in enumerate(csv.DictReader(StringIO(text)), start=2):
+        if not (row.get('id') or '').strip():
+            raise BulkEditError(f'Line {line}: missing id')
+        rows.append({key.strip(): value for key, value in row.items() if key and value not in (None, '')})
+    return rows
+
+def bulk_edit_medicines(payload, apply=False):
+    """Preview or apply a bulk edit of medicines.
+
+    ``payload`` is either ``{'changes': [{'id': 1, 'price': 12.5}, ...]}``
+    (one row per medicine) or ``{'filter': {'supplier_id': 3}, 'set':
+    {'price': '+4%'}}``. Filtered edits run as single set-based UPDATEs;
+    row changes as one executemany UPDATE per field. Quantity changes are
+    written to the stock ledger as adjustments, and the catalog change log
+    and supplier stats are updated in the same transaction. Returns
+    ``{'count', 'changes', 'applied'}``, with every changed field and its
+    old and new value; the caller commits.
+    """
+    if not isinstance(payload, dict):
+        raise BulkEditError('Expected a JSON object')
+    if 'changes' in payload:
+        if not isinstance(payload['changes'], list):
+            raise BulkEditError('"changes" must be a list of rows')
+        changes, rows = _bulk_row_diff(payload['changes'])
+    elif 'set' in payload:
+        if not isinstance(payload['set'], dict) or not isinstance(payload.get('filter') or {}, dict):
+            raise BulkEditError('"filter" and "set" must be objects')
+        changes, rows = _bulk_filter_diff(payload.get('filter') or {}, payload['set'])
+    else:
+        raise BulkEditError('Expected "changes" or "filter" and "set"')
+
+    problems = [str(change['id']) for change in changes
+                if change['field'] in ('price', 'quantity') and change['new'] < 0]
+    if problems:
+        raise BulkEditError('Price and stock cannot go negative (medicines ' + ', '.join(problems) + ')')
+    supplier_ids = {change['new'] for change in changes if change['field'] == 'supplier_id'} - {None}
+    missing = supplier_ids - {row[0] for row in db.session.execute(
+        db.select(Supplier.id).where(Supplier.id.in_(supplier_ids)))}
+    if missing:
+        raise BulkEditError('Unknown supplier ids: ' + ', '.join(map(str, sorted(missing))))
+
+    medicine_ids = {change['id'] for change in changes}
+    if apply and changes:
+        conn = db.session.connection()
+        if 'changes' in payload:
+            _apply_bulk_rows(conn, changes)
+        else:
+            _apply_bulk_filter(conn, payload.get('filter') or {}, payload['set'])
+        record_bulk_catalog_changes(conn, sorted(medicine_ids))
+        affected = {supplier_id for medicine_id, supplier_id in rows if medicine_id in medicine_ids} | supplier_ids
+        rebuild_supplier_stats(affected - {None}, conn)
+        db.session.expire_all()
+    return {'count': len(medicine_ids), 'changes': changes, 'applied': bool(apply and changes)}
+
+def _bulk_row_diff(raw_changes):
+    parsed = {}
+    for raw in raw_changes:
+        try:
+            medicine_id = int(raw['id'])
+        except (KeyError, TypeError, ValueError):
+            raise BulkEditError(f'Invalid id in {raw!r}')
+        if medicine_id in parsed:
+            raise BulkEditError(f'Medicine {medicine_id} is listed twice')
+        parsed[medicine_id] = {field: _bulk_value(field, value) for field, value in raw.items() if field != 'id'}
+    columns = [getattr(Medicine, field) for field in BULK_EDIT_FIELDS]
+    current = {row[0]: row for row in db.session.execute(
+        db.select(Medicine.id, Medicine.name, *columns).where(Medicine.id.in_(list(parsed))))}
+    unknown = sorted(set(parsed) - set(current))
+    if unknown:
+        raise BulkEditError('Unknown medicine ids: ' + ', '.join(map(str, unknown)))
+
+    changes = []
+    for medicine_id, fields in parsed.items():
+        row = current[medicine_id]
+        for field, (op, value) in fields.items():
+            old = row[2 + BULK_EDIT_FIELDS.index(field)]
+            new = _apply_bulk_value(field, old, op, value)
+            if new != old:
+                changes.append({'id': medicine_id, 'name': row[1], 'field': field, 'old': old, 'new': new})
+    return changes, [(row[0], row[2 + BULK_EDIT_FIELDS.index('supplier_id')]) for row in current.values()]
+
+def _bulk_conditions(spec):
+    unknown = set(spec) - set(BULK_FILTER_KEYS)
+    if unknown:
+        raise BulkEditError('Unknown filter: ' + ', '.join(sorted(unknown)))
+    conditions = []
+    if 'ids' in spec:
+        try:
+            conditions.append(Medicine.id.in_([int(medicine_id) for medicine_id in spec['ids']]))
+        except (TypeError, ValueError):
+            raise BulkEditError(f"Invalid ids filter: {spec['ids']!r}")
+    if 'supplier_id' in spec:
+        supplier_id = spec['supplier_id']
+        try:
+            conditions.append(Medicine.supplier_id.is_(None) if supplier_id in (None, '')
+                              else Medicine.supplier_id == int(supplier_id))
+        except (TypeError, ValueError):
+            raise BulkEditError(f'Invalid supplier_id filter: {supplier_id!r}')
+    if spec.get('name'):
+        conditions.append(Medicine.name.ilike(f"%{spec['name']}%"))
+    if not conditions and not spec.get('all'):
+        raise BulkEditError('A filter is required; use {"all": true} to edit every medicine')
+    return conditions
+
+def _bulk_filter_diff(spec, assignments):
+    conditions = _bulk_conditions(spec)
+    values = {field: _bulk_value(field, raw) for field, raw in assignments.items()}
+    fields = list(values)
+    query = db.select(
+        Medicine.id, Medicine.name, Medicine.supplier_id,
+        *[getattr(Medicine, field) for field in fields],
+        *[_bulk_sql_value(field, *values[field]) for field in fields]
+    ).where(*conditions).order_by(Medicine.id)
+    changes, rows = [], []
+    for row in db.session.execute(query):
+        rows.append((row[0], row[2]))
+        for i, field in enumerate(fields):
+            old, new = row[3 + i], row[3 + len(fields) + i]
+            if new != old:
+                changes.append({'id': row[0], 'name': row[1], 'field': field, 'old': old, 'new': new})
+    return changes, rows
+
+def _apply_bulk_rows(conn, changes):
+    medicine = Medicine.__table__
+    for field in BULK_EDIT_FIELDS:
+        params = [{'b_id': change['id'], 'b_value': change['new']} for change in changes if change['field'] == field]
+        if params:
+            conn.execute(medicine.update().where(medicine.c.id == bindparam('b_id'))
+                         .values({field: bindparam('b_value')}), params)
+    now = datetime.utcnow()
+    movements = [
+        {'medicine_id': change['id'], 'movement_type': 'adjustment', 'quantity': change['new'] - change['old'],
+         'note': 'Bulk edit', 'created_at': now}
+        for change in changes if change['field'] == 'quantity'
+    ]
+    if movements:
+        conn.execute(StockMovement.__table__.insert(), movements)
+        removed = [{'b_id': row['medicine_id'], 'b_quantity': -row['quantity']}
+                   for row in movements if row['quantity'] < 0]
+        if removed:
+            conn.execute(release_lots_statement(db.select(
+                bindparam('b_id', type_=db.Integer).label('medicine_id'),
+                bindparam('b_quantity', type_=db.Integer).label('quantity')).subquery()), removed)
+
+def _apply_bulk_filter(conn, spec, assignments):
+    conditions = _bulk_conditions(spec)
+    values = {field: _bulk_sql_value(field, *_bulk_value(field, raw)) for field, raw in assignments.items()}
+    if 'quantity' in values:
+        # Ledger rows first, while the filter still sees the old quantities
+        delta = values['quantity'] - Medicine.quantity
+        conn.execute(StockMovement.__table__.insert().from_select(
+            ['medicine_id', 'movement_type', 'quantity', 'note', 'created_at'],
+            db.select(Medicine.id, db.literal('adjustment'), delta, db.literal('Bulk edit'),
+                      db.literal(datetime.utcnow(), db.DateTime)).where(*conditions, delta != 0)
+        ))
+        conn.execute(release_lots_statement(db.select(Medicine.id.label('medicine_id'), (-delta).label('quantity'))
+                                            .where(*conditions, delta < 0).subquery()))
+    conn.execute(Medicine.__table__.update().where(*conditions).values(values))
+
+def _bulk_json(result):
+    for change in result['changes']:
+        for key in ('old', 'new'):
+            if isinstance(change[key], date):
+                change[key] = change[key].strftime('%Y-%m-%d')
+    return result
+
+@app.route('/api/medicines/bulk-edit', methods=['POST'])
+@login_required
+def bulk_edit():
+    """Preview (default) or apply a bulk edit. Accepts a JSON body (see
+    bulk_edit_medicines) or a CSV upload in ``file``; pass ``apply=1`` to
+    commit it."""
+    if not current_user.is_admin:
+        abort(403)
+    try:
+        if request.is_json:
+            payload = request.get_json()
+            if not isinstance(payload, dict):
+                raise BulkEditError('Expected a JSON object')
+            apply = bool(payload.get('apply')) or request.args.get('apply') == '1'
+        elif 'file' in request.files:
+            payload = {'changes': bulk_changes_from_csv(request.files['file'].read().decode('utf-8-sig'))}
+            apply = request.form.get('apply') == '1' or request.args.get('apply') == '1'
+        else:
+            raise BulkEditError('Send a JSON body or a CSV file')
+        result = bulk_edit_medicines(payload, apply=apply)
+    except BulkEditError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify(_bulk_json(result))
+
+# Demand forecasting and reorder suggestions
+def generate_reorder_suggestions(today=None):
+    """Forecast daily demand for every medicine and store reorder suggestions.
+
+    Runs two queries regardless of catalog size: the grouped sales history and
+    the current stock. Smoothing and reorder maths run vectorized in NumPy.
+    Returns the number of medicines that need reordering.
+    """
+    if forecasting is None:
+        raise RuntimeError('NumPy is required for demand forecasting (pip install numpy)')
+
+    config = app.config
+    days = config['FORECAST_HISTORY_DAYS']
+    today = today or datetime.utcnow().date()
+    start = forecasting.history_window(today, days)
+
+    stock_rows = db.session.query(Medicine.id, Medicine.quantity, Medicine.supplier_id).order_by(Medicine.id).all()
+    medicine_ids = [row.id for row in stock_rows]
+    history = db.session.query(
+        SaleItem.medicine_id,
+        func.date(Sale.sale_date),
+        func.sum(SaleItem.quantity)
+    ).join(
+        Sale, Sale.id == SaleItem.sale_id
+    ).filter(
+        Sale.sale_date >= datetime.combine(start, datetime.min.time())
+    ).group_by(
+        SaleItem.medicine_id, func.date(Sale.sale_date)
+    ).all()
+
+    matrix = forecasting.demand_matrix(medicine_ids, history, start, days)
+    if config['FORECAST_METHOD'] == 'sma':
+        demand = forecasting.moving_average(matrix, config['FORECAST_SMA_WINDOW'])
+    else:
+        demand = forecasting.exponential_smoothing(matrix, config['FORECAST_ALPHA'])
+    days_of_cover, reorder = forecasting.reorder_plan(
+        demand,
+        [row.quantity for row in stock_rows],
+        config['REORDER_LEAD_TIME_DAYS'],
+        config['REORDER_COVER_DAYS'],
+        config['REORDER_SAFETY_DAYS']
+    )
+
+    now = datetime.utcnow()
+    suggestions = [
+        {
+            'medicine_id': row.id,
+            'supplier_id': row.supplier_id,
+            'current_stock': row.quantity,
+            'daily_demand': float(demand[i]),
+            'days_of_cover': float(days_of_cover[i]) if demand[i] > 0 else None,
+            'reorder_quantity': int(reorder[i]),
+            'method': config['FORECAST_METHOD'],
+            'generated_at': now,
+        }
+        for i, row in enumerate(stock_rows)
+        if reorder[i] > 0
+    ]
+
+    # Replace the previous run in one transaction
+    db.session.query(ReorderSuggestion).delete()
+    if suggestions:
+        db.session.execute(ReorderSuggestion.__table__.insert(), suggestions)
+    db.session.commit()
+    return len(suggestions)
+
+@app.route('/reports/reorder')
+@login_required
+@reporting_route
+def reorder_suggestions():
+    suggestions = ReorderSuggestion.query.order_by(
+        ReorderSuggestion.supplier_id,
+        ReorderSuggestion.days_of_cover
+    ).all()
+
+    by_supplier = {}
+    for suggestion in suggestions:
+        by_supplier.setdefault(suggestion.supplier, []).append(suggestion)
+    generated_at = suggestions[0].generated_at if suggestions else None
+
+    return render_template('reorder.html',
+                         by_supplier=by_supplier,
+                         generated_at=generated_at,
+                         forecasting_available=forecasting is not None)
+
+@app.route('/reports/reorder/refresh', methods=['POST'])
+@login_required
+def refresh_reorder_suggestions():
+    try:
+        count = generate_reorder_suggestions()
+        flash(f'Reorder suggestions updated: {count} medicines need restocking.', 'success')
+    except RuntimeError as e:
+        flash(str(e), 'danger')
+    return redirect(url_for('reorder_suggestions'))
 
 # Export reports as CSV
+class _CSVLine:
+    """File-like target that hands back each row csv.writer formats."""
+    def write(self, line):
+        return line
+
+def csv_response(header, rows, filename, rows_per_chunk=500):
+    """Stream a CSV download in chunks of rows as the query yields them, so
+    large exports neither build the whole file in memory nor wait for it
+    before the first byte (the compression middleware compresses the
+    chunks as they pass)."""
+    writer = csv.writer(_CSVLine())
+
+    def generate():
+        chunk = [writer.writerow(header)]
+        for row in rows:
+            chunk.append(writer.writerow(row))
+            if len(chunk) >= rows_per_chunk:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
 @app.route('/export/report/<string:report_type>')
 @login_required
+@reporting_route
 def export_report(report_type):
     if report_type == 'sales':
-        # Get sales data
         sales = db.session.query(
             Sale.invoice_number,
             Sale.sale_date,
             Sale.customer_name,
             Sale.total_amount,
             Sale.payment_method
-        ).order_by(Sale.sale_date.desc()).all()
-        
-        # Create CSV data
-        si = StringIO()
-        cw = csv.writer(si)
-        cw.writerow(['Invoice #', 'Date', 'Customer', 'Total Amount', 'Payment Method'])
+        ).order_by(Sale.sale_date.desc()).yield_per(1000)
         
-        for sale in sales:
-            cw.writerow([
+        return csv_response(
+            ['Invoice #', 'Date', 'Customer', 'Total Amount', 'Payment Method'],
+            ([
                 sale.invoice_number,
                 sale.sale_date.strftime('%Y-%m-%d %H:%M'),
                 sale.customer_name,
                 f"{sale.total_amount:.2f}",
                 sale.payment_method
-            ])
-        
-        # Prepare the response
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = f"attachment; filename=sales_report_{datetime.utcnow().strftime('%Y%m%d')}.csv"
-        output.headers["Content-type"] = "text/csv"
-        
-        return output
+            ] for sale in sales),
+            f"sales_report_{datetime.utcnow().strftime('%Y%m%d')}.csv"
+        )
     
     elif report_type == 'inventory':
-        # Get inventory data
         inventory = db.session.query(
             Medicine.name,
             Medicine.batch_number,
@@ -605,34 +3648,26 @@ def export_report(report_type):
             Supplier, Medicine.supplier_id == Supplier.id
         ).order_by(
             Medicine.quantity.asc()
-        ).all()
+        ).yield_per(1000)
         
-        # Create CSV data
-        si = StringIO()
-        cw = csv.writer(si)
-        cw.writerow(['Medicine', 'Batch Number', 'Quantity', 'Price (₹)', 'Supplier'])
-        
-        for item in inventory:
-            cw.writerow([
+        return csv_response(
+            ['Medicine', 'Batch Number', 'Quantity', 'Price (₹)', 'Supplier'],
+            ([
                 item.name,
                 item.batch_number or 'N/A',
                 item.quantity,
                 f"{float(item.price):.2f}",
                 item.supplier_name or 'N/A'
-            ])
-        
-        # Prepare the response
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = f"attachment; filename=inventory_report_{datetime.utcnow().strftime('%Y%m%d')}.csv"
-        output.headers["Content-type"] = "text/csv"
-        
-        return output
+            ] for item in inventory),
+            f"inventory_report_{datetime.utcnow().strftime('%Y%m%d')}.csv"
+        )
     
     flash('Invalid report type', 'error')
     return redirect(url_for('reports'))
 
 @app.route('/reports/export')
 @login_required
+@reporting_route
 def export_reports():
     # Get date range from query parameters
     start_date = request.args.get('start_date')
@@ -645,26 +3680,34 @@ def export_reports():
     if end_date:
         end_date = datetime.strptime(end_date, '%Y-%m-%d')
     
-    # Create a file-like buffer to receive CSV data
-    si = StringIO()
-    cw = csv.writer(si)
-    
     if report_type == 'sales':
         # Sales Report
-        query = Sale.query
+        # Units per sale come from a correlated subquery on the
+        # (sale_id, quantity) index instead of loading every sale's items
+        item_count = db.select(func.coalesce(func.sum(SaleItem.quantity), 0)).where(
+            SaleItem.sale_id == Sale.id).correlate(Sale).scalar_subquery()
+        # Only the printed columns, as rows; the archive rows have the same names
+        query = db.session.query(
+            Sale.invoice_number, Sale.sale_date, Sale.customer_name, Sale.total_amount, Sale.discount,
+            Sale.tax_amount, Sale.payment_method, item_count.label('item_count'))
         
         if start_date and end_date:
             query = query.filter(Sale.sale_date.between(start_date, end_date))
         
-        sales = query.order_by(Sale.sale_date.desc()).all()
+        def sales():
+            for sale in query.order_by(Sale.sale_date.desc()).yield_per(1000):
+                yield sale, sale.item_count
+            # Archived years follow (they are older than every live sale),
+            # only when the requested range reaches them
+            store = archive_store()
+            for year, _ in archived_years(start_date if end_date else None, end_date if start_date else None):
+                for sale in store.sales(year, start=start_date if end_date else None,
+                                        end=end_date if start_date else None):
+                    yield sale, sale.item_count
         
-        # Write CSV header
-        cw.writerow(['Invoice #', 'Date', 'Customer', 'Items', 'Subtotal', 'Discount', 'Tax', 'Total', 'Payment Method'])
-        
-        # Write data rows
-        for sale in sales:
-            item_count = sum(item.quantity for item in sale.items)
-            cw.writerow([
+        return csv_response(
+            ['Invoice #', 'Date', 'Customer', 'Items', 'Subtotal', 'Discount', 'Tax', 'Total', 'Payment Method'],
+            ([
                 sale.invoice_number,
                 sale.sale_date.strftime('%Y-%m-%d %H:%M'),
                 sale.customer_name,
@@ -674,20 +3717,19 @@ def export_reports():
                 sale.tax_amount,
                 sale.total_amount,
                 sale.payment_method
-            ])
-        
-        filename = f'sales_report_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
+            ] for sale, item_count in sales()),
+            f'sales_report_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
+        )
     
     elif report_type == 'inventory':
         # Inventory Report
-        medicines = Medicine.query.order_by(Medicine.name).all()
+        medicines = medicine_records(medicine_select(
+            'id', 'name', 'description', 'batch_number', 'quantity', 'price', 'supplier_name', 'expiry_date'
+        ).order_by(Medicine.name))
         
-        # Write CSV header
-        cw.writerow(['ID', 'Name', 'Description', 'Batch #', 'Quantity', 'Price', 'Supplier', 'Expiry Date'])
-        
-        # Write data rows
-        for med in medicines:
-            cw.writerow([
+        return csv_response(
+            ['ID', 'Name', 'Description', 'Batch #', 'Quantity', 'Price', 'Supplier', 'Expiry Date'],
+            ([
                 med.id,
                 med.name,
                 med.description or '',
@@ -696,15 +3738,81 @@ def export_reports():
                 med.price,
                 med.supplier_ref.name if med.supplier_ref else '',
                 med.expiry_date.strftime('%Y-%m-%d') if med.expiry_date else ''
-            ])
-        
-        filename = f'inventory_report_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
+            ] for med in medicines),
+            f'inventory_report_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
+        )
     
-    # Prepare the response
+    flash('Invalid report type', 'error')
+    return redirect(url_for('reports'))
+
+# Consolidated multi-branch reports
+def branch_urls():
+    """Per-branch URLs for the report workers, preferring each branch's
+    reporting engine when it is fresh enough."""
+    urls = {}
+    for code in app.config['BRANCHES']:
+        engine = fresh_reporting_engine(None if code == app.config['DEFAULT_BRANCH'] else code)
+        urls[code] = engine.url.render_as_string(hide_password=False) if engine is not None \
+            else branch_database_url(code)
+    return urls
+
+@app.route('/reports/consolidated')
+@login_required
+def consolidated_reports():
+    today = datetime.utcnow()
+    first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    dates = [(first_day + timedelta(days=i)).strftime('%Y-%m-%d')
+             for i in range((today - first_day).days + 1)]
+
+    # Every branch database is queried in its own worker process
+    results = branch_reports.fan_out(branch_reports.branch_report, branch_urls(), first_day, today,
+                                     app.config['LOW_STOCK_THRESHOLD'])
+    merged = branch_reports.merge_reports(results, dates)
+
+    return render_template('consolidated_reports.html',
+                         start_date=first_day,
+                         end_date=today,
+                         dates=dates,
+                         **merged)
+
+@app.route('/reports/consolidated/export')
+@login_required
+def export_consolidated_reports():
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    report_type = request.args.get('type', 'sales')
+    if report_type not in ('sales', 'inventory'):
+        flash('Invalid report type', 'error')
+        return redirect(url_for('consolidated_reports'))
+
+    if start_date:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+    if end_date:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d')
+
+    results = branch_reports.fan_out(branch_reports.branch_export, branch_urls(), report_type, start_date, end_date,
+                                     archive_folder={code: archive_folder(code) for code in app.config['BRANCHES']})
+
+    si = StringIO()
+    cw = csv.writer(si)
+    if report_type == 'sales':
+        cw.writerow(['Branch', 'Invoice #', 'Date', 'Customer', 'Items', 'Subtotal', 'Discount', 'Tax', 'Total', 'Payment Method'])
+    else:
+        cw.writerow(['Branch', 'ID', 'Name', 'Description', 'Batch #', 'Quantity', 'Price', 'Supplier', 'Expiry Date'])
+
+    for code, (rows, error) in results.items():
+        branch_name = app.config['BRANCHES'][code]['name']
+        if error:
+            cw.writerow([branch_name, f'ERROR: {error}'])
+            continue
+        for row in rows:
+            cw.writerow([branch_name] + row)
+
+    filename = f'consolidated_{report_type}_report_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}.csv'
     output = make_response(si.getvalue())
     output.headers["Content-Disposition"] = f"attachment; filename={filename}"
     output.headers["Content-type"] = "text/csv"
-    
+
     return output
 
 # Static files for logo
@@ -780,10 +3888,17 @@ def create_tables():
             except Exception:
                 print(f"Detected incompatible DB schema at {db_path}, recreating database...")
                 try:
+                    snapshot = backups.backup_database(
+                        db_path, os.path.join(app.config['BACKUP_FOLDER'], app.config['DEFAULT_BRANCH']),
+                        app.config['DEFAULT_BRANCH'])
+                    print(f"Old database backed up to {snapshot}")
                     os.remove(db_path)
                 except Exception as e:
                     print(f"Failed to remove old database: {e}")
-        db.create_all()
+        upgrade_schema(db.engine)
+        # Branch databases share the same schema as the main database
+        for code in app.config['SQLALCHEMY_BINDS']:
+            upgrade_schema(db.engines[code])
         
         # Create admin user if not exists
         admin = User.query.filter_by(username='Piyu').first()
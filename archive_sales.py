@@ -0,0 +1,44 @@
+"""Periodic job: move old sales out of the live tables into yearly archives.
+
+Sales older than ARCHIVE_AFTER_DAYS (or ``--older-than-days N``) are copied to
+``instance/archive/<branch>/sales_<year>.db`` (gzipped once the whole year is
+past the cutoff) and deleted from the live database, ``--chunk-size`` sales
+per transaction. Sales lists, reports and
+exports read the archives back when their date range reaches them. Schedule
+with cron, e.g. ``30 3 * * 0 cd /path/to/app && python archive_sales.py``.
+Pass ``--all-branches`` to run it against every registered branch database.
+"""
+import argparse
+import time
+
+from flask import g
+
+import app as app_module
+from app import archive_sales
+
+
+def run(branch, older_than_days, chunk_size):
+    with app_module.app.app_context():
+        g.branch = None if branch == app_module.app.config['DEFAULT_BRANCH'] else branch
+        app_module.upgrade_schema(app_module.db.engines[g.branch])
+        started = time.perf_counter()
+        moved = archive_sales(older_than_days, chunk_size)
+        summary = ', '.join(f'{year}: {count}' for year, count in sorted(moved.items())) or 'nothing to archive'
+        print(f'[{branch}] {summary} ({time.perf_counter() - started:.2f}s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--older-than-days', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--all-branches', action='store_true')
+    args = parser.parse_args()
+
+    config = app_module.app.config
+    targets = list(config['BRANCHES']) if args.all_branches else [config['DEFAULT_BRANCH']]
+    for branch in targets:
+        run(branch, args.older_than_days, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+"""ASGI entry point: async lookups next to the Flask app.
+
+The read-heavy terminal lookups of app.py (medicine search, stock, a sale,
+the dashboard figures) are served under ``/async/lookup/...`` on the event
+loop with an async SQLite driver (aiosqlite), so many terminals waiting on
+the database need no thread each. At most ASYNC_MAX_CONNECTIONS queries per
+branch run at once; further requests wait for a free connection. They use
+the same statements and JSON as the ``/lookup/...`` Flask routes and the
+same login session cookie. The dashboard's live stream
+(``/dashboard/stream``) is kept on the event loop too, so open dashboards
+hold no thread. Every other path goes to the Flask app, run on a pool of
+ASGI_WSGI_THREADS threads.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Requires the packages ``aiosqlite``, ``greenlet`` (for SQLAlchemy's asyncio
+support) and an ASGI server such as ``uvicorn``.
+"""
+import asyncio
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import (app, User, API_BATCH_LIMIT, LOOKUP_LIMIT, _api_ids, branch_database_url, dashboard_catch_up,
+                 dashboard_events_select, dashboard_kpi_selects, lookup_dashboard_json, lookup_medicines_json,
+                 lookup_medicines_select, lookup_sale_json, lookup_sale_selects, lookup_stock_json,
+                 lookup_stock_select)
+
+# Async drivers for the database URLs of the branch registry
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'mysql': 'mysql+aiomysql'}
+
+
+class LookupFailed(Exception):
+    """Answered with ``status`` and the message as the JSON error."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LookupService:
+    """The ``/async/lookup/...`` endpoints."""
+
+    routes = [
+        (re.compile(r'^/async/lookup/medicines$'), 'medicines'),
+        (re.compile(r'^/async/lookup/stock$'), 'stock'),
+        (re.compile(r'^/async/lookup/sales/(\d+)$'), 'sale'),
+        (re.compile(r'^/async/lookup/dashboard$'), 'dashboard'),
+    ]
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self._engines = {}
+        self._slots = {}
+
+    def engine(self, code):
+        """The async engine of branch ``code`` and its connection slots."""
+        if code not in self._engines:
+            with app.app_context():
+                url = make_url(branch_database_url(code))
+            driver = ASYNC_DRIVERS.get(url.get_backend_name())
+            if driver is None:
+                raise LookupFailed(501, f'No async driver for {url.get_backend_name()} databases')
+            self._engines[code] = create_async_engine(url.set(drivername=driver), pool_size=self.max_connections,
+                                                      max_overflow=0)
+            self._slots[code] = asyncio.Semaphore(self.max_connections)
+        return self._engines[code], self._slots[code]
+
+    async def execute(self, code, user_id, statements):
+        """Rows of each statement, on one connection of branch ``code``, after
+        checking that the session's user still exists (as Flask-Login's user
+        loader does). A ``user_id`` of None skips the check (for the server's
+        own queries)."""
+        if user_id is not None:
+            await self.check_user(user_id)
+        engine, slots = self.engine(code)
+        async with slots:
+            async with engine.connect() as conn:
+                return [(await conn.execute(statement)).all() for statement in statements]
+
+    async def check_user(self, user_id):
+        # Users are shared by every branch (__branch_shared__), so they are
+        # only in the default branch's database
+        engine, slots = self.engine(app.config['DEFAULT_BRANCH'])
+        async with slots:
+            async with engine.connect() as conn:
+                if (await conn.execute(select(User.id).where(User.id == user_id))).first() is None:
+                    raise LookupFailed(401, 'Login required')
+
+    def session(self, scope):
+        """``(user id, branch code)`` from the Flask session cookie."""
+        headers = dict(scope['headers'])
+        cookies = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+        morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+        serializer = app.session_interface.get_signing_serializer(app)
+        try:
+            data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds())) \
+                if morsel is not None else {}
+        except BadSignature:
+            data = {}
+        if not str(data.get('_user_id', '')).isdigit():
+            raise LookupFailed(401, 'Login required')
+        branch = data.get('branch', app.config['DEFAULT_BRANCH'])
+        if branch not in app.config['BRANCHES']:
+            branch = app.config['DEFAULT_BRANCH']
+        return int(data['_user_id']), branch
+
+    async def handle(self, name, match, args, user_id, code):
+        if name == 'medicines':
+            limit = min(int(args['limit']) if args.get('limit', '').isdigit() else LOOKUP_LIMIT, 100)
+            rows, = await self.execute(code, user_id, [lookup_medicines_select(args.get('q', ''), limit)])
+            return lookup_medicines_json(rows)
+        if name == 'stock':
+            ids = _api_ids([value for value in args.get('ids', '').split(',') if value])
+            if ids is None:
+                raise LookupFailed(400, f'ids must be a list of at most {API_BATCH_LIMIT} integers')
+            rows, = await self.execute(code, user_id, [lookup_stock_select(ids)])
+            return lookup_stock_json(ids, rows)
+        if name == 'sale':
+            sale, items = await self.execute(code, user_id, lookup_sale_selects(int(match.group(1))))
+            if not sale:
+                raise LookupFailed(404, 'Sale not found')
+            return lookup_sale_json(sale[0], items)
+        statements = dashboard_kpi_selects(app.config['LOW_STOCK_THRESHOLD'])
+        results = await self.execute(code, user_id, list(statements.values()))
+        return lookup_dashboard_json(dict(zip(statements, results)))
+
+    async def __call__(self, scope, receive, send):
+        status, data = 404, {'error': 'Not found'}
+        for pattern, name in self.routes:
+            match = pattern.match(scope['path'])
+            if match:
+                if scope['method'] not in ('GET', 'HEAD'):
+                    status, data = 405, {'error': 'Method not allowed'}
+                    break
+                args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+                try:
+                    user_id, code = self.session(scope)
+                    status, data = 200, await self.handle(name, match, args, user_id, code)
+                except LookupFailed as e:
+                    status, data = e.status, {'error': str(e)}
+                break
+        body = json.dumps(data).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                                (b'cache-control', b'no-store')]})
+        await send({'type': 'http.response.body', 'body': body if scope['method'] != 'HEAD' else b''})
+
+    async def close(self):
+        for engine in self._engines.values():
+            await engine.dispose()
+        self._engines.clear()
+        self._slots.clear()
+
+
+class BranchFeed:
+    """The open dashboard streams of one branch and the task polling its
+    event log. ``version`` is the id of the last event handed out."""
+
+    def __init__(self):
+        self.viewers = set()
+        self.version = None
+        self.task = None
+
+
+class DashboardStreams:
+    """``/dashboard/stream`` as long-lived Server-Sent Events.
+
+    One task per branch with open streams reads the dashboard_event log
+    every DASHBOARD_POLL_SECONDS and puts each new event on every viewer's
+    bounded queue, so a write reaches N viewers with one query and a waiting
+    or slow viewer costs no thread. A viewer whose queue fills up is told to
+    reload. Streams resume from the browser's last event id, which is the
+    same in every process since it comes from the database.
+    """
+
+    def __init__(self, lookups):
+        self.lookups = lookups
+        self._feeds = {}
+
+    @staticmethod
+    def deliver(feed, viewer, item):
+        try:
+            viewer.put_nowait(item)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop it and make it reload
+            feed.viewers.discard(viewer)
+            while not viewer.empty():
+                viewer.get_nowait()
+            viewer.put_nowait(None)
+
+    async def poll(self, code, feed):
+        try:
+            while feed.viewers:
+                await asyncio.sleep(app.config['DASHBOARD_POLL_SECONDS'])
+                if feed.version is None:
+                    continue
+                try:
+                    rows, bounds = await self.lookups.execute(
+                        code, None, dashboard_events_select(feed.version, app.config['DASHBOARD_QUEUE_SIZE'] + 1))
+                except Exception:
+                    app.logger.exception('Reading the dashboard events of %s failed', code)
+                    continue
+                messages = dashboard_catch_up(feed.version, rows, bounds[0])
+                for viewer in list(feed.viewers):
+                    if messages is None:
+                        self.deliver(feed, viewer, None)
+                    for row, message in zip(rows, messages or []):
+                        self.deliver(feed, viewer, (row.id, message))
+                if messages is None:
+                    feed.version = bounds[0][1] or 0
+                elif rows:
+                    feed.version = rows[-1].id
+        finally:
+            if self._feeds.get(code) is feed:
+                del self._feeds[code]
+
+    @staticmethod
+    async def respond(send, status, message, headers=()):
+        body = f'{message}\n'.encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain')] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            user_id, code = self.lookups.session(scope)
+        except LookupFailed as e:
+            return await self.respond(send, e.status, e)
+        headers = dict(scope['headers'])
+        args = parse_qs(scope['query_string'].decode('latin-1'))
+        since = headers.get(b'last-event-id', b'').decode('latin-1') or args.get('since', ['0'])[-1]
+        since = int(since) if since.isdigit() else -1
+
+        feed = self._feeds.setdefault(code, BranchFeed())
+        if len(feed.viewers) >= app.config['DASHBOARD_MAX_CLIENTS']:
+            return await self.respond(send, 503, 'Too many dashboard streams', [(b'retry-after', b'30')])
+        viewer = asyncio.Queue(maxsize=app.config['DASHBOARD_QUEUE_SIZE'])
+        # Subscribed before catching up, so no event falls in between;
+        # events seen twice are skipped by id
+        feed.viewers.add(viewer)
+        if feed.task is None or feed.task.done():
+            feed.task = asyncio.create_task(self.poll(code, feed))
+        disconnected = None
+        try:
+            try:
+                rows, bounds = await self.lookups.execute(
+                    code, user_id, dashboard_events_select(since, app.config['DASHBOARD_QUEUE_SIZE'] + 1))
+            except LookupFailed as e:
+                return await self.respond(send, e.status, e)
+            messages = dashboard_catch_up(since, rows, bounds[0])
+            if feed.version is None:
+                feed.version = bounds[0][1] or 0
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            if messages is None:
+                return await send({'type': 'http.response.body', 'body': b'event: reload\ndata: {}\n\n'})
+            await send({'type': 'http.response.body', 'body': ''.join(['retry: 3000\n\n'] + messages).encode(),
+                        'more_body': True})
+            last = rows[-1].id if rows else since
+            disconnected = asyncio.ensure_future(self.disconnect(receive))
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + app.config['DASHBOARD_STREAM_SECONDS']
+            while loop.time() < deadline:
+                getter = asyncio.ensure_future(viewer.get())
+                done, _ = await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=min(app.config['DASHBOARD_HEARTBEAT'], deadline - loop.time()))
+                if getter not in done:
+                    getter.cancel()
+                    if disconnected in done:
+                        return
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                    continue
+                item = getter.result()
+                if item is None:
+                    return await send({'type': 'http.response.body', 'body': b'event: reload\ndata: {}\n\n'})
+                event_id, message = item
+                if event_id > last:
+                    await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+                    last = event_id
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            feed.viewers.discard(viewer)
+            if disconnected is not None:
+                disconnected.cancel()
+
+    @staticmethod
+    async def disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def close(self):
+        for feed in list(self._feeds.values()):
+            if feed.task is not None:
+                feed.task.cancel()
+        self._feeds.clear()
+
+
+class WsgiBridge:
+    """Serve a WSGI app from ASGI, one request per pool thread. Chunks are
+    sent as the app yields them, so streamed responses (dashboard events,
+    CSV exports) stay streamed."""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+            else:
+                key = 'HTTP_' + name
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def run(self, environ, loop, send):
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: write(data)
+
+        def write(data):
+            if 'started' not in response:
+                call({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                response['started'] = True
+            if data:
+                call({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                write(chunk)
+            write(b'')
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run, self.environ(scope, bytes(body)), loop, send)
+
+
+lookups = LookupService(app.config['ASYNC_MAX_CONNECTIONS'])
+dashboards = DashboardStreams(lookups)
+flask_app = WsgiBridge(app, app.config['ASGI_WSGI_THREADS'])
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await dashboards.close()
+                await lookups.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http':
+        if scope['path'].startswith('/async/'):
+            await lookups(scope, receive, send)
+        elif scope['path'] == '/dashboard/stream':
+            await dashboards(scope, receive, send)
+        else:
+            await flask_app(scope, receive, send)
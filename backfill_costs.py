@@ -0,0 +1,34 @@
+"""Cost the sale lines recorded before FIFO costing existed.
+
+Replays the live sales and stock write-offs in date order against the
+purchase lots, storing each sale line's cost and each lot's remaining
+units. Safe to re-run: the whole history is recomputed, which also
+repairs lots after purchases were backdated. New sales are costed as they
+are recorded, so this is normally needed once per branch.
+
+Usage:
+    python backfill_costs.py [--all-branches]
+"""
+import sys
+
+from flask import g
+
+import app as app_module
+from app import db
+
+
+def main():
+    config = app_module.app.config
+    targets = list(config['BRANCHES']) if '--all-branches' in sys.argv else [config['DEFAULT_BRANCH']]
+    for branch in targets:
+        with app_module.app.app_context():
+            g.branch = None if branch == config['DEFAULT_BRANCH'] else branch
+            app_module.upgrade_schema(db.engines[g.branch])
+            costed = app_module.rebuild_sale_costs()
+            app_module.invalidate_cache('sales')
+            db.session.commit()
+            print(f'[{branch}] {costed} sale lines costed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Create Customer rows from the free-text contacts of existing sales and link
+the sales to them. Safe to re-run: only sales without a customer are touched.
+"""
+import sys
+
+from flask import g
+
+import app as app_module
+from app import db, Customer, Sale, normalize_phone
+
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def customer_ids(phones):
+    ids = {}
+    for chunk in chunks(phones):
+        ids.update(db.session.query(Customer.phone, Customer.id).filter(Customer.phone.in_(chunk)).all())
+    return ids
+
+
+def backfill():
+    # One pass over the distinct raw contacts (far fewer than sales), newest first
+    # so each customer keeps the name used on their latest invoice.
+    contacts = db.session.query(
+        Sale.customer_contact,
+        Sale.customer_name,
+        db.func.max(Sale.sale_date).label('last_sale')
+    ).filter(
+        Sale.customer_id.is_(None),
+        Sale.customer_contact.isnot(None)
+    ).group_by(Sale.customer_contact, Sale.customer_name).order_by(db.desc('last_sale')).all()
+
+    names = {}
+    raw_by_phone = {}
+    for raw, name, _ in contacts:
+        phone = normalize_phone(raw)
+        if not phone:
+            continue
+        names.setdefault(phone, name)
+        raw_by_phone.setdefault(phone, set()).add(raw)
+
+    existing = customer_ids(names)
+    new_customers = [{'name': names[phone], 'phone': phone} for phone in names if phone not in existing]
+    if new_customers:
+        db.session.execute(Customer.__table__.insert(), new_customers)
+        existing.update(customer_ids(c['phone'] for c in new_customers))
+
+    sale_table = Sale.__table__
+    linked = 0
+    for phone, raws in raw_by_phone.items():
+        result = db.session.execute(
+            sale_table.update().where(
+                sale_table.c.customer_contact.in_(list(raws)),
+                sale_table.c.customer_id.is_(None)
+            ).values(customer_id=existing[phone])
+        )
+        linked += result.rowcount
+    db.session.commit()
+    return len(new_customers), linked
+
+
+def main():
+    config = app_module.app.config
+    targets = list(config['BRANCHES']) if '--all-branches' in sys.argv else [config['DEFAULT_BRANCH']]
+    for branch in targets:
+        with app_module.app.app_context():
+            g.branch = None if branch == config['DEFAULT_BRANCH'] else branch
+            app_module.upgrade_schema(db.engines[g.branch])
+            created, linked = backfill()
+            print(f'[{branch}] {created} customers created, {linked} sales linked')
+
+
+if __name__ == '__main__':
+    main()
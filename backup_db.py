@@ -0,0 +1,79 @@
+"""Online backups of the store databases.
+
+    python backup_db.py backup [--all-branches]     snapshot, verify, prune
+    python backup_db.py backup --every 60           keep snapshotting hourly
+    python backup_db.py list [--branch CODE]
+    python backup_db.py restore SNAPSHOT [--branch CODE]
+
+Snapshots are copied with SQLite's online backup API, so checkout keeps
+working while they run, and each one is checked with ``PRAGMA
+integrity_check`` before it is kept. Only the newest BACKUP_RETENTION
+snapshots per branch are retained. Schedule with cron, e.g.
+``0 * * * * cd /path/to/app && python backup_db.py backup --all-branches``.
+A restore first snapshots the current database as ``<branch>-pre-restore``.
+"""
+import argparse
+import os
+import sys
+import time
+
+import app as app_module
+from backups import BackupError, list_backups
+
+
+def backup(targets):
+    failed = False
+    for branch in targets:
+        with app_module.app.app_context():
+            started = time.perf_counter()
+            try:
+                path, pruned = app_module.backup_branch(branch)
+            except (BackupError, OSError) as e:
+                print(f'[{branch}] backup failed: {e}', file=sys.stderr)
+                failed = True
+                continue
+            size = os.path.getsize(path) / 1024
+            print(f'[{branch}] {path} ({size:.0f} KiB, verified, {time.perf_counter() - started:.2f}s)'
+                  + (f'; pruned {len(pruned)} old snapshots' if pruned else ''))
+    return failed
+
+
+def main():
+    config = app_module.app.config
+    parser = argparse.ArgumentParser(description='Online backups of the store databases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backup_parser = commands.add_parser('backup')
+    backup_parser.add_argument('--all-branches', action='store_true')
+    backup_parser.add_argument('--every', type=int, metavar='MINUTES',
+                               help='keep running and take a snapshot every MINUTES minutes')
+    list_parser = commands.add_parser('list')
+    list_parser.add_argument('--branch', default=config['DEFAULT_BRANCH'], choices=list(config['BRANCHES']))
+    restore_parser = commands.add_parser('restore')
+    restore_parser.add_argument('snapshot')
+    restore_parser.add_argument('--branch', default=config['DEFAULT_BRANCH'], choices=list(config['BRANCHES']))
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        targets = list(config['BRANCHES']) if args.all_branches else [config['DEFAULT_BRANCH']]
+        failed = backup(targets)
+        while args.every:
+            time.sleep(args.every * 60)
+            backup(targets)
+        sys.exit(1 if failed else 0)
+
+    if args.command == 'list':
+        for path in list_backups(os.path.join(config['BACKUP_FOLDER'], args.branch), args.branch):
+            print(path)
+        return
+
+    with app_module.app.app_context():
+        try:
+            safety = app_module.restore_branch(args.branch, args.snapshot)
+        except (BackupError, OSError) as e:
+            print(f'[{args.branch}] restore failed: {e}', file=sys.stderr)
+            sys.exit(1)
+    print(f'[{args.branch}] restored from {args.snapshot} (previous state saved to {safety})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Online SQLite backups.
+
+Snapshots are taken with SQLite's backup API a few pages at a time. The
+source database is only locked while each step copies its pages, so sales
+keep committing while a backup runs; a write between steps makes SQLite
+restart the copy, which still yields a consistent point-in-time file. Only
+depends on the standard library so init_db.py can use it before the app is
+imported.
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+SNAPSHOT_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class BackupError(Exception):
+    pass
+
+
+def copy_database(source_path, dest_path, pages=256, sleep=0.005):
+    """Copy ``source_path`` into ``dest_path`` in steps of ``pages`` pages,
+    pausing ``sleep`` seconds between steps to let writers in."""
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=pages, sleep=sleep)
+    finally:
+        dest.close()
+        source.close()
+
+
+def verify_backup(path):
+    """Open a snapshot and run ``PRAGMA integrity_check``; raises BackupError
+    unless SQLite reports ``ok``."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f'{path}: {e}') from e
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise BackupError(f'{path}: ' + '; '.join(result))
+
+
+def snapshot_name(prefix, taken_at=None):
+    return f'{prefix}-{(taken_at or datetime.utcnow()).strftime(SNAPSHOT_TIME_FORMAT)}.db'
+
+
+def backup_database(source_path, folder, prefix, pages=256, sleep=0.005):
+    """Write a verified snapshot of ``source_path`` into ``folder``.
+
+    The copy goes to a temporary name and is only renamed once it passes the
+    integrity check, so a listed snapshot is always restorable.
+    """
+    if not os.path.exists(source_path):
+        raise BackupError(f'{source_path} does not exist')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, snapshot_name(prefix))
+    partial = path + '.partial'
+    try:
+        copy_database(source_path, partial, pages, sleep)
+        verify_backup(partial)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path
+
+
+def list_backups(folder, prefix):
+    """Snapshots of ``prefix`` in ``folder``, newest first."""
+    if not os.path.isdir(folder):
+        return []
+    names = [name for name in os.listdir(folder) if _is_snapshot(name, prefix)]
+    return [os.path.join(folder, name) for name in sorted(names, reverse=True)]
+
+
+def _is_snapshot(name, prefix):
+    stamp = name[len(prefix) + 1:-len('.db')]
+    if not (name.startswith(prefix + '-') and name.endswith('.db')):
+        return False
+    try:
+        datetime.strptime(stamp, SNAPSHOT_TIME_FORMAT)
+    except ValueError:
+        return False
+    return True
+
+
+def prune_backups(folder, prefix, keep):
+    """Delete all but the ``keep`` newest snapshots; returns the removed paths."""
+    removed = list_backups(folder, prefix)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def restore_backup(backup_path, dest_path, pages=256, sleep=0.005):
+    """Verify ``backup_path`` and copy it over the live database.
+
+    The copy goes through the backup API as well, so connections the app
+    already holds see either the old or the restored database, never a
+    half-written file.
+    """
+    verify_backup(backup_path)
+    copy_database(backup_path, dest_path, pages, sleep)
@@ -0,0 +1,203 @@
+"""Load test: the async lookups (asgi.py) against the sync Flask routes.
+
+Seeds a temporary copy of the database with synthetic medicines and sales,
+starts the Flask app on a threaded WSGI server and asgi.py on uvicorn, logs
+in once and then keeps N concurrent keep-alive clients requesting a mix of
+medicine searches, stock lookups, sale lookups and dashboard figures from
+``/lookup/...`` on the first and ``/async/lookup/...`` on the second. Prints
+requests per second and latency percentiles per concurrency level.
+
+Usage:
+    python bench_async_lookups.py [--clients 10,50,200] [--seconds 10] [--rows 20000]
+
+Requires uvicorn, aiosqlite and greenlet. The live database is never modified.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed(workdir, rows):
+    import app as app_module
+
+    db = app_module.db
+    today = datetime.utcnow()
+    with app_module.app.app_context():
+        app_module.upgrade_schema(db.engine)
+        if app_module.User.query.filter_by(is_admin=True).first() is None:
+            raise SystemExit('The database has no admin user; run init_db.py first')
+        with db.engine.begin() as conn:
+            first = conn.execute(db.select(db.func.coalesce(db.func.max(app_module.Medicine.id), 0))).scalar() + 1
+            conn.execute(app_module.Medicine.__table__.insert(), [
+                {'name': f'Bench Medicine {n}', 'description': 'Tablets, strip of 10', 'quantity': n % 250,
+                 'price': 1 + n % 500, 'batch_number': f'B{n % 997:04d}', 'expiry_date': (today + timedelta(days=n % 700)).date()}
+                for n in range(rows)])
+            first_sale = conn.execute(db.select(db.func.coalesce(db.func.max(app_module.Sale.id), 0))).scalar() + 1
+            conn.execute(app_module.Sale.__table__.insert(), [
+                {'invoice_number': f'BENCH-{n}', 'customer_name': f'Bench Customer {n}', 'total_amount': 25.0,
+                 'discount': 0.0, 'tax_amount': 0.0, 'payment_method': 'Cash', 'sale_date': today - timedelta(minutes=n)}
+                for n in range(rows // 10)])
+            conn.execute(app_module.SaleItem.__table__.insert(), [
+                {'sale_id': first_sale + n, 'medicine_id': first + n, 'quantity': 1, 'unit_price': 25.0, 'total_price': 25.0}
+                for n in range(rows // 10)])
+    return first, first_sale
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_sync(port):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+    make_server('127.0.0.1', port, app, threaded=True, request_handler=KeepAliveHandler).serve_forever()
+
+
+async def request(reader, writer, path, cookie):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\nCookie: session={cookie}\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+def session_cookie():
+    """A login session cookie for the admin, signed with the app's secret key."""
+    from app import app, User
+    with app.app_context():
+        admin = User.query.filter_by(is_admin=True).first()
+    return app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(admin.id), '_fresh': True})
+
+
+async def load(port, paths, cookie, clients, seconds):
+    latencies, errors = [], 0
+    loop = asyncio.get_running_loop()
+    stop = loop.time() + seconds
+
+    async def client(n):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        count = n
+        while loop.time() < stop:
+            started = time.perf_counter()
+            try:
+                status, headers, _ = await request(reader, writer, paths[count % len(paths)], cookie)
+            except (ConnectionError, asyncio.IncompleteReadError, IndexError, ValueError):
+                errors += 1
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                continue
+            latencies.append(time.perf_counter() - started)
+            errors += status != 200
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            count += 1
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise SystemExit(f'Server on port {port} did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', default='10,50,200', help='concurrency levels (default 10,50,200)')
+    parser.add_argument('--seconds', type=float, default=10, help='duration per level and server (default 10)')
+    parser.add_argument('--rows', type=int, default=20000, help='synthetic medicines to add (default 20000)')
+    parser.add_argument('--serve-sync', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_sync:
+        serve_sync(args.serve_sync)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='bench-async-')
+    source = os.path.join(ROOT, 'instance', 'medical_store.db')
+    target = os.path.join(workdir, 'medical_store.db')
+    if os.path.exists(source):
+        shutil.copy(source, target)
+    env = {'DATABASE_URL': 'sqlite:///' + target, 'BRANCHES_FILE': os.path.join(workdir, 'branches.json'),
+           'ARCHIVE_FOLDER': os.path.join(workdir, 'archive'), 'CACHE_PATH': os.path.join(workdir, 'cache.db'),
+           'TEMPLATE_CACHE_FOLDER': os.path.join(workdir, 'template_cache')}
+    os.environ.update(env)
+
+    servers = []
+    try:
+        first_medicine, first_sale = seed(workdir, args.rows)
+        sync_port, async_port = free_port(), free_port()
+        quiet = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL, 'cwd': ROOT, 'env': dict(os.environ, **env)}
+        servers.append(subprocess.Popen([sys.executable, __file__, '--serve-sync', str(sync_port)], **quiet))
+        servers.append(subprocess.Popen([sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(async_port),
+                                         '--log-level', 'warning', '--no-access-log'], **quiet))
+
+        lookups = [
+            '/lookup/medicines?' + urlencode({'q': 'Bench Medicine 199'}),
+            '/lookup/stock?ids=' + ','.join(str(first_medicine + n) for n in range(0, 500, 10)),
+            f'/lookup/sales/{first_sale + 7}',
+            '/lookup/dashboard',
+            '/lookup/medicines?' + urlencode({'q': 'B0042'}),
+            f'/lookup/stock?ids={first_medicine + 3}',
+        ]
+
+        async def run():
+            await wait_for(sync_port)
+            await wait_for(async_port)
+            cookie = session_cookie()
+            print(f'{args.rows} medicines, {args.rows // 10} sales; {args.seconds:g} s per run')
+            print(f'{"routes":<22} {"clients":>7} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+            for clients in [int(value) for value in args.clients.split(',')]:
+                for label, port, prefix in (('sync (threaded WSGI)', sync_port, ''),
+                                            ('async (uvicorn)', async_port, '/async')):
+                    latencies, errors, elapsed = await load(port, [prefix + path for path in lookups], cookie,
+                                                            clients, args.seconds)
+                    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+                    print(f'{label:<22} {clients:>7} {len(latencies) / elapsed:>8.0f} {cuts[49] * 1000:>8.1f} '
+                          f'{cuts[94] * 1000:>8.1f} {cuts[98] * 1000:>8.1f} {errors:>7}')
+
+        asyncio.run(run())
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
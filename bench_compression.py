@@ -0,0 +1,107 @@
+"""Measure what response compression costs and saves.
+
+Renders a few real pages and the CSV exports through the Flask test client
+(uncompressed), then compresses each body at several gzip levels (and
+brotli qualities when the brotli package is installed) and prints the
+bytes saved against the CPU time spent.
+
+Usage:
+    python bench_compression.py [--rows 10000] [--repeat 5]
+
+--rows adds that many synthetic medicines and sales to a temporary copy of
+the database first, so the export sizes resemble a busy shop; the live
+database is never modified.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROUTES = ['/dashboard', '/medicines', '/sales', '/reports', '/reports/export?type=sales',
+          '/reports/export?type=inventory', '/export/report/inventory']
+
+
+def seed(app_module, rows):
+    db = app_module.db
+    medicine_table = app_module.Medicine.__table__
+    expiry = (datetime.utcnow() + timedelta(days=365)).date()
+    with db.engine.begin() as conn:
+        start = conn.execute(db.select(db.func.coalesce(db.func.max(medicine_table.c.id), 0))).scalar()
+        conn.execute(medicine_table.insert(), [
+            {'name': f'Bench Medicine {n}', 'description': 'Tablets, strip of 10', 'quantity': n % 120,
+             'price': round(1 + (n % 500) / 7, 2), 'expiry_date': expiry, 'batch_number': f'B{n % 997:04d}'}
+            for n in range(rows)
+        ])
+        now = datetime.utcnow()
+        conn.execute(app_module.Sale.__table__.insert(), [
+            {'invoice_number': f'BENCH-{n}', 'customer_name': f'Customer {n % 300}', 'total_amount': 25.0 + n % 90,
+             'discount': 0.0, 'tax_amount': 1.2, 'payment_method': ('Cash', 'Card', 'UPI')[n % 3],
+             'sale_date': now - timedelta(minutes=n)}
+            for n in range(rows)
+        ])
+        conn.execute(app_module.SaleItem.__table__.insert(), [
+            {'sale_id': n + 1, 'medicine_id': start + 1 + n, 'batch_number': 'B1', 'quantity': 1 + n % 4,
+             'unit_price': 5.0, 'total_price': 5.0 * (1 + n % 4)}
+            for n in range(rows)
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='synthetic rows to add (default 10000)')
+    parser.add_argument('--repeat', type=int, default=5, help='compressions per measurement (default 5)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-compression-')
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'medical_store.db')
+    target = os.path.join(workdir, 'medical_store.db')
+    if os.path.exists(source):
+        shutil.copy(source, target)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + target
+    os.environ['BRANCHES_FILE'] = os.path.join(workdir, 'branches.json')
+    os.environ['ARCHIVE_FOLDER'] = os.path.join(workdir, 'archive')
+
+    import app as app_module
+    import compression
+
+    try:
+        with app_module.app.app_context():
+            app_module.upgrade_schema(app_module.db.engine)
+            if not app_module.User.query.filter_by(is_admin=True).first():
+                print('The database has no admin user; run init_db.py first')
+                return 1
+            admin = app_module.User.query.filter_by(is_admin=True).first()
+            if args.rows:
+                seed(app_module, args.rows)
+
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        settings = [('gzip', level) for level in (1, 6, 9)]
+        if compression.brotli is not None:
+            settings += [('br', quality) for quality in (1, 5, 9)]
+
+        print(f'{"route":<36} {"coding":>8} {"bytes":>10} {"compressed":>11} {"ratio":>6} {"ms":>8} {"MB/s":>7}')
+        for route in ROUTES:
+            body = client.get(route, headers={'Accept-Encoding': 'identity'}).data
+            for coding, level in settings:
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    stream = compression.compressor(coding, level, level)
+                    size = len(stream.compress(body)) + len(stream.finish())
+                elapsed = (time.perf_counter() - started) / args.repeat
+                print(f'{route:<36} {coding + "-" + str(level):>8} {len(body):>10} {size:>11} '
+                      f'{len(body) / max(size, 1):>6.1f} {elapsed * 1000:>8.2f} '
+                      f'{len(body) / 1e6 / max(elapsed, 1e-9):>7.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
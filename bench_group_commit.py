@@ -0,0 +1,125 @@
+"""Sustained sale throughput with and without group commit.
+
+Starts a number of concurrent clients that keep posting two-line sales to
+/sale/new for a fixed time, first with every request committing its own
+transaction and then with SALE_GROUP_COMMIT on, and prints sales per
+second, request latency percentiles and the sales per commit.
+
+Usage:
+    python bench_group_commit.py [--clients 16] [--seconds 10] [--max-sales 50] [--max-wait-ms 5]
+
+Works on a temporary copy of the database; nothing live is modified.
+"""
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def run(app_module, admin_id, medicine_ids, clients, seconds):
+    from werkzeug.datastructures import MultiDict
+
+    latencies, errors = [], []
+    stop = time.monotonic() + seconds
+
+    def terminal(n):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+            session['_fresh'] = True
+        count = 0
+        while time.monotonic() < stop:
+            first, second = medicine_ids[count % len(medicine_ids)], medicine_ids[(count + n) % len(medicine_ids)]
+            started = time.perf_counter()
+            response = client.post('/sale/new', data=MultiDict([
+                ('customer_name', f'Bench Terminal {n}'), ('payment_method', 'Cash'),
+                ('medicine_id[]', str(first)), ('quantity[]', '1'), ('price[]', '12.5'),
+                ('medicine_id[]', str(second)), ('quantity[]', '2'), ('price[]', '12.5')]))
+            elapsed = time.perf_counter() - started
+            if response.status_code == 302 and '/sale/' in response.headers['Location']:
+                latencies.append(elapsed)
+            else:
+                errors.append(response.status_code)  # e.g. database locked, duplicate invoice number
+            count += 1
+
+    threads = [threading.Thread(target=terminal, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent terminals (default 16)')
+    parser.add_argument('--seconds', type=float, default=10, help='duration per mode (default 10)')
+    parser.add_argument('--max-sales', type=int, default=50, help='SALE_GROUP_COMMIT_MAX_SALES (default 50)')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='SALE_GROUP_COMMIT_MAX_WAIT_MS (default 5)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-group-commit-')
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'medical_store.db')
+    target = os.path.join(workdir, 'medical_store.db')
+    if os.path.exists(source):
+        shutil.copy(source, target)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + target
+    os.environ['BRANCHES_FILE'] = os.path.join(workdir, 'branches.json')
+    os.environ['ARCHIVE_FOLDER'] = os.path.join(workdir, 'archive')
+    os.environ['CACHE_PATH'] = os.path.join(workdir, 'cache.db')
+    os.environ['TEMPLATE_CACHE_FOLDER'] = os.path.join(workdir, 'template_cache')
+
+    import app as app_module
+    # Failed requests are counted below instead of logged with a traceback
+    app_module.app.logger.setLevel(logging.CRITICAL)
+
+    try:
+        with app_module.app.app_context():
+            db = app_module.db
+            app_module.upgrade_schema(db.engine)
+            admin = app_module.User.query.filter_by(is_admin=True).first()
+            if admin is None:
+                print('The database has no admin user; run init_db.py first')
+                return 1
+            admin_id = admin.id
+            medicines = [app_module.Medicine(name=f'Bench Sale Medicine {n}', quantity=10 ** 7, price=12.5,
+                                             batch_number=f'GC{n}',
+                                             expiry_date=(datetime.utcnow() + timedelta(days=400)).date())
+                         for n in range(50)]
+            db.session.add_all(medicines)
+            db.session.commit()
+            medicine_ids = [medicine.id for medicine in medicines]
+            with db.engine.connect() as conn:
+                journal = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+
+        print(f'{args.clients} clients, {args.seconds:g} s per mode, journal_mode={journal}')
+        print(f'{"mode":<32} {"sales/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"per commit":>11} {"errors":>7}')
+        for label, enabled in (('one commit per sale', False),
+                               (f'group commit ({args.max_sales} / {args.max_wait_ms:g} ms)', True)):
+            app_module.app.config.update(SALE_GROUP_COMMIT=enabled,
+                                         SALE_GROUP_COMMIT_MAX_SALES=args.max_sales,
+                                         SALE_GROUP_COMMIT_MAX_WAIT_MS=args.max_wait_ms)
+            writer = app_module._sale_writers.get(None)
+            before = (writer.batches, writer.sales) if writer else (0, 0)
+            latencies, errors, elapsed = run(app_module, admin_id, medicine_ids, args.clients, args.seconds)
+            per_commit = 1.0
+            if enabled:
+                writer = app_module._sale_writers[None]
+                per_commit = (writer.sales - before[1]) / max(writer.batches - before[0], 1)
+            cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+            print(f'{label:<32} {len(latencies) / elapsed:>8.1f} {cuts[49] * 1000:>8.1f} {cuts[94] * 1000:>8.1f} '
+                  f'{cuts[98] * 1000:>8.1f} {per_commit:>11.1f} {len(errors):>7}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Time the filtered medicine list on a large catalog.
+
+Seeds a temporary copy of the database with synthetic medicines spread
+over a few hundred suppliers, then requests /medicines with typical filter
+combinations and prints the median time of the whole request and of the
+facet and page queries, with the query plans SQLite picked.
+
+Usage:
+    python bench_medicine_filters.py [--rows 200000] [--repeat 7]
+
+The live database is never modified.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CASES = [
+    ('no filters', ''),
+    ('supplier', 'supplier=7'),
+    ('supplier + stock + expiry + price',
+     'supplier=7&stock_max=20&expiry_to={march}&price_min=50&price_max=200'),
+    ('stock below 20, by expiry', 'stock_max=19&sort=expiry_date'),
+    ('expiring soon, by price', 'expiry_from={today}&expiry_to={month}&sort=price&dir=desc'),
+    ('price range', 'price_min=50&price_max=200'),
+    ('batch prefix', 'batch=B01'),
+    ('text search', 'search=Bench%20Medicine%201999'),
+    ('deep page', 'sort=quantity&page=500'),
+]
+
+
+def seed(app_module, rows, suppliers=300):
+    db = app_module.db
+    today = datetime.utcnow().date()
+    with db.engine.begin() as conn:
+        first = conn.execute(db.select(db.func.coalesce(db.func.max(app_module.Supplier.id), 0))).scalar() + 1
+        conn.execute(app_module.Supplier.__table__.insert(), [
+            {'name': f'Bench Supplier {n}', 'contact': '000'} for n in range(suppliers)])
+        for start in range(0, rows, 50000):
+            conn.execute(app_module.Medicine.__table__.insert(), [
+                {'name': f'Bench Medicine {n}', 'description': 'Tablets, strip of 10', 'quantity': (n * 7) % 250,
+                 'price': round(1 + (n * 13) % 900 + (n % 100) / 100, 2), 'supplier_id': first + n % suppliers,
+                 'expiry_date': today + timedelta(days=(n * 11) % 900 - 60), 'batch_number': f'B{n % 997:04d}'}
+                for n in range(start, min(rows, start + 50000))
+            ])
+
+
+def median_ms(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='synthetic medicines to add (default 200000)')
+    parser.add_argument('--repeat', type=int, default=7, help='requests per case (default 7)')
+    parser.add_argument('--plans', action='store_true', help='print the SQLite query plans')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-filters-')
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'medical_store.db')
+    target = os.path.join(workdir, 'medical_store.db')
+    if os.path.exists(source):
+        shutil.copy(source, target)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + target
+    os.environ['BRANCHES_FILE'] = os.path.join(workdir, 'branches.json')
+    os.environ['ARCHIVE_FOLDER'] = os.path.join(workdir, 'archive')
+    os.environ['CACHE_PATH'] = os.path.join(workdir, 'cache.db')
+
+    import app as app_module
+    from werkzeug.datastructures import MultiDict
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    try:
+        with app_module.app.app_context():
+            app_module.upgrade_schema(app_module.db.engine)
+            admin = app_module.User.query.filter_by(is_admin=True).first()
+            if admin is None:
+                print('The database has no admin user; run init_db.py first')
+                return 1
+            admin_id = admin.id
+            seed(app_module, args.rows)
+
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+            session['_fresh'] = True
+
+        today = datetime.utcnow().date()
+        dates = {'today': today, 'month': today + timedelta(days=30),
+                 'march': today.replace(month=3, day=1) if today.month < 3 else today.replace(year=today.year + 1,
+                                                                                               month=3, day=1)}
+        print(f'{args.rows} synthetic medicines; median of {args.repeat} runs')
+        print(f'{"case":<38} {"matches":>8} {"request ms":>11} {"facets ms":>10} {"page ms":>8}')
+        for name, query in CASES:
+            query = query.format(**{key: value.strftime('%Y-%m-%d') for key, value in dates.items()})
+            url = '/medicines?' + query
+            assert client.get(url).status_code == 200
+            request_ms = median_ms(lambda: client.get(url), args.repeat)
+
+            with app_module.app.test_request_context(url):
+                app_module.g.branch = None
+                request_args = MultiDict(app_module.request.args)
+                filters = app_module.medicine_filters(request_args)
+                conditions = app_module.medicine_conditions(filters)
+                total = app_module.medicine_facets(filters)[0]
+                facets_ms = median_ms(lambda: app_module.medicine_facets(filters), args.repeat)
+                sort = app_module.MEDICINE_SORTS[request_args.get('sort', 'name')]
+                page_query = app_module.Medicine.query.filter(
+                    *[condition for parts in conditions.values() for condition in parts]
+                ).order_by(sort.desc() if request_args.get('dir') == 'desc' else sort, app_module.Medicine.id)
+                offset = (request_args.get('page', 1, type=int) - 1) * 10
+                page_ms = median_ms(lambda: page_query.limit(10).offset(offset).all(), args.repeat)
+
+                if args.plans:
+                    statements = []
+                    listener = lambda conn, cursor, statement, params, context, many: statements.append((statement, params))
+                    event.listen(Engine, 'before_cursor_execute', listener)
+                    app_module.medicine_facets(filters)
+                    page_query.limit(10).offset(offset).all()
+                    event.remove(Engine, 'before_cursor_execute', listener)
+                    for statement, params in statements:
+                        plan = app_module.db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params)
+                        print('    ' + '\n    '.join(row[3] for row in plan))
+            print(f'{name:<38} {total:>8} {request_ms:>11.1f} {facets_ms:>10.1f} {page_ms:>8.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Compare ORM objects with read-only records on large medicine lists.
+
+Seeds a temporary copy of the database with synthetic medicines, then loads
+them once as tracked Medicine objects (with the supplier joined, as the
+pages used to) and once as MedicineRecords holding only the printed
+columns. For each it prints the memory held per row, the load time and the
+time to render the rows through a Jinja loop like the report templates.
+
+Usage:
+    python bench_read_records.py [--rows 100000] [--repeat 3]
+
+The live database is never modified.
+"""
+import argparse
+import gc
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+TEMPLATE = ('{% for medicine in rows %}{{ medicine.id }} {{ medicine.name }} {{ medicine.batch_number }} '
+            '{{ medicine.quantity }} {{ "%.2f"|format(medicine.price) }} '
+            '{{ medicine.supplier_ref.name if medicine.supplier_ref }}\n{% endfor %}')
+
+
+def seed(app_module, rows, suppliers=200):
+    db = app_module.db
+    today = datetime.utcnow().date()
+    with db.engine.begin() as conn:
+        first = conn.execute(db.select(db.func.coalesce(db.func.max(app_module.Supplier.id), 0))).scalar() + 1
+        conn.execute(app_module.Supplier.__table__.insert(), [
+            {'name': f'Bench Supplier {n}', 'contact': '000'} for n in range(suppliers)])
+        for start in range(0, rows, 50000):
+            conn.execute(app_module.Medicine.__table__.insert(), [
+                {'name': f'Bench Medicine {n}', 'description': 'Tablets, strip of 10', 'quantity': n % 250,
+                 'price': 1 + n % 500, 'supplier_id': first + n % suppliers, 'batch_number': f'B{n % 997:04d}',
+                 'expiry_date': today + timedelta(days=n % 700)}
+                for n in range(start, min(rows, start + 50000))])
+
+
+def measure(app_module, load, template, repeat):
+    """Median load and render seconds, and bytes still held by the loaded rows."""
+    db = app_module.db
+    loads, renders, held = [], [], []
+    for _ in range(repeat):
+        db.session.remove()
+        gc.collect()
+        started = time.perf_counter()
+        rows = load()
+        loads.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        template.render(rows=rows)
+        renders.append(time.perf_counter() - started)
+        del rows
+        # Memory is measured on a separate load, tracing slows loading down
+        db.session.remove()
+        gc.collect()
+        tracemalloc.start()
+        rows = load()
+        held.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del rows
+    return statistics.median(loads), statistics.median(renders), statistics.median(held)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='synthetic medicines to add (default 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (default 3)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-records-')
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'medical_store.db')
+    target = os.path.join(workdir, 'medical_store.db')
+    if os.path.exists(source):
+        shutil.copy(source, target)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + target
+    os.environ['BRANCHES_FILE'] = os.path.join(workdir, 'branches.json')
+    os.environ['ARCHIVE_FOLDER'] = os.path.join(workdir, 'archive')
+    os.environ['CACHE_PATH'] = os.path.join(workdir, 'cache.db')
+    os.environ['TEMPLATE_CACHE_FOLDER'] = ''
+
+    import app as app_module
+    from sqlalchemy.orm import joinedload
+
+    Medicine = app_module.Medicine
+    try:
+        with app_module.app.app_context():
+            app_module.upgrade_schema(app_module.db.engine)
+            seed(app_module, args.rows)
+            template = app_module.app.jinja_env.from_string(TEMPLATE)
+            total = app_module.db.session.query(app_module.db.func.count(Medicine.id)).scalar()
+            cases = [
+                ('ORM objects', lambda: Medicine.query.options(joinedload(Medicine.supplier_ref)).all()),
+                ('MedicineRecords', lambda: list(app_module.medicine_records(app_module.medicine_select(
+                    'id', 'name', 'batch_number', 'quantity', 'price', 'supplier_name')))),
+            ]
+            print(f'{total} medicines; median of {args.repeat} runs')
+            print(f'{"rows as":<18} {"bytes/row":>10} {"load ms":>9} {"render ms":>10}')
+            for name, load in cases:
+                load_s, render_s, held = measure(app_module, load, template, args.repeat)
+                print(f'{name:<18} {held / total:>10.0f} {load_s * 1000:>9.0f} {render_s * 1000:>10.0f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
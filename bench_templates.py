@@ -0,0 +1,106 @@
+"""Measure first-render latency with and without the template bytecode cache.
+
+Each case starts a fresh Python process (so nothing is compiled in memory),
+requests a handful of pages once and again, and prints the first and the
+second request time per page; the difference is mostly template loading.
+The cases are: bytecode cache disabled, an empty (cold) cache and a cache
+filled by the previous run or by ``python run_checks.py --precompile``.
+
+Usage:
+    python bench_templates.py [--runs 5]
+
+Works on a temporary copy of the database; nothing live is modified.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PAGES = ['/dashboard', '/medicines', '/sales', '/reports', '/reports/margins', '/suppliers', '/sale/new']
+
+
+def child():
+    import app as app_module
+
+    with app_module.app.app_context():
+        app_module.upgrade_schema(app_module.db.engine)
+        admin = app_module.User.query.filter_by(is_admin=True).first()
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    # Open connections and load the user outside of any template first
+    client.get('/api/catalog/changes?since=0')
+
+    timings = {}
+    for page in PAGES:
+        runs = []
+        for _ in range(2):
+            started = time.perf_counter()
+            response = client.get(page)
+            runs.append((time.perf_counter() - started) * 1000)
+        timings[page] = runs if response.status_code == 200 else None
+    print(json.dumps(timings))
+
+
+def run_case(workdir, cache_folder):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'medical_store.db'),
+               BRANCHES_FILE=os.path.join(workdir, 'branches.json'),
+               ARCHIVE_FOLDER=os.path.join(workdir, 'archive'), CACHE_PATH=os.path.join(workdir, 'cache.db'),
+               CACHE_BACKEND='memory', TEMPLATE_CACHE_FOLDER=cache_folder, TEMPLATES_AUTO_RELOAD='0')
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per case (default 5)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='bench-templates-')
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'medical_store.db')
+    if not os.path.exists(source):
+        print('No instance/medical_store.db; run init_db.py first')
+        return 1
+    shutil.copy(source, os.path.join(workdir, 'medical_store.db'))
+    cache_folder = os.path.join(workdir, 'template_cache')
+    try:
+        results = {'no cache': [], 'cold cache': [], 'warm cache': []}
+        for _ in range(args.runs):
+            results['no cache'].append(run_case(workdir, ''))
+            shutil.rmtree(cache_folder, ignore_errors=True)
+            results['cold cache'].append(run_case(workdir, cache_folder))
+            results['warm cache'].append(run_case(workdir, cache_folder))
+
+        print(f'Median of {args.runs} fresh processes; first / second request in ms')
+        print(f'{"page":<18}' + ''.join(f'{case:>22}' for case in results))
+        totals = dict.fromkeys(results, 0.0)
+        for page in PAGES:
+            cells = []
+            for case, runs in results.items():
+                if any(run[page] is None for run in runs):
+                    cells.append(f'{"error":>22}')
+                    continue
+                first = statistics.median(run[page][0] for run in runs)
+                second = statistics.median(run[page][1] for run in runs)
+                totals[case] += first
+                cells.append(f'{first:>12.1f} / {second:>7.1f}')
+            print(f'{page:<18}' + ''.join(cells))
+        print(f'{"first renders":<18}' + ''.join(f'{total:>22.1f}' for total in totals.values()))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
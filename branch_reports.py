@@ -0,0 +1,251 @@
+"""Consolidated reporting across branch databases.
+
+Each branch runs against its own database. The functions in this module are
+executed inside worker processes, so they only depend on SQLAlchemy Core and
+take a plain database URL (and archive folder) instead of touching the Flask
+app or its session.
+"""
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy import create_engine, select, func, table, column, Integer, Float, String, Date, DateTime
+
+import sales_archive
+from process_pool import ProcessPool
+
+# Lightweight table definitions matching the models in app.py
+sale = table(
+    'sale',
+    column('id', Integer),
+    column('invoice_number', String),
+    column('customer_name', String),
+    column('total_amount', Float),
+    column('discount', Float),
+    column('tax_amount', Float),
+    column('payment_method', String),
+    column('sale_date', DateTime),
+)
+sale_item = table(
+    'sale_item',
+    column('sale_id', Integer),
+    column('medicine_id', Integer),
+    column('quantity', Integer),
+    column('total_price', Float),
+)
+medicine = table(
+    'medicine',
+    column('id', Integer),
+    column('name', String),
+    column('description', String),
+    column('batch_number', String),
+    column('quantity', Integer),
+    column('price', Float),
+    column('supplier_id', Integer),
+    column('expiry_date', Date),
+)
+supplier = table(
+    'supplier',
+    column('id', Integer),
+    column('name', String),
+)
+sale_archive = table(
+    'sale_archive',
+    column('year', Integer),
+    column('first_sale', DateTime),
+    column('last_sale', DateTime),
+)
+
+_engines = {}
+_archive_stores = {}
+_pool = ProcessPool()
+
+
+def _engine(database_url):
+    # Engines are cached per worker process so repeated reports reuse connections
+    if database_url not in _engines:
+        _engines[database_url] = create_engine(database_url)
+    return _engines[database_url]
+
+
+def _archive_store(folder):
+    # Cached like the engines, so a compressed year is unpacked once per worker
+    if folder not in _archive_stores:
+        _archive_stores[folder] = sales_archive.ArchiveStore(folder)
+    return _archive_stores[folder]
+
+
+def branch_report(database_url, start, end, low_stock_threshold):
+    """Aggregates behind the reports page for one branch database; medicines
+    below ``low_stock_threshold`` are listed as low on stock."""
+    with _engine(database_url).connect() as conn:
+        period = (sale.c.sale_date >= start, sale.c.sale_date <= end)
+
+        daily = conn.execute(
+            select(
+                func.date(sale.c.sale_date).label('sale_date'),
+                func.sum(sale.c.total_amount),
+                func.count(sale.c.id),
+            ).where(*period).group_by(func.date(sale.c.sale_date))
+        ).all()
+
+        top_medicines = conn.execute(
+            select(
+                medicine.c.name,
+                func.sum(sale_item.c.quantity),
+                func.sum(sale_item.c.total_price),
+            ).select_from(
+                sale_item.join(medicine, medicine.c.id == sale_item.c.medicine_id)
+                         .join(sale, sale.c.id == sale_item.c.sale_id)
+            ).where(*period).group_by(medicine.c.id, medicine.c.name)
+        ).all()
+
+        low_stock = conn.execute(
+            select(medicine.c.name, medicine.c.quantity, supplier.c.name)
+            .select_from(medicine.outerjoin(supplier, medicine.c.supplier_id == supplier.c.id))
+            .where(medicine.c.quantity < low_stock_threshold)
+            .order_by(medicine.c.quantity)
+        ).all()
+
+        payment_methods = conn.execute(
+            select(sale.c.payment_method, func.count(sale.c.id), func.sum(sale.c.total_amount))
+            .where(*period).group_by(sale.c.payment_method)
+        ).all()
+
+    return {
+        'daily': {str(d): (float(amount or 0), count or 0) for d, amount, count in daily},
+        'top_medicines': [(name, int(qty or 0), float(total or 0)) for name, qty, total in top_medicines],
+        'low_stock': [(name, qty, supplier_name) for name, qty, supplier_name in low_stock],
+        'payment_methods': [(method, count or 0, float(total or 0)) for method, count, total in payment_methods],
+    }
+
+
+def branch_export(database_url, report_type, start=None, end=None, archive_folder=None):
+    """Rows of the sales or inventory CSV export for one branch database.
+    Sales exports include the branch's yearly archives in ``archive_folder``
+    for the years the range reaches, after the live sales like export_reports()."""
+    with _engine(database_url).connect() as conn:
+        if report_type == 'sales':
+            item_counts = (
+                select(sale_item.c.sale_id, func.sum(sale_item.c.quantity).label('item_count'))
+                .group_by(sale_item.c.sale_id).subquery()
+            )
+            query = (
+                select(
+                    sale.c.invoice_number, sale.c.sale_date, sale.c.customer_name,
+                    func.coalesce(item_counts.c.item_count, 0),
+                    sale.c.total_amount, sale.c.discount, sale.c.tax_amount, sale.c.payment_method,
+                )
+                .select_from(sale.outerjoin(item_counts, item_counts.c.sale_id == sale.c.id))
+                .order_by(sale.c.sale_date.desc())
+            )
+            if start and end:
+                query = query.where(sale.c.sale_date.between(start, end))
+            sales = list(conn.execute(query))
+            if archive_folder is not None:
+                years = select(sale_archive.c.year).order_by(sale_archive.c.year.desc())
+                if start and end:
+                    years = years.where(sale_archive.c.last_sale >= start, sale_archive.c.first_sale <= end)
+                store = _archive_store(archive_folder)
+                for year in conn.execute(years).scalars():
+                    sales.extend(
+                        (row.invoice_number, row.sale_date, row.customer_name, row.item_count, row.total_amount,
+                         row.discount, row.tax_amount, row.payment_method)
+                        for row in store.sales(year, start=start if end else None, end=end if start else None))
+            rows = []
+            for invoice, sale_date, customer, items, total, discount, tax, method in sales:
+                discount = discount or 0
+                tax = tax or 0
+                rows.append([
+                    invoice, sale_date.strftime('%Y-%m-%d %H:%M'), customer, items,
+                    total - tax + discount, discount, tax, total, method,
+                ])
+            return rows
+
+        query = (
+            select(
+                medicine.c.id, medicine.c.name, medicine.c.description, medicine.c.batch_number,
+                medicine.c.quantity, medicine.c.price, supplier.c.name, medicine.c.expiry_date,
+            )
+            .select_from(medicine.outerjoin(supplier, medicine.c.supplier_id == supplier.c.id))
+            .order_by(medicine.c.name)
+        )
+        return [
+            [med_id, name, description or '', batch or '', qty, price, supplier_name or '',
+             expiry.strftime('%Y-%m-%d') if expiry else '']
+            for med_id, name, description, batch, qty, price, supplier_name, expiry in conn.execute(query)
+        ]
+
+
+def fan_out(fn, branch_urls, *args, **per_branch):
+    """Run ``fn(url, *args)`` for every branch in parallel worker processes.
+    Each keyword is a ``{code: value}`` dict of a per-branch argument, passed
+    to ``fn`` under that name.
+
+    Returns ``{code: (result, error)}``. Total latency is that of the slowest
+    branch rather than the sum; a failing branch does not hide the others.
+    """
+    if not branch_urls:
+        return {}
+    # One worker per branch
+    futures = {code: _pool.submit(len(branch_urls), fn, url, *args,
+                                  **{name: values.get(code) for name, values in per_branch.items()})
+               for code, url in branch_urls.items()}
+    results = {}
+    for code, future in futures.items():
+        try:
+            results[code] = (future.result(), None)
+        except BrokenProcessPool as e:
+            _pool.reset()
+            results[code] = (None, str(e))
+        except Exception as e:
+            results[code] = (None, str(e))
+    return results
+
+
+def merge_reports(results, dates):
+    """Combine per-branch report dicts into the consolidated view."""
+    amounts = dict.fromkeys(dates, 0.0)
+    counts = dict.fromkeys(dates, 0)
+    top = {}
+    payment = {}
+    low_stock = []
+    per_branch = {}
+    for code, (report, error) in results.items():
+        if error:
+            per_branch[code] = {'error': error, 'total': 0.0, 'count': 0}
+            continue
+        branch_total = 0.0
+        branch_count = 0
+        for day, (amount, count) in report['daily'].items():
+            if day in amounts:
+                amounts[day] += amount
+                counts[day] += count
+            branch_total += amount
+            branch_count += count
+        per_branch[code] = {'error': None, 'total': branch_total, 'count': branch_count}
+        for name, qty, total in report['top_medicines']:
+            entry = top.setdefault(name, [0, 0.0])
+            entry[0] += qty
+            entry[1] += total
+        for method, count, total in report['payment_methods']:
+            entry = payment.setdefault(method, [0, 0.0])
+            entry[0] += count
+            entry[1] += total
+        low_stock.extend((code, name, qty, supplier_name) for name, qty, supplier_name in report['low_stock'])
+
+    top_medicines = sorted(
+        ({'name': name, 'total_quantity': qty, 'total_sales': total} for name, (qty, total) in top.items()),
+        key=lambda row: row['total_quantity'], reverse=True,
+    )[:10]
+    payment_methods = [
+        {'payment_method': method, 'sale_count': count, 'total_amount': total}
+        for method, (count, total) in sorted(payment.items())
+    ]
+    low_stock.sort(key=lambda row: row[2])
+    return {
+        'amounts': [amounts[d] for d in dates],
+        'counts': [counts[d] for d in dates],
+        'top_medicines': top_medicines,
+        'payment_methods': payment_methods,
+        'low_stock': low_stock,
+        'per_branch': per_branch,
+    }
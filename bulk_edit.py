@@ -0,0 +1,77 @@
+"""Bulk edit medicines from the command line.
+
+    python bulk_edit.py changes.csv                  preview row changes
+    python bulk_edit.py changes.json --apply
+    python bulk_edit.py --supplier-id 3 --set price=+4% --apply
+    python bulk_edit.py --name paracetamol --set quantity=+50 --set batch_number=B42
+
+CSV files have an ``id`` column plus any of price, supplier_id, batch_number,
+expiry_date (YYYY-MM-DD) and quantity. Price and quantity also take relative
+changes: ``*1.04``, ``+4%``, ``-2.50``, ``+10``. JSON files use the same
+format as the /api/medicines/bulk-edit endpoint. Without ``--apply`` nothing
+is written; the diff and change count are printed either way.
+"""
+import argparse
+import json
+import sys
+
+from flask import g
+
+import app as app_module
+from app import db, BulkEditError, bulk_changes_from_csv, bulk_edit_medicines
+
+
+def main():
+    config = app_module.app.config
+    parser = argparse.ArgumentParser(description='Bulk edit medicines.')
+    parser.add_argument('file', nargs='?', help='CSV or JSON file of changes')
+    parser.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE')
+    parser.add_argument('--supplier-id')
+    parser.add_argument('--name')
+    parser.add_argument('--ids', help='comma separated medicine ids')
+    parser.add_argument('--all', action='store_true', help='edit every medicine')
+    parser.add_argument('--apply', action='store_true')
+    parser.add_argument('--branch', default=config['DEFAULT_BRANCH'], choices=list(config['BRANCHES']))
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding='utf-8-sig') as f:
+            text = f.read()
+        if args.file.endswith('.json'):
+            payload = json.loads(text)
+            payload = payload if isinstance(payload, dict) else {'changes': payload}
+        else:
+            payload = {'changes': bulk_changes_from_csv(text)}
+    elif args.set:
+        spec = {}
+        if args.supplier_id is not None:
+            spec['supplier_id'] = args.supplier_id
+        if args.name:
+            spec['name'] = args.name
+        if args.ids:
+            spec['ids'] = args.ids.split(',')
+        if args.all:
+            spec['all'] = True
+        payload = {'filter': spec, 'set': dict(assignment.split('=', 1) for assignment in args.set)}
+    else:
+        parser.error('give a file of changes or at least one --set')
+
+    with app_module.app.app_context():
+        g.branch = None if args.branch == config['DEFAULT_BRANCH'] else args.branch
+        app_module.upgrade_schema(db.engines[g.branch])
+        try:
+            result = bulk_edit_medicines(payload, apply=args.apply)
+        except BulkEditError as e:
+            db.session.rollback()
+            print(f'error: {e}', file=sys.stderr)
+            sys.exit(2)
+        db.session.commit()
+
+    for change in result['changes']:
+        print(f"{change['id']:>6} {change['name']:<40} {change['field']:<13} {change['old']} -> {change['new']}")
+    action = 'updated' if result['applied'] else 'would be updated (preview, pass --apply to write)'
+    print(f"{result['count']} medicines {action}, {len(result['changes'])} field changes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Cache backends for values shared between requests.
+
+Two interchangeable backends:
+
+- ``MemoryCache``: an LRU dict inside the process. Fastest, but every
+  worker process holds its own copy and its own version stamps.
+- ``SQLiteCache``: one SQLite file on local disk shared by every worker
+  process on the host. No external service is needed; WAL mode lets
+  workers read while another one writes.
+
+Invalidation uses version stamps rather than deleting keys: callers group
+keys into namespaces (e.g. ``main:catalog``) and ``cached()`` folds the
+current version of each namespace into the key. ``bump()`` increments a
+version, so every entry built from older data stops matching at once and
+ages out through eviction or its TTL. With the SQLite backend the
+versions live in the shared file, so a bump in one worker reaches all of
+them. Both backends count hits, misses, sets and evictions.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class Cache:
+    """Interface shared by the backends."""
+    backend = None
+
+    def __init__(self, max_entries=1000, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _expiry(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    # Backends implement these
+    def get_many(self, keys):
+        """``{key: value}`` for the keys that are cached."""
+        raise NotImplementedError
+
+    def set_many(self, values, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def versions(self, namespaces):
+        raise NotImplementedError
+
+    def bump(self, *namespaces):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def versioned_key(self, namespaces, key):
+        versions = self.versions(namespaces)
+        return ':'.join(f'{namespace}@{versions[namespace]}' for namespace in namespaces) + '|' + key
+
+    def cached(self, namespaces, key, factory, ttl=None):
+        """Value of ``key`` under the current versions of ``namespaces``,
+        computed with ``factory()`` and stored on a miss."""
+        full_key = self.versioned_key(namespaces, key)
+        value = self.get_many([full_key]).get(full_key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(full_key, value, ttl)
+        return value
+
+    def cached_many(self, namespaces, keys, factory, ttl=None):
+        """Like cached() for a batch: ``factory(missing_keys)`` returns
+        ``{key: value}`` for the keys that were not cached."""
+        prefix = self.versioned_key(namespaces, '')
+        found = self.get_many([prefix + key for key in keys])
+        values = {key: found[prefix + key] for key in keys if prefix + key in found}
+        missing = [key for key in keys if key not in values]
+        if missing:
+            loaded = factory(missing)
+            self.set_many({prefix + key: value for key, value in loaded.items()}, ttl)
+            values.update(loaded)
+        return values
+
+    def info(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        return dict(stats, backend=self.backend, entries=len(self), max_entries=self.max_entries,
+                    hit_rate=round(stats['hits'] / lookups, 3) if lookups else None)
+
+
+class MemoryCache(Cache):
+    backend = 'memory'
+
+    def __init__(self, max_entries=1000, default_ttl=300):
+        super().__init__(max_entries, default_ttl)
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] is not None and entry[0] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return found
+
+    def set_many(self, values, ttl=None):
+        expires_at = self._expiry(ttl)
+        evicted = 0
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        self._count('sets', len(values))
+        self._count('evictions', evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def versions(self, namespaces):
+        return {namespace: self._versions.get(namespace, 0) for namespace in namespaces}
+
+    def bump(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(Cache):
+    """Cache in a local SQLite file shared by all worker processes.
+
+    Values are pickled. Eviction removes the least recently written entries
+    once the table grows past ``max_entries`` (reads do not write, so they
+    never contend for the file lock).
+    """
+    backend = 'sqlite'
+
+    def __init__(self, path, max_entries=1000, default_ttl=300):
+        super().__init__(max_entries, default_ttl)
+        self.path = path
+        self._local = threading.local()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5)
+        with conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                         'expires_at REAL, stored_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_stored_at ON cache_entry (stored_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_version (namespace TEXT PRIMARY KEY, '
+                         'version INTEGER NOT NULL)')
+        conn.close()
+
+    def _connect(self):
+        # One connection per thread (sqlite3 connections are not thread-safe),
+        # opened again after a fork so workers never share one
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = conn.execute(
+                f'SELECT key, value FROM cache_entry WHERE key IN ({",".join("?" * len(batch))}) '
+                'AND (expires_at IS NULL OR expires_at > ?)', [*batch, now])
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return found
+
+    def set_many(self, values, ttl=None):
+        if not values:
+            return
+        expires_at = self._expiry(ttl)
+        now = time.time()
+        rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at, now) for key, value in values.items()]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO cache_entry (key, value, expires_at, stored_at) '
+                             'VALUES (?, ?, ?, ?)', rows)
+            conn.execute('DELETE FROM cache_entry WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+            excess = conn.execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute('DELETE FROM cache_entry WHERE key IN '
+                             '(SELECT key FROM cache_entry ORDER BY stored_at LIMIT ?)', (excess,))
+        self._count('sets', len(values))
+        self._count('evictions', max(excess, 0))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache_entry')
+
+    def versions(self, namespaces):
+        rows = dict(self._connect().execute(
+            f'SELECT namespace, version FROM cache_version WHERE namespace IN ({",".join("?" * len(namespaces))})',
+            list(namespaces)))
+        return {namespace: rows.get(namespace, 0) for namespace in namespaces}
+
+    def bump(self, *namespaces):
+        with self._connect() as conn:
+            conn.executemany('INSERT INTO cache_version (namespace, version) VALUES (?, 1) '
+                             'ON CONFLICT (namespace) DO UPDATE SET version = version + 1',
+                             [(namespace,) for namespace in namespaces])
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+
+
+def create_cache(backend, path=None, max_entries=1000, default_ttl=300):
+    if backend == 'memory':
+        return MemoryCache(max_entries, default_ttl)
+    if backend == 'sqlite':
+        return SQLiteCache(path, max_entries, default_ttl)
+    raise ValueError(f'Unknown cache backend: {backend}')
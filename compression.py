@@ -0,0 +1,183 @@
+"""Negotiated gzip/brotli compression for WSGI responses.
+
+CompressionMiddleware wraps the Flask WSGI app and compresses bodies chunk
+by chunk, so streamed (chunked) responses such as the CSV exports are
+compressed as they are produced instead of being buffered whole. Responses
+smaller than ``min_size``, partial or empty responses and already
+compressed content types (images, archives, fonts) pass through untouched.
+Brotli is used when the ``brotli`` package is installed and the client
+prefers it; otherwise gzip from the standard library.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+DEFAULT_SKIP_TYPES = (
+    'image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/pdf', 'application/octet-stream',
+    # Compressors buffer output; events must reach the browser immediately
+    'text/event-stream',
+)
+# Text-based image formats still compress well
+COMPRESSIBLE_IMAGES = ('image/svg+xml',)
+
+
+def parse_accept_encoding(header):
+    """``{coding: q}`` for an Accept-Encoding header."""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def negotiate(header, available=None):
+    """The coding to use for ``header``: 'br', 'gzip' or None."""
+    if available is None:
+        available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    codings = parse_accept_encoding(header or '')
+    best, best_q = None, 0.0
+    for coding in available:
+        q = codings.get(coding, codings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class GzipStream:
+    def __init__(self, level):
+        # wbits=31: gzip container rather than a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compressor(coding, level, brotli_quality):
+    return BrotliStream(brotli_quality) if coding == 'br' else GzipStream(level)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, level=6, brotli_quality=5, min_size=500, skip_types=DEFAULT_SKIP_TYPES):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.skip_types = tuple(skip_types)
+
+    def compressible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        names = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in names or 'content-range' in names:
+            return False
+        content_type = names.get('content-type', '').split(';')[0].strip().lower()
+        if not content_type or (content_type.startswith(self.skip_types)
+                                and content_type not in COMPRESSIBLE_IMAGES):
+            return False
+        length = names.get('content-length')
+        return length is None or not length.isdigit() or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        coding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response.update(status=status, headers=headers, exc_info=exc_info)
+            return response.setdefault('written', []).append
+
+        body = self.app(environ, capture)
+        return self._respond(body, response, coding, start_response)
+
+    def _respond(self, body, response, coding, start_response):
+        try:
+            chunks = iter(body)
+            pending = []
+            exhausted = False
+            if 'status' not in response:
+                # start_response may be deferred until the first chunk
+                for chunk in chunks:
+                    pending.append(chunk)
+                    if 'status' in response:
+                        break
+                else:
+                    exhausted = True
+            pending = response.pop('written', []) + pending
+            status, headers = response['status'], response['headers']
+
+            if not self.compressible(status, headers):
+                start_response(status, headers, response['exc_info'])
+                response['started'] = True
+                yield from pending
+                if not exhausted:
+                    yield from chunks
+                return
+
+            # Buffer up to min_size so small streamed bodies go out as is
+            size = sum(len(chunk) for chunk in pending)
+            if not exhausted and size < self.min_size:
+                for chunk in chunks:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size >= self.min_size:
+                        break
+                else:
+                    exhausted = True
+            # Caches must keep compressed and plain copies apart
+            vary = [value for name, value in headers if name.lower() == 'vary']
+            headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+            headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+            if exhausted and size < self.min_size:
+                start_response(status, headers, response['exc_info'])
+                response['started'] = True
+                yield b''.join(pending)
+                return
+
+            stream = compressor(coding, self.level, self.brotli_quality)
+            headers = [(name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+                       for name, value in headers if name.lower() != 'content-length']
+            start_response(status, headers + [('Content-Encoding', coding)], response['exc_info'])
+            response['started'] = True
+            data = stream.compress(b''.join(pending))
+            if data:
+                yield data
+            if not exhausted:
+                for chunk in chunks:
+                    data = stream.compress(chunk)
+                    if data:
+                        yield data
+            yield stream.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
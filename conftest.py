@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+
+# Point the app at a throwaway database before it is imported, so the test
+# suite never touches instance/medical_store.db.
+_test_dir = tempfile.mkdtemp(prefix='medical-store-tests-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(_test_dir, 'medical_store.db'))
+os.environ.setdefault('BRANCHES_FILE', os.path.join(_test_dir, 'branches.json'))
+os.environ.setdefault('ARCHIVE_FOLDER', os.path.join(_test_dir, 'archive'))
+os.environ.setdefault('BACKUP_FOLDER', os.path.join(_test_dir, 'backups'))
+os.environ.setdefault('PROFILE_FOLDER', os.path.join(_test_dir, 'profiles'))
+os.environ.setdefault('CACHE_PATH', os.path.join(_test_dir, 'cache.db'))
+os.environ.setdefault('TEMPLATE_CACHE_FOLDER', os.path.join(_test_dir, 'template_cache'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_test_dir, 'uploads'))
+os.environ.setdefault('IMAGE_ORIGINALS_FOLDER', os.path.join(_test_dir, 'image_originals'))
+# A second branch with its own database, next to the default "main" one
+if not os.path.exists(os.environ['BRANCHES_FILE']):
+    with open(os.environ['BRANCHES_FILE'], 'w', encoding='utf-8') as f:
+        json.dump({'north': {'name': 'North Branch',
+                             'database_uri': 'sqlite:///' + os.path.join(_test_dir, 'north.db')}}, f)
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+from app import db, User
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    app_module.app.testing = True
+    with app_module.app.app_context():
+        db.create_all()
+        if not User.query.filter_by(username='Piyu').first():
+            db.session.add(User(username='Piyu',
+                                password_hash=generate_password_hash('Piyu24', method='pbkdf2:sha256'),
+                                is_admin=True))
+            db.session.commit()
+    yield db
+
+
+@pytest.fixture
+def client():
+    with app_module.app.test_client() as client:
+        client.post('/login', data={'username': 'Piyu', 'password': 'Piyu24'})
+        yield client
+
+
+@pytest.fixture
+def max_queries():
+    """``with max_queries(n): ...`` fails when the block runs more than ``n``
+    SQL statements on any engine (primary, branch or reporting)."""
+    @contextmanager
+    def limit(n):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, 'before_cursor_execute', count)
+        assert len(statements) <= n, f'{len(statements)} queries (limit {n}):\n' + '\n'.join(statements)
+    return limit
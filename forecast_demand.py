@@ -0,0 +1,32 @@
+"""Nightly job: forecast demand and refresh reorder suggestions.
+
+Schedule with cron, e.g. ``15 2 * * * cd /path/to/app && python forecast_demand.py``.
+Pass ``--all-branches`` to run it against every registered branch database.
+"""
+import sys
+import time
+
+from flask import g
+
+import app as app_module
+from app import generate_reorder_suggestions
+
+
+def run(branch):
+    with app_module.app.app_context():
+        g.branch = None if branch == app_module.app.config['DEFAULT_BRANCH'] else branch
+        app_module.upgrade_schema(app_module.db.engines[g.branch])
+        started = time.perf_counter()
+        count = generate_reorder_suggestions()
+        print(f'[{branch}] {count} medicines need reordering ({time.perf_counter() - started:.2f}s)')
+
+
+def main():
+    branches = app_module.app.config['BRANCHES']
+    targets = list(branches) if '--all-branches' in sys.argv else [app_module.app.config['DEFAULT_BRANCH']]
+    for branch in targets:
+        run(branch)
+
+
+if __name__ == '__main__':
+    main()
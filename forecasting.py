@@ -0,0 +1,77 @@
+"""Vectorized demand forecasting for reorder suggestions.
+
+Sales history is held as a (medicines x days) matrix so every smoothing step
+runs across the whole catalog at once instead of per medicine.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+
+def demand_matrix(medicine_ids, history, start_date, days):
+    """Build the daily quantity matrix from grouped sales rows.
+
+    ``history`` holds ``(medicine_id, day, quantity)`` tuples where ``day`` is a
+    date or an ISO date string; rows for unknown medicines or days outside the
+    window are ignored.
+    """
+    matrix = np.zeros((len(medicine_ids), days), dtype=np.float64)
+    history = list(history)
+    if not history or not len(medicine_ids):
+        return matrix
+
+    ids, day_values, quantities = zip(*history)
+    order = np.argsort(medicine_ids)
+    sorted_ids = np.asarray(medicine_ids)[order]
+    ids = np.asarray(ids)
+    pos = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids) - 1)
+    rows = order[pos]
+    cols = (np.array([str(day)[:10] for day in day_values], dtype='datetime64[D]')
+            - np.datetime64(start_date, 'D')).astype(np.int64)
+
+    valid = (sorted_ids[pos] == ids) & (cols >= 0) & (cols < days)
+    np.add.at(matrix, (rows[valid], cols[valid]),
+              np.asarray([q or 0 for q in quantities], dtype=np.float64)[valid])
+    return matrix
+
+
+def moving_average(matrix, window):
+    """Mean daily demand over the last ``window`` days for every row."""
+    window = max(1, min(window, matrix.shape[1]))
+    return matrix[:, -window:].mean(axis=1)
+
+
+def exponential_smoothing(matrix, alpha):
+    """Final level of simple exponential smoothing for every row.
+
+    The recursive update ``level = alpha * x + (1 - alpha) * level`` unrolls to
+    a weighted sum, so the whole matrix is smoothed with one product. The
+    level is seeded with the first observed day.
+    """
+    days = matrix.shape[1]
+    if days == 0:
+        return np.zeros(matrix.shape[0])
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+    weights[0] += (1 - alpha) ** days
+    return matrix @ weights
+
+
+def reorder_plan(demand, stock, lead_time_days, cover_days, safety_days=0):
+    """Days of cover and reorder quantity for every medicine.
+
+    Enough stock is ordered to cover the supplier lead time, the review period
+    and a safety buffer at the forecast daily demand. Medicines without demand
+    have infinite cover and are never reordered.
+    """
+    demand = np.asarray(demand, dtype=np.float64)
+    stock = np.asarray(stock, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(demand > 0, stock / demand, np.inf)
+    target = demand * (lead_time_days + cover_days + safety_days)
+    reorder = np.ceil(np.clip(target - stock, 0, None)).astype(np.int64)
+    return days_of_cover, reorder
+
+
+def history_window(today, days):
+    """First day of a ``days`` long history window ending on ``today``."""
+    return today - timedelta(days=days - 1)
@@ -0,0 +1,125 @@
+"""Medicine images: resized variants stored under their content hash.
+
+Uploads are decoded and resized with Pillow in worker processes
+(``render_variants`` is what the pool runs), so a large phone photo never
+holds a request thread or the GIL. Originals and variants are written once
+under the SHA-256 of their bytes: a photo uploaded twice, or shared by two
+medicines, is stored once, and a variant's URL always names the same
+content, so browsers may cache it for good.
+
+Pillow is optional; without it ``available()`` is False and uploads are
+refused.
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = ImageOps = None
+
+from process_pool import ProcessPool
+
+# Variants: name -> (width, height, mode); 'crop' fills the box and cuts the
+# overflow, 'fit' scales the whole picture to fit inside it
+DEFAULT_VARIANTS = {'thumb': (96, 96, 'crop'), 'preview': (640, 640, 'fit')}
+MAX_PIXELS = 50_000_000
+
+_pool = ProcessPool()
+
+
+class ImageError(ValueError):
+    """The upload is not an image Pillow can read, or is too large."""
+
+
+def available():
+    return Image is not None
+
+
+def probe(data):
+    """Check the header of the image in ``data`` without decoding it;
+    returns ``(format, width, height)``."""
+    if Image is None:
+        raise ImageError('Image uploads need Pillow installed')
+    try:
+        image = Image.open(io.BytesIO(data))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Not a readable image: {e}') from None
+    if image.width * image.height > MAX_PIXELS:
+        raise ImageError(f'Image is larger than {MAX_PIXELS // 1_000_000} megapixels')
+    return image.format, image.width, image.height
+
+
+def render_variants(data, variants=DEFAULT_VARIANTS, quality=82):
+    """``{name: JPEG bytes}`` for each variant of the image in ``data``.
+
+    JPEGs are decoded at a reduced scale when the largest variant allows it,
+    EXIF rotation is applied, and transparency is flattened onto white.
+    Metadata (camera, location) is not copied into the variants.
+    """
+    probe(data)
+    try:
+        image = Image.open(io.BytesIO(data))
+        largest = max(max(width, height) for width, height, _ in variants.values())
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P', 'PA'):
+            image = image.convert('RGBA')
+            flat = Image.new('RGB', image.size, 'white')
+            flat.paste(image, mask=image.getchannel('A'))
+            image = flat
+        else:
+            image = image.convert('RGB')
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Not a readable image: {e}') from None
+
+    rendered = {}
+    for name, (width, height, mode) in variants.items():
+        if mode == 'crop':
+            variant = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        else:
+            variant = image.copy()
+            variant.thumbnail((width, height), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        variant.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        rendered[name] = out.getvalue()
+    return rendered
+
+
+class ContentStore:
+    """Files named by the SHA-256 of their bytes, fanned out over
+    subfolders by the first two hex digits."""
+
+    def __init__(self, folder, suffix=''):
+        self.folder = folder
+        self.suffix = suffix
+
+    def path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest + self.suffix)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        """Store ``data`` unless it is already there; returns its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so a reader never sees half a file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return digest
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+
+def render_in_pool(data, variants=DEFAULT_VARIANTS, quality=82, max_workers=2):
+    """``render_variants`` in a worker process; returns its Future."""
+    return _pool.submit(max_workers, render_variants, data, variants, quality)
@@ -2,12 +2,22 @@ import os
 import sys
 from werkzeug.security import generate_password_hash
 
+import backups
+
 # Ensure we import the app package after adjusting cwd
 cwd = os.getcwd()
 # Try both project root and Flask instance folder where the DB may live
 db_candidates = [os.path.join(cwd, 'medical_store.db'), os.path.join(cwd, 'instance', 'medical_store.db')]
 for db_path in db_candidates:
     if os.path.exists(db_path):
+        # Keep a verified snapshot of the old database; restore it with
+        # `python backup_db.py restore <snapshot>`
+        try:
+            snapshot = backups.backup_database(db_path, os.path.join(cwd, 'instance', 'backups', 'main'), 'main')
+            print(f'Backed up existing database to {snapshot}')
+        except Exception as e:
+            print(f'Failed to back up {db_path}, leaving it in place: {e}')
+            continue
         try:
             os.remove(db_path)
             print(f'Removed existing database: {db_path}')
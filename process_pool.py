@@ -0,0 +1,47 @@
+"""A process pool for the CPU-bound work handed off by the app (consolidated
+branch reports, image resizing), started on first use.
+
+Each module keeps its own ``ProcessPool``, so a slow report never queues an
+upload behind it.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ProcessPool:
+    """A ProcessPoolExecutor started on first use, replaced when a
+    different number of workers is asked for and restarted once when a
+    worker process has died."""
+
+    def __init__(self):
+        self._executor = None
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, max_workers):
+        with self._lock:
+            if self._executor is not None and self._size != max_workers:
+                # Work already submitted finishes in the old pool, new work
+                # goes to a pool of the new size
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=max_workers)
+                self._size = max_workers
+            return self._executor
+
+    def reset(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, max_workers, fn, *args, **kwargs):
+        """``fn(*args, **kwargs)`` in a worker process; returns its Future."""
+        try:
+            return self.get(max_workers).submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); start a fresh pool once
+            self.reset()
+            return self.get(max_workers).submit(fn, *args, **kwargs)
@@ -0,0 +1,208 @@
+"""Per-request profiling for the admin profiler page.
+
+A RequestProfiler wraps one request either in cProfile (exact call counts
+and times) or in a sampling thread that records the request thread's stack
+every few milliseconds (low overhead, real stacks). Either way the result
+is reduced to the same stored form: a JSON file in the profiles folder
+with the request details, the top functions, the time spent in SQL and
+collapsed stacks ("frame;frame;frame value" lines) that flamegraph.pl,
+speedscope or inferno can draw. cProfile runs also keep the raw .prof
+file for pstats or snakeviz. Standard library only.
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MODES = ('cprofile', 'sampling')
+
+_active = threading.local()
+
+
+# SQL time of the profiled request, measured on every engine
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_active, 'profiler', None) is not None:
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    profiler = getattr(_active, 'profiler', None)
+    started = conn.info.get('profiler_started')
+    if profiler is not None and started:
+        profiler.sql_time += time.perf_counter() - started.pop()
+        profiler.sql_count += 1
+
+
+def frame_label(filename, name):
+    """Flame graph frame for a function: ``module.py:function``."""
+    label = name if filename == '~' else f'{os.path.basename(filename)}:{name}'
+    return label.replace(';', ',')
+
+
+class RequestProfiler:
+    def __init__(self, mode='cprofile', interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiler mode: {mode}')
+        self.mode = mode
+        self.interval = interval
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.duration = 0.0
+        self._profile = None
+        self._samples = {}
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def start(self):
+        _active.profiler = self
+        self._started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                             name='request-sampler', daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._stop.set()
+            self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+        _active.profiler = None
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self._samples[key] = self._samples.get(key, 0) + 1
+
+    def functions(self, limit=40):
+        """Top functions by cumulative time: ``[label, calls, own_s, cumulative_s]``."""
+        if self._profile is not None:
+            stats = pstats.Stats(self._profile).stats
+            rows = [[frame_label(filename, name) + (f':{line}' if line else ''), calls, own, cumulative]
+                    for (filename, line, name), (_, calls, own, cumulative, _) in stats.items()]
+        else:
+            own, total = {}, {}
+            for stack, count in self._samples.items():
+                frames = stack.split(';')
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+                for label in set(frames):
+                    total[label] = total.get(label, 0) + count
+            rows = [[label, None, own.get(label, 0) * self.interval, count * self.interval]
+                    for label, count in total.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def save(self, folder, **details):
+        """Write the profile to ``folder``; returns its id."""
+        os.makedirs(folder, exist_ok=True)
+        now = datetime.utcnow()
+        endpoint = (details.get('endpoint') or 'request').replace('/', '_')
+        profile_id = f'{now:%Y%m%d-%H%M%S-%f}-{endpoint}'
+        record = dict(details, id=profile_id, created_at=now.isoformat(timespec='seconds'), mode=self.mode,
+                      duration=self.duration, sql_time=self.sql_time, sql_count=self.sql_count,
+                      functions=self.functions())
+        if self._profile is not None:
+            # Stacks are rebuilt from the .prof file when downloaded, keeping
+            # that work off the profiled request
+            self._profile.dump_stats(os.path.join(folder, profile_id + '.prof'))
+        else:
+            record['stacks'] = {stack: int(count * self.interval * 1e6) for stack, count in self._samples.items()}
+        partial = os.path.join(folder, profile_id + '.json.partial')
+        with open(partial, 'w') as f:
+            json.dump(record, f)
+        os.replace(partial, os.path.join(folder, profile_id + '.json'))
+        return profile_id
+
+
+def collapsed_stacks(folder, record):
+    """``{stack: microseconds}`` of a stored profile, for flame graphs."""
+    if 'stacks' in record:
+        return record['stacks']
+    return collapse_pstats(pstats.Stats(os.path.join(folder, record['id'] + '.prof')).stats)
+
+
+def collapse_pstats(stats, max_depth=64, min_time=2e-5):
+    """Approximate collapsed stacks from a cProfile call graph.
+
+    cProfile only keeps caller -> callee edges, so each function's own time
+    is spread over the paths leading to it in proportion to the time each
+    caller spent calling it. Paths worth less than ``min_time`` seconds are
+    not expanded further.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    stacks = {}
+
+    def walk(func, path, share):
+        own, cumulative = stats[func][2], stats[func][3]
+        path = path + (func,)
+        key = ';'.join(frame_label(f[0], f[2]) for f in path)
+        if own * share > 0:
+            stacks[key] = stacks.get(key, 0) + int(own * share * 1e6)
+        if len(path) >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, ()):
+            if callee in path or callee not in stats or not stats[callee][3]:
+                continue
+            child_share = edge_time * share / stats[callee][3]
+            if child_share * stats[callee][3] >= min_time:
+                walk(callee, path, child_share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, (), 1.0)
+    return stacks
+
+
+def list_profiles(folder):
+    """Stored profiles without their function and stack data, newest first."""
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(folder), reverse=True):
+        if name.endswith('.json'):
+            record = load_profile(folder, name[:-len('.json')])
+            if record is not None and 'id' in record:  # skips settings.json
+                record.pop('functions', None)
+                record.pop('stacks', None)
+                profiles.append(record)
+    return profiles
+
+
+def load_profile(folder, profile_id):
+    path = os.path.join(folder, os.path.basename(profile_id) + '.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prune_profiles(folder, keep):
+    """Delete all but the ``keep`` newest profiles."""
+    for record in list_profiles(folder)[keep:]:
+        for suffix in ('.json', '.prof'):
+            path = os.path.join(folder, record['id'] + suffix)
+            if os.path.exists(path):
+                os.remove(path)
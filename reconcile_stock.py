@@ -0,0 +1,51 @@
+"""Check stock levels against purchase and sale history.
+
+Expected stock per medicine is purchased - sold + manual adjustments and
+write-offs, computed in one grouped query. Prints every medicine whose stock
+differs; ``--apply`` corrects them all and records the corrections in the
+stock ledger. Exits with status 1 when drift is found and not applied, so it
+can be run from cron as a check. Pass ``--all-branches`` to run it against
+every registered branch database.
+"""
+import argparse
+import sys
+import time
+
+from flask import g
+
+import app as app_module
+from app import db, reconcile_stock
+
+
+def run(branch, apply):
+    with app_module.app.app_context():
+        g.branch = None if branch == app_module.app.config['DEFAULT_BRANCH'] else branch
+        app_module.upgrade_schema(app_module.db.engines[g.branch])
+        started = time.perf_counter()
+        drift, orphans = reconcile_stock(apply=apply)
+        if apply:
+            db.session.commit()
+        for row in drift:
+            print(f'[{branch}] {row.medicine_id:>6} {row.name:<40} stock {row.actual:>7} '
+                  f'expected {row.expected:>7} ({row.difference:+d})')
+        if orphans:
+            print(f'[{branch}] line items reference deleted medicines: {", ".join(map(str, orphans))}')
+        status = 'corrected' if apply else 'out of balance'
+        print(f'[{branch}] {len(drift)} medicines {status} ({time.perf_counter() - started:.2f}s)')
+        return bool(drift) and not apply
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check stock levels against purchase and sale history.')
+    parser.add_argument('--apply', action='store_true', help='correct every drifted medicine')
+    parser.add_argument('--all-branches', action='store_true')
+    args = parser.parse_args()
+
+    config = app_module.app.config
+    targets = list(config['BRANCHES']) if args.all_branches else [config['DEFAULT_BRANCH']]
+    drifted = [run(branch, args.apply) for branch in targets]
+    sys.exit(1 if any(drifted) else 0)
+
+
+if __name__ == '__main__':
+    main()
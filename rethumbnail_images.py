@@ -0,0 +1,35 @@
+"""Render the medicine image variants again from the stored originals.
+
+Run after changing IMAGE_VARIANTS or IMAGE_QUALITY, or with --missing to
+finish images whose rendering was interrupted or failed (e.g. by a restart
+or a worker process that died). The originals are resized in a pool of
+IMAGE_WORKERS processes; variants that come out identical are stored once,
+as on upload.
+
+Usage:
+    python rethumbnail_images.py [--missing] [--all-branches]
+"""
+import sys
+
+from flask import g
+
+import app as app_module
+from app import db
+
+
+def main():
+    config = app_module.app.config
+    if not app_module.images.available():
+        sys.exit('Pillow is not installed')
+    targets = list(config['BRANCHES']) if '--all-branches' in sys.argv else [config['DEFAULT_BRANCH']]
+    for branch in targets:
+        with app_module.app.app_context():
+            g.branch = None if branch == config['DEFAULT_BRANCH'] else branch
+            app_module.upgrade_schema(db.engines[g.branch])
+            rendered, failed = app_module.rethumbnail_images(missing_only='--missing' in sys.argv)
+            db.session.commit()
+            print(f'[{branch}] {rendered} images rendered, {failed} failed')
+
+
+if __name__ == '__main__':
+    main()
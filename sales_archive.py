@@ -0,0 +1,336 @@
+"""Cold storage for old sales: one SQLite file per year.
+
+Sales older than the archive cutoff are moved out of the live ``sale`` and
+``sale_item`` tables into ``<folder>/sales_<year>.db`` by archive_sales.py.
+Each archive is self-contained (sale lines carry the medicine name) and is
+VACUUMed after every run so it stays compact. Years that can no longer
+receive sales are gzipped to ``sales_<year>.db.gz`` (SQLite has no built-in
+page compression); reading one unpacks it once into ``<folder>/unpacked``,
+shared by every process until the .gz changes, and archiving into it again
+restores the plain file first. The
+queries here mirror the ones app.py runs on the live tables so list, report
+and export views can union both transparently.
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Float, DateTime, Index,
+                        case, create_engine, inspect, select, func, text)
+
+metadata = MetaData()
+
+sale = Table(
+    'sale', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('invoice_number', String(50), nullable=False),
+    Column('customer_name', String(100), nullable=False),
+    Column('customer_contact', String(20)),
+    Column('customer_id', Integer, index=True),
+    Column('total_amount', Float, nullable=False),
+    Column('discount', Float),
+    Column('tax_amount', Float),
+    Column('payment_method', String(20)),
+    Column('sale_date', DateTime, nullable=False, index=True),
+    Column('item_count', Integer, nullable=False, default=0),
+)
+
+sale_item = Table(
+    'sale_item', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('sale_id', Integer, nullable=False, index=True),
+    Column('medicine_id', Integer, nullable=False),
+    Column('medicine_name', String(100)),
+    Column('batch_number', String(50)),
+    Column('quantity', Integer, nullable=False),
+    Column('unit_price', Float, nullable=False),
+    Column('total_price', Float, nullable=False),
+    # The FIFO cost stored on the live line; NULL when it was never costed
+    Column('cost_amount', Float),
+    Column('unmatched_quantity', Integer),
+)
+
+Index('ix_archive_sale_item_medicine', sale_item.c.medicine_id)
+
+
+def upgrade(engine):
+    """Add the columns the archive tables gained after a file was written;
+    rows archived before then read them as NULL."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                      f'{column.type.compile(engine.dialect)}'))
+
+
+class ArchivedSaleItem:
+    __slots__ = ('medicine_id', 'medicine_name', 'batch_number', 'quantity', 'unit_price', 'total_price')
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row._mapping[name])
+
+    @property
+    def medicine(self):
+        # Same shape as SaleItem.medicine for the sale templates
+        return SimpleNamespace(id=self.medicine_id, name=self.medicine_name or f'#{self.medicine_id}')
+
+
+class ArchivedSale:
+    """Read-only stand-in for a Sale loaded from an archive file."""
+    __slots__ = ('id', 'invoice_number', 'customer_name', 'customer_contact', 'customer_id',
+                 'total_amount', 'discount', 'tax_amount', 'payment_method', 'sale_date',
+                 'item_count', 'items')
+    archived = True
+
+    def __init__(self, row, items=()):
+        for name in self.__slots__[:-1]:
+            setattr(self, name, row._mapping[name])
+        self.items = list(items)
+
+
+class ArchiveStore:
+    """Access to the per-year archive files in ``folder``."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._engines = {}
+        self._lock = threading.RLock()
+
+    def path(self, year):
+        return os.path.join(self.folder, f'sales_{year}.db')
+
+    def compressed_path(self, year):
+        return self.path(year) + '.gz'
+
+    def compressed(self, year):
+        return os.path.exists(self.compressed_path(year))
+
+    def engine(self, year):
+        # Keyed by what is on disk, so a year another process compressed or
+        # reopened since is not read from a stale file
+        try:
+            stat = os.stat(self.compressed_path(year))
+            key = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        with self._lock:
+            cached = self._engines.get(year)
+            if cached is None or cached[0] != key:
+                if cached is not None:
+                    cached[1].dispose()
+                os.makedirs(self.folder, exist_ok=True)
+                engine = create_engine(f'sqlite:///{self.path(year) if key is None else self._unpack(year, key)}')
+                metadata.create_all(engine)
+                upgrade(engine)
+                self._engines[year] = cached = (key, engine)
+            return cached[1]
+
+    def unpacked_folder(self):
+        return os.path.join(self.folder, 'unpacked')
+
+    def _unpacked_copies(self, year):
+        folder = self.unpacked_folder()
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, name) for name in os.listdir(folder)
+                if name.startswith(f'sales_{year}.') and name.endswith('.db')]
+
+    def _unpack(self, year, key):
+        """Path of the plain copy of a compressed year, named after the .gz's
+        mtime and size so every process reuses it until the year changes."""
+        path = os.path.join(self.unpacked_folder(), f'sales_{year}.{key[0]}-{key[1]}.db')
+        if not os.path.exists(path):
+            os.makedirs(self.unpacked_folder(), exist_ok=True)
+            # Written aside and renamed, so another process never opens half a file
+            fd, temp_path = tempfile.mkstemp(dir=self.unpacked_folder(), suffix='.tmp')
+            with gzip.open(self.compressed_path(year), 'rb') as source, os.fdopen(fd, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.replace(temp_path, path)
+        # Copies of an earlier .gz of the year are not read again
+        for stale in self._unpacked_copies(year):
+            if stale != path:
+                self._remove(stale)
+        return path
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _forget(self, year):
+        with self._lock:
+            cached = self._engines.pop(year, None)
+            if cached is not None:
+                cached[1].dispose()
+
+    def compress(self, year):
+        """VACUUM and gzip a year that will not receive more sales."""
+        self.compact(year)
+        self._forget(year)
+        path = self.path(year)
+        # Written aside and renamed, so a reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(temp_path, self.compressed_path(year))
+        os.remove(path)
+
+    def reopen(self, year):
+        """Restore the plain file of a compressed year, to write to it."""
+        self._forget(year)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with gzip.open(self.compressed_path(year), 'rb') as source, os.fdopen(fd, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(temp_path, self.path(year))
+        os.remove(self.compressed_path(year))
+        for copy in self._unpacked_copies(year):
+            self._remove(copy)
+
+    def write(self, year, sales, items):
+        """Insert sales and their lines; rows already archived are skipped, so
+        an interrupted run can simply be repeated."""
+        if self.compressed(year):
+            self.reopen(year)
+        with self.engine(year).begin() as conn:
+            if sales:
+                conn.execute(sale.insert().prefix_with('OR IGNORE'), sales)
+            if items:
+                conn.execute(sale_item.insert().prefix_with('OR IGNORE'), items)
+
+    def compact(self, year):
+        with self.engine(year).connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+
+    def close(self):
+        with self._lock:
+            for _, engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+
+    # Queries
+    @staticmethod
+    def _filters(start=None, end=None, customer_id=None, customer_name=None):
+        filters = []
+        if start is not None:
+            filters.append(sale.c.sale_date >= start)
+        if end is not None:
+            filters.append(sale.c.sale_date <= end)
+        if customer_id is not None:
+            filters.append(sale.c.customer_id == customer_id)
+        elif customer_name:
+            filters.append(sale.c.customer_name.ilike(f'%{customer_name}%'))
+        return filters
+
+    def count(self, year, **filters):
+        with self.engine(year).connect() as conn:
+            return conn.execute(select(func.count()).select_from(sale).where(*self._filters(**filters))).scalar()
+
+    def sales(self, year, offset=0, limit=None, with_items=False, **filters):
+        """Archived sales, newest first."""
+        query = select(sale).where(*self._filters(**filters)).order_by(sale.c.sale_date.desc()).offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine(year).connect() as conn:
+            rows = conn.execute(query).all()
+            items = {}
+            if with_items and rows:
+                for item in conn.execute(select(sale_item).where(sale_item.c.sale_id.in_([r.id for r in rows]))):
+                    items.setdefault(item.sale_id, []).append(ArchivedSaleItem(item))
+        return [ArchivedSale(row, items.get(row.id, ())) for row in rows]
+
+    def get(self, year, sale_id):
+        with self.engine(year).connect() as conn:
+            row = conn.execute(select(sale).where(sale.c.id == sale_id)).first()
+            if row is None:
+                return None
+            items = [ArchivedSaleItem(item) for item in conn.execute(
+                select(sale_item).where(sale_item.c.sale_id == sale_id))]
+        return ArchivedSale(row, items)
+
+    def customer_totals(self, year, customer_id):
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(func.coalesce(func.sum(sale.c.total_amount), 0), func.count(sale.c.id),
+                       func.max(sale.c.sale_date)).where(sale.c.customer_id == customer_id)
+            ).one()
+
+    def sold_quantities(self, year):
+        """Units sold per medicine over the whole archived year."""
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(sale_item.c.medicine_id, func.sum(sale_item.c.quantity)).group_by(sale_item.c.medicine_id)
+            ).all()
+
+    def sale_lines(self, year):
+        """``(sale_date, medicine_id, quantity)`` of every archived line, oldest first."""
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(sale.c.sale_date, sale_item.c.medicine_id, sale_item.c.quantity)
+                .select_from(sale_item.join(sale, sale.c.id == sale_item.c.sale_id))
+                .order_by(sale.c.sale_date, sale_item.c.id)
+            ).all()
+
+    def margins(self, year, group, start, end):
+        """Rows of margin_report() for the archived lines sold from ``start``
+        up to (not including) ``end``, per medicine, day or month: key, label,
+        quantity, revenue, costed revenue, cost and uncosted lines."""
+        key, label = {
+            'medicine': (sale_item.c.medicine_id, sale_item.c.medicine_name),
+            'day': (func.date(sale.c.sale_date), func.date(sale.c.sale_date)),
+            'month': (func.strftime('%Y-%m', sale.c.sale_date), func.strftime('%Y-%m', sale.c.sale_date)),
+        }[group]
+        costed = sale_item.c.cost_amount.isnot(None)
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(key, label, func.sum(sale_item.c.quantity), func.sum(sale_item.c.total_price),
+                       func.sum(case((costed, sale_item.c.total_price), else_=0)),
+                       func.sum(sale_item.c.cost_amount), func.sum(case((costed, 0), else_=1)))
+                .select_from(sale_item.join(sale, sale.c.id == sale_item.c.sale_id))
+                .where(sale.c.sale_date >= start, sale.c.sale_date < end)
+                .group_by(key, label)
+            ).all()
+
+    def daily_totals(self, year, start, end):
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(func.date(sale.c.sale_date), func.sum(sale.c.total_amount), func.count(sale.c.id))
+                .where(*self._filters(start, end)).group_by(func.date(sale.c.sale_date))
+            ).all()
+
+    def top_medicines(self, year, start, end):
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(sale_item.c.medicine_id, sale_item.c.medicine_name,
+                       func.sum(sale_item.c.quantity), func.sum(sale_item.c.total_price))
+                .select_from(sale_item.join(sale, sale.c.id == sale_item.c.sale_id))
+                .where(*self._filters(start, end))
+                .group_by(sale_item.c.medicine_id, sale_item.c.medicine_name)
+            ).all()
+
+    def payment_methods(self, year, start, end):
+        with self.engine(year).connect() as conn:
+            return conn.execute(
+                select(sale.c.payment_method, func.count(sale.c.id), func.sum(sale.c.total_amount))
+                .where(*self._filters(start, end)).group_by(sale.c.payment_method)
+            ).all()
+
+
+def merge_grouped(rows_by_key, rows, key_len=1):
+    """Add grouped aggregate rows into ``rows_by_key`` (key -> list of sums)."""
+    for row in rows:
+        key = tuple(row[:key_len]) if key_len > 1 else row[0]
+        values = [value or 0 for value in row[key_len:]]
+        if key in rows_by_key:
+            rows_by_key[key] = [a + b for a, b in zip(rows_by_key[key], values)]
+        else:
+            rows_by_key[key] = values
+    return rows_by_key
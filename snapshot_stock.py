@@ -0,0 +1,26 @@
+"""Periodic job: snapshot the quantity of every medicine.
+
+Stock-as-of-date queries start from the latest snapshot and only replay the
+ledger movements after it, so run this daily, e.g.
+``0 0 * * * cd /path/to/app && python snapshot_stock.py``.
+"""
+import sys
+
+from flask import g
+
+import app as app_module
+from app import take_stock_snapshot
+
+
+def main():
+    config = app_module.app.config
+    targets = list(config['BRANCHES']) if '--all-branches' in sys.argv else [config['DEFAULT_BRANCH']]
+    for branch in targets:
+        with app_module.app.app_context():
+            g.branch = None if branch == config['DEFAULT_BRANCH'] else branch
+            app_module.upgrade_schema(app_module.db.engines[g.branch])
+            print(f'[{branch}] snapshot of {take_stock_snapshot()} medicines recorded')
+
+
+if __name__ == '__main__':
+    main()
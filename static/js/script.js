@@ -136,3 +136,100 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 });
+
+// Local catalog copy for the sale screen. Medicines are kept in IndexedDB
+// (one database per branch) and only changes since the stored catalog version
+// are fetched from the server. Falls back to memory if IndexedDB is missing.
+class CatalogStore {
+    constructor(branch) {
+        this.dbName = `medical-store-catalog-${branch || 'main'}`;
+        this.version = 0;
+        this.medicines = new Map();
+        this.ready = this.open().then(() => this.load());
+    }
+
+    open() {
+        if (!window.indexedDB) {
+            this.db = null;
+            return Promise.resolve();
+        }
+        return new Promise(resolve => {
+            const request = indexedDB.open(this.dbName, 1);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                db.createObjectStore('medicines', { keyPath: 'id' });
+                db.createObjectStore('meta');
+            };
+            request.onsuccess = () => {
+                this.db = request.result;
+                resolve();
+            };
+            request.onerror = () => {
+                this.db = null;
+                resolve();
+            };
+        });
+    }
+
+    load() {
+        if (!this.db) return Promise.resolve();
+        return new Promise((resolve, reject) => {
+            const tx = this.db.transaction(['medicines', 'meta'], 'readonly');
+            tx.objectStore('medicines').getAll().onsuccess = e => {
+                e.target.result.forEach(m => this.medicines.set(m.id, m));
+            };
+            tx.objectStore('meta').get('version').onsuccess = e => {
+                this.version = e.target.result || 0;
+            };
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    async sync(feedUrl) {
+        await this.ready;
+        const response = await fetch(`${feedUrl}?since=${this.version}`, { credentials: 'same-origin' });
+        if (!response.ok) throw new Error(`Catalog feed returned ${response.status}`);
+        const feed = await response.json();
+
+        const rows = feed.upserts.map(row => {
+            const medicine = {};
+            feed.fields.forEach((field, i) => { medicine[field] = row[i]; });
+            return medicine;
+        });
+
+        if (feed.full) this.medicines.clear();
+        rows.forEach(m => this.medicines.set(m.id, m));
+        feed.deletes.forEach(id => this.medicines.delete(id));
+        this.version = feed.version;
+
+        if (!this.db) return;
+        await new Promise((resolve, reject) => {
+            const tx = this.db.transaction(['medicines', 'meta'], 'readwrite');
+            const store = tx.objectStore('medicines');
+            if (feed.full) store.clear();
+            rows.forEach(m => store.put(m));
+            feed.deletes.forEach(id => store.delete(id));
+            tx.objectStore('meta').put(feed.version, 'version');
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    // In-stock medicines matching name, batch or id, sorted by name
+    search(term, limit) {
+        const needle = (term || '').toLowerCase();
+        const matches = [];
+        this.medicines.forEach(m => {
+            if (m.stock <= 0) return;
+            if (!needle ||
+                m.name.toLowerCase().includes(needle) ||
+                (m.batch || '').toLowerCase().includes(needle) ||
+                String(m.id).includes(needle)) {
+                matches.push(m);
+            }
+        });
+        matches.sort((a, b) => a.name.localeCompare(b.name));
+        return limit ? matches.slice(0, limit) : matches;
+    }
+}
@@ -0,0 +1,71 @@
+import pytest
+
+from app import app, db, ApiToken, Medicine, User, create_api_token
+from test_stock_ledger import add_medicine
+
+
+@pytest.fixture
+def api_headers():
+    with app.app_context():
+        token = create_api_token(User.query.filter_by(username='Piyu').one(), 'test POS')
+        db.session.commit()
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_requests_without_a_valid_token_are_rejected():
+    with app.test_client() as client:
+        assert client.get('/api/v1/medicines?ids=1').status_code == 401
+        response = client.get('/api/v1/medicines?ids=1', headers={'Authorization': 'Bearer nope'})
+        assert response.status_code == 401
+        assert 'Set-Cookie' not in response.headers
+
+
+def test_batch_fetch_and_sale_creation(client, api_headers):
+    first = add_medicine(client, 'API Med A', 10, price='2.5')
+    second = add_medicine(client, 'API Med B', 4, price='8')
+
+    with app.test_client() as api:
+        response = api.get(f'/api/v1/medicines?ids={first},{second},999999', headers=api_headers)
+        body = response.get_json()
+        assert [row[1] for row in body['rows']] == ['API Med A', 'API Med B']
+        assert body['missing'] == [999999]
+        assert 'Set-Cookie' not in response.headers
+
+        response = api.post('/api/v1/sales', headers=api_headers, json={'sales': [
+            {'customer_name': 'POS 1', 'items': [[first, 2], [second, 1, 7.5]]},
+            {'customer_name': 'POS 2', 'items': [[first, 3]]},
+        ]})
+        assert response.status_code == 201
+        rows = response.get_json()['rows']
+        assert [row[2] for row in rows] == [12.5, 7.5]
+
+        # The whole batch fails when one sale cannot be filled
+        response = api.post('/api/v1/sales', headers=api_headers, json={'sales': [
+            {'items': [[first, 1]]},
+            {'items': [[second, 50]]},
+        ]})
+        assert response.status_code == 409 and response.get_json()['index'] == 1
+
+        # Values the sale form refuses are refused here too, before any stock moves
+        for sale in ({'items': [[first, 1]], 'discount': 150}, {'items': [[first, 1]], 'tax_percentage': -5},
+                     {'items': [[first, 1, -2]]}, {'items': [[first, 0], [second, -1]]}, {'items': [['x', 1]]}):
+            response = api.post('/api/v1/sales', headers=api_headers, json={'sales': [{'items': [[first, 1]]}, sale]})
+            assert response.status_code == 400 and response.get_json()['index'] == 1
+
+        page = api.get('/api/v1/sales?limit=1&after_id=' + str(rows[0][0] - 1), headers=api_headers).get_json()
+        assert page['rows'][0][1] == rows[0][1]
+        assert page['rows'][0][8] == [[first, 2, 2.5, 5.0], [second, 1, 7.5, 7.5]]
+        assert page['next_after_id'] == rows[0][0]
+
+    with app.app_context():
+        assert db.session.get(Medicine, first).quantity == 5
+        assert db.session.get(Medicine, second).quantity == 3
+
+
+def test_revoked_token_is_rejected(api_headers):
+    with app.app_context():
+        for api_token in ApiToken.query.all():
+            api_token.revoked_at = db.func.now()
+        db.session.commit()
+    with app.test_client() as api:
+        assert api.get('/api/v1/medicines?ids=1', headers=api_headers).status_code == 401
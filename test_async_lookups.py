@@ -0,0 +1,199 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+from werkzeug.datastructures import MultiDict
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+from app import app, db, Medicine, dashboard_version
+
+
+def asgi_get(path, cookie=None):
+    """``(status, headers, body)`` of a GET through the ASGI application."""
+    import asgi
+
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'root_path': '',
+             'headers': [(b'host', b'localhost')] + ([(b'cookie', f'session={cookie}'.encode())] if cookie else []),
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 5000), 'scheme': 'http', 'http_version': '1.1'}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        try:
+            await asgi.application(scope, receive, send)
+        finally:
+            await asgi.dashboards.close()
+            await asgi.lookups.close()
+
+    asyncio.run(run())
+    start = messages[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def test_async_lookups_match_the_flask_routes(client):
+    with app.app_context():
+        medicine = Medicine(name='Async Lookup Med', description='Syrup', quantity=4, price=3.0, batch_number='AL1',
+                            expiry_date=(datetime.utcnow() + timedelta(days=60)).date())
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+    client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Async Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', '1'), ('price[]', '3')]))
+    sale_id = client.get('/lookup/dashboard').get_json()['recent_sales'][0]['id']
+    cookie = client.get_cookie('session').value
+
+    for path in ('/lookup/medicines?q=Async%20Lookup', f'/lookup/stock?ids={medicine_id},999999',
+                 f'/lookup/sales/{sale_id}', '/lookup/dashboard'):
+        expected = client.get(path).get_json()
+        status, headers, body = asgi_get('/async' + path, cookie)
+        assert status == 200 and headers[b'content-type'] == b'application/json'
+        assert json.loads(body) == expected
+    assert expected['low_stock_medicines'] >= 1
+    assert asgi_get(f'/async/lookup/stock?ids={medicine_id}', cookie)[2] == \
+        json.dumps({'stock': {str(medicine_id): 3}, 'missing': []}).encode()
+
+    assert asgi_get('/async/lookup/sales/999999', cookie)[0] == 404
+    assert asgi_get('/async/lookup/dashboard')[0] == 401
+    assert asgi_get('/async/lookup/dashboard', 'forged.cookie')[0] == 401
+
+
+def test_async_lookups_follow_the_session_branch(client):
+    client.get('/dashboard?branch=north')
+    client.post('/add_medicine', data={
+        'name': 'North Async Med', 'description': '', 'quantity': '2', 'price': '6', 'supplier_id': '',
+        'expiry_date': (datetime.utcnow() + timedelta(days=90)).strftime('%Y-%m-%d'), 'batch_number': 'NA'})
+    cookie = client.get_cookie('session').value
+    try:
+        for path in ('/lookup/dashboard', '/lookup/medicines?q=North%20Async'):
+            expected = client.get(path).get_json()
+            status, _, body = asgi_get('/async' + path, cookie)
+            assert status == 200 and json.loads(body) == expected
+        assert [row[1] for row in expected['rows']] == ['North Async Med']
+    finally:
+        client.get('/dashboard?branch=main')
+
+
+def test_other_paths_are_served_by_flask():
+    status, headers, body = asgi_get('/login')
+    assert status == 200 and b'<form' in body
+
+
+def test_dashboard_stream_runs_on_the_event_loop(client):
+    import asgi
+
+    cookie = client.get_cookie('session').value
+    with app.app_context():
+        since = dashboard_version()
+    scope = {'type': 'http', 'method': 'GET', 'path': '/dashboard/stream', 'query_string': f'since={since}'.encode(),
+             'root_path': '', 'headers': [(b'host', b'localhost'), (b'cookie', f'session={cookie}'.encode())],
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 5000), 'scheme': 'http', 'http_version': '1.1'}
+
+    def add_medicine():
+        with app.app_context():
+            db.session.add(Medicine(name='Async Stream Med', quantity=3, price=2.0,
+                                    expiry_date=(datetime.utcnow() + timedelta(days=60)).date()))
+            db.session.commit()
+
+    async def run():
+        messages, gone, received = [], asyncio.Event(), asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b''}
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if b'event: delta' in message.get('body', b''):
+                received.set()
+
+        stream = asyncio.create_task(asgi.application(scope, receive, send))
+        try:
+            await asyncio.sleep(0.2)
+            # At most one viewer: the second is turned away
+            app.config['DASHBOARD_MAX_CLIENTS'] = 1
+            refused = []
+            await asgi.application(dict(scope), receive, lambda message: refused.append(message) or asyncio.sleep(0))
+            assert refused[0]['status'] == 503
+            await asyncio.to_thread(add_medicine)
+            await asyncio.wait_for(received.wait(), 5)
+            gone.set()
+            await asyncio.wait_for(stream, 5)
+        finally:
+            app.config['DASHBOARD_MAX_CLIENTS'] = 50
+            await asgi.dashboards.close()
+            await asgi.lookups.close()
+        return messages
+
+    app.config.update(DASHBOARD_POLL_SECONDS=0.05, DASHBOARD_HEARTBEAT=0.1)
+    try:
+        messages = asyncio.run(run())
+    finally:
+        app.config.update(DASHBOARD_POLL_SECONDS=2, DASHBOARD_HEARTBEAT=15)
+    assert messages[0]['status'] == 200 and dict(messages[0]['headers'])[b'content-type'] == b'text/event-stream'
+    body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+    delta = json.loads(body.split('event: delta\ndata: ', 1)[1].split('\n', 1)[0])
+    assert delta['medicines'] == 1 and delta['low_items'][0]['name'] == 'Async Stream Med'
+
+
+def test_dashboard_stream_of_another_branch(client):
+    import asgi
+
+    client.get('/dashboard?branch=north')
+    cookie = client.get_cookie('session').value
+    client.get('/dashboard?branch=main')
+    with app.app_context():
+        g.branch = 'north'
+        since = dashboard_version()
+        db.session.add(Medicine(name='North Stream Med', quantity=1, price=2.0,
+                                expiry_date=(datetime.utcnow() + timedelta(days=60)).date()))
+        db.session.commit()
+    scope = {'type': 'http', 'method': 'GET', 'path': '/dashboard/stream', 'query_string': f'since={since}'.encode(),
+             'root_path': '', 'headers': [(b'host', b'localhost'), (b'cookie', f'session={cookie}'.encode())],
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 5000), 'scheme': 'http', 'http_version': '1.1'}
+
+    async def run():
+        messages, caught_up = [], asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b''}
+            await caught_up.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if b'event: delta' in message.get('body', b''):
+                caught_up.set()
+
+        try:
+            await asyncio.wait_for(asgi.application(scope, receive, send), 5)
+        finally:
+            await asgi.dashboards.close()
+            await asgi.lookups.close()
+        return messages
+
+    messages = asyncio.run(run())
+    # The user lives in the main database, the events in the north one
+    assert messages[0]['status'] == 200
+    body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+    delta = json.loads(body.split('event: delta\ndata: ', 1)[1].split('\n', 1)[0])
+    assert delta['low_items'][0]['name'] == 'North Stream Med'
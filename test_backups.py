@@ -0,0 +1,60 @@
+import os
+import sqlite3
+from unittest import mock
+
+import pytest
+
+import backups
+from app import app, db, Supplier, backup_branch, restore_branch
+
+
+def make_database(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO item (name) VALUES (?)', [(f'item {i}',) for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def test_snapshot_is_verified_and_pruned(tmp_path):
+    source = str(tmp_path / 'live.db')
+    make_database(source, 2000)
+    folder = str(tmp_path / 'backups')
+
+    stamps = ['20240101-000000', '20240102-000000', '20240103-000000']
+    for stamp in stamps:
+        with mock.patch.object(backups, 'snapshot_name', return_value=f'main-{stamp}.db'):
+            backups.backup_database(source, folder, 'main', pages=4)
+    open(os.path.join(folder, 'main-pre-restore-20240101-000000.db'), 'w').close()
+
+    assert [os.path.basename(p) for p in backups.list_backups(folder, 'main')] == [
+        f'main-{stamp}.db' for stamp in reversed(stamps)]
+    removed = backups.prune_backups(folder, 'main', keep=2)
+    assert [os.path.basename(p) for p in removed] == ['main-20240101-000000.db']
+
+    conn = sqlite3.connect(backups.list_backups(folder, 'main')[0])
+    assert conn.execute('SELECT COUNT(*) FROM item').fetchone()[0] == 2000
+    conn.close()
+
+
+def test_corrupt_snapshot_fails_verification(tmp_path):
+    path = tmp_path / 'broken.db'
+    path.write_bytes(b'SQLite format 3\x00' + b'\x00' * 200)
+    with pytest.raises(backups.BackupError):
+        backups.verify_backup(str(path))
+
+
+def test_branch_backup_and_restore():
+    with app.app_context():
+        db.session.add(Supplier(name='Before Backup', contact='Backup'))
+        db.session.commit()
+        snapshot, _ = backup_branch('main')
+
+        db.session.add(Supplier(name='After Backup', contact='Backup'))
+        db.session.commit()
+        safety = restore_branch('main', snapshot)
+        db.session.remove()
+
+        names = {supplier.name for supplier in Supplier.query.all()}
+        assert 'Before Backup' in names and 'After Backup' not in names
+        assert os.path.basename(safety).startswith('main-pre-restore-')
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from werkzeug.datastructures import MultiDict
+
+import app as app_module
+from app import app, db, Barcode, CatalogChange, Medicine
+from test_stock_ledger import add_medicine
+
+
+def test_scan_resolves_codes_and_follows_writes(client):
+    medicine_id = add_medicine(client, 'Scan Med', 30, price='4')
+    client.post(f'/medicine/{medicine_id}/barcodes', data={'code': '8901234567890', 'pack_size': '1'})
+    client.post(f'/medicine/{medicine_id}/barcodes', data={'code': '8901234567891', 'pack_size': '10'})
+
+    unit = client.get('/sale/scan?code=8901234567890').get_json()
+    assert (unit['id'], unit['price'], unit['stock'], unit['pack_size']) == (medicine_id, 4.0, 30, 1)
+    assert client.get('/sale/scan?code=8901234567891').get_json()['pack_size'] == 10
+
+    # Sales and bulk edits are picked up from the catalog change log
+    client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Scan Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', '10'), ('price[]', '4'),
+    ]))
+    client.post('/api/medicines/bulk-edit?apply=1', json={'changes': [{'id': medicine_id, 'price': 4.5}]})
+    unit = client.get('/sale/scan?code=8901234567890').get_json()
+    assert (unit['price'], unit['stock']) == (4.5, 20)
+
+    # A code belongs to one medicine only
+    other_id = add_medicine(client, 'Scan Other Med', 5)
+    client.post(f'/medicine/{other_id}/barcodes', data={'code': '8901234567890'})
+    with app.app_context():
+        assert Barcode.query.filter_by(code='8901234567890').one().medicine_id == medicine_id
+
+    client.post(f'/medicine/{medicine_id}/delete')
+    assert client.get('/sale/scan?code=8901234567890').status_code == 404
+    assert client.get('/sale/scan?code=8901234567891').status_code == 404
+
+
+def test_scans_check_the_change_log_once_per_interval(client, max_queries):
+    medicine_id = add_medicine(client, 'Scan Interval Med', 8, price='2')
+    client.post(f'/medicine/{medicine_id}/barcodes', data={'code': '8901234567899', 'pack_size': '1'})
+    app.config['BARCODE_REFRESH_SECONDS'] = 3600
+    try:
+        assert client.get('/sale/scan?code=8901234567899').get_json()['price'] == 2.0
+        with max_queries(10) as statements:
+            client.get('/sale/scan?code=8901234567899')
+        assert not any('catalog_change' in statement for statement in statements)
+
+        # Another worker process writes straight to the database: not seen
+        # until the interval is up
+        with app.app_context(), db.engine.begin() as conn:
+            conn.execute(Medicine.__table__.update().where(Medicine.id == medicine_id).values(price=3.0))
+            conn.execute(CatalogChange.__table__.insert().values(medicine_id=medicine_id, change_type='upsert',
+                                                                 changed_at=datetime.utcnow()))
+        assert client.get('/sale/scan?code=8901234567899').get_json()['price'] == 2.0
+        # A commit in this process is seen on the next scan, with the other write
+        client.post('/api/medicines/bulk-edit?apply=1', json={'changes': [{'id': medicine_id, 'quantity': 6}]})
+        assert client.get('/sale/scan?code=8901234567899').get_json()['stock'] == 6
+        assert client.get('/sale/scan?code=8901234567899').get_json()['price'] == 3.0
+
+        with app.app_context(), db.engine.begin() as conn:
+            conn.execute(Medicine.__table__.update().where(Medicine.id == medicine_id).values(price=3.5))
+            conn.execute(CatalogChange.__table__.insert().values(medicine_id=medicine_id, change_type='upsert',
+                                                                 changed_at=datetime.utcnow()))
+        app_module._barcode_indexes[None].checked_at -= 3600
+        assert client.get('/sale/scan?code=8901234567899').get_json()['price'] == 3.5
+    finally:
+        app.config['BARCODE_REFRESH_SECONDS'] = 1
+
+
+def test_refresh_swaps_in_a_new_index(client):
+    medicine_id = add_medicine(client, 'Scan Swap Med', 8, price='2')
+    client.post(f'/medicine/{medicine_id}/barcodes', data={'code': '8901234567900', 'pack_size': '1'})
+    assert client.get('/sale/scan?code=8901234567900').get_json()['price'] == 2.0
+    index = app_module._barcode_indexes[None]
+    codes, medicines, _ = before = index.index
+
+    client.post('/api/medicines/bulk-edit?apply=1', json={'changes': [{'id': medicine_id, 'price': 2.5}]})
+    assert client.get('/sale/scan?code=8901234567900').get_json()['price'] == 2.5
+    # A scan still holding the old index reads it unchanged
+    assert index.index is not before
+    assert medicines[medicine_id][2] == 2.0 and '8901234567900' in codes
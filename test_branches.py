@@ -0,0 +1,144 @@
+import csv
+import io
+from datetime import date, datetime, timedelta
+
+from flask import g
+from sqlalchemy import text
+from werkzeug.datastructures import MultiDict
+
+import branch_reports
+from app import app, db, Medicine, Sale, User, archive_sales, branch_urls
+
+
+def branch_medicine(branch, name):
+    with app.app_context():
+        g.branch = branch
+        return Medicine.query.filter_by(name=name).one_or_none()
+
+
+def add_medicine(client, name, quantity, price):
+    client.post('/add_medicine', data={
+        'name': name, 'description': '', 'quantity': str(quantity), 'price': price, 'supplier_id': '',
+        'expiry_date': (date.today() + timedelta(days=365)).strftime('%Y-%m-%d'), 'batch_number': 'BR'})
+
+
+def sell(client, medicine_id, quantity, price):
+    client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Branch Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', str(quantity)), ('price[]', price)]))
+
+
+def test_requests_use_the_bound_branch_and_users_stay_in_main(client):
+    client.get('/dashboard?branch=north')
+    add_medicine(client, 'North Only Med', 7, '5')
+    assert branch_medicine('north', 'North Only Med') is not None
+    assert branch_medicine(None, 'North Only Med') is None
+    # The choice sticks to the browser session until it is changed
+    assert b'North Only Med' in client.get('/medicines?search=North+Only').data
+    client.get('/dashboard?branch=main')
+    assert b'North Only Med' not in client.get('/medicines?search=North+Only').data
+
+    # Users are shared: looked up in the main database whatever the branch
+    with app.app_context():
+        g.branch = 'north'
+        assert User.query.filter_by(username='Piyu').one().is_admin
+        with db.engines['north'].connect() as conn:
+            assert conn.execute(text('SELECT count(*) FROM user')).scalar() == 0
+
+    # API clients pick the branch per request
+    headers = {'X-Branch': 'nowhere'}
+    assert client.get('/api/v1/medicines', headers=headers).status_code == 400
+
+
+def test_consolidated_report_merges_every_branch(client):
+    client.get('/dashboard?branch=north')
+    add_medicine(client, 'North Report Med', 20, '4')
+    sell(client, branch_medicine('north', 'North Report Med').id, 3, '4')
+    client.get('/dashboard?branch=main')
+    add_medicine(client, 'Main Report Med', 4, '2')
+    sell(client, branch_medicine(None, 'Main Report Med').id, 2, '2')
+
+    today = datetime.utcnow()
+    first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    dates = [(first_day + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((today - first_day).days + 1)]
+    with app.app_context():
+        urls = branch_urls()
+        totals = {}
+        for code, branch in (('main', None), ('north', 'north')):
+            g.branch = branch
+            totals[code] = db.session.query(db.func.sum(Sale.total_amount)).filter(
+                Sale.sale_date >= first_day, Sale.sale_date <= today).scalar() or 0
+    assert set(urls) == {'main', 'north'}
+
+    merged = branch_reports.merge_reports(
+        branch_reports.fan_out(branch_reports.branch_report, urls, first_day, today, 10), dates)
+    assert merged['per_branch']['north'] == {'error': None, 'total': 12.0, 'count': 1}
+    assert merged['per_branch']['main']['total'] == totals['main']
+    assert round(sum(merged['amounts']), 2) == round(totals['main'] + totals['north'], 2)
+    assert ('main', 'Main Report Med', 2, None) in merged['low_stock']
+    assert not any(code == 'north' and name == 'Main Report Med' for code, name, *_ in merged['low_stock'])
+    assert client.get('/reports/consolidated').status_code == 200
+
+    # The configured threshold decides what is low on stock
+    low_stock = branch_reports.merge_reports(
+        branch_reports.fan_out(branch_reports.branch_report, urls, first_day, today, 2), dates)['low_stock']
+    assert not any(name == 'Main Report Med' for _, name, *_ in low_stock)
+
+    # A branch that cannot be read is reported without hiding the others
+    results = branch_reports.fan_out(branch_reports.branch_report,
+                                     dict(urls, south='sqlite:////nonexistent/south.db'), first_day, today, 10)
+    merged = branch_reports.merge_reports(results, dates)
+    assert merged['per_branch']['south']['error'] and merged['per_branch']['north']['total'] == 12.0
+
+
+def test_consolidated_export_labels_rows_by_branch(client):
+    client.get('/dashboard?branch=north')
+    add_medicine(client, 'North Export Med', 9, '3')
+    client.get('/dashboard?branch=main')
+    add_medicine(client, 'Main Export Med', 9, '3')
+
+    response = client.get('/reports/consolidated/export?type=inventory')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:3] == ['Branch', 'ID', 'Name']
+    branches = {row[2]: row[0] for row in rows[1:]}
+    assert branches['North Export Med'] == 'North Branch'
+    assert branches['Main Export Med'] == 'Main Branch'
+
+
+def test_consolidated_sales_export_includes_archived_years(client):
+    client.get('/dashboard?branch=north')
+    add_medicine(client, 'North Archived Med', 9, '3')
+    medicine_id = branch_medicine('north', 'North Archived Med').id
+    sell(client, medicine_id, 2, '3')
+    sell(client, medicine_id, 1, '3')
+    sold_on = datetime.utcnow() - timedelta(days=800)
+    with app.app_context():
+        g.branch = 'north'
+        old = Sale.query.order_by(Sale.id.desc()).offset(1).first()
+        old.sale_date, invoice = sold_on, old.invoice_number
+        db.session.commit()
+        assert archive_sales(older_than_days=365)
+    client.get('/dashboard?branch=main')
+
+    def exported(query):
+        response = client.get('/reports/consolidated/export?type=sales' + query)
+        return {row[1]: row[0] for row in csv.reader(io.StringIO(response.get_data(as_text=True)))}
+
+    day = lambda when: when.strftime('%Y-%m-%d')
+    assert exported('')[invoice] == 'North Branch'
+    assert exported(f'&start_date={day(sold_on - timedelta(days=1))}&end_date={day(sold_on + timedelta(days=1))}') \
+        == {'Invoice #': 'Branch', invoice: 'North Branch'}
+    assert invoice not in exported(f'&start_date={day(datetime.utcnow() - timedelta(days=30))}'
+                                   f'&end_date={day(datetime.utcnow())}')
+
+
+def test_report_pool_follows_the_number_of_branches():
+    urls = {'a': 'sqlite://', 'b': 'sqlite://'}
+    branch_reports.fan_out(branch_reports.branch_export, urls, 'inventory')
+    pool = branch_reports._pool._executor
+    assert pool._max_workers == 2
+    branch_reports.fan_out(branch_reports.branch_export, urls, 'inventory')
+    assert branch_reports._pool._executor is pool
+    results = branch_reports.fan_out(branch_reports.branch_export, dict(urls, c='sqlite://'), 'inventory')
+    assert branch_reports._pool._executor._max_workers == 3 and set(results) == {'a', 'b', 'c'}
@@ -0,0 +1,70 @@
+import io
+from datetime import date
+
+from app import app, db, CatalogChange, Medicine, StockMovement, Supplier, SupplierStats
+from test_stock_ledger import add_medicine
+
+
+def make_supplier(name):
+    with app.app_context():
+        supplier = Supplier(name=name, contact='Bulk')
+        db.session.add(supplier)
+        db.session.commit()
+        return supplier.id
+
+
+def test_filter_expression_preview_and_apply(client):
+    supplier_id = make_supplier('Bulk Supplier')
+    ids = [add_medicine(client, f'Bulk Med {i}', 10, price='10') for i in range(3)]
+    with app.app_context():
+        Medicine.query.filter(Medicine.id.in_(ids)).update({'supplier_id': supplier_id})
+        db.session.commit()
+
+    payload = {'filter': {'supplier_id': supplier_id}, 'set': {'price': '+4%', 'quantity': '-2'}}
+    preview = client.post('/api/medicines/bulk-edit', json=payload).get_json()
+    assert preview['applied'] is False and preview['count'] == 3
+    assert {(c['field'], c['old'], c['new']) for c in preview['changes']} == {('price', 10.0, 10.4), ('quantity', 10, 8)}
+    with app.app_context():
+        assert db.session.get(Medicine, ids[0]).price == 10.0
+        version = db.session.query(db.func.max(CatalogChange.id)).scalar()
+
+    applied = client.post('/api/medicines/bulk-edit?apply=1', json=payload).get_json()
+    assert applied['applied'] is True and applied['count'] == 3
+    with app.app_context():
+        assert [(m.price, m.quantity) for m in Medicine.query.filter(Medicine.id.in_(ids))] == [(10.4, 8)] * 3
+        movements = StockMovement.query.filter(StockMovement.medicine_id.in_(ids),
+                                               StockMovement.movement_type == 'adjustment').all()
+        assert sorted(m.quantity for m in movements) == [-2, -2, -2]
+        assert CatalogChange.query.filter(CatalogChange.id > version).count() == 3
+        assert db.session.get(SupplierStats, supplier_id).stock_value == 3 * 8 * 10.4
+
+
+def test_csv_row_changes(client):
+    medicine_id = add_medicine(client, 'Bulk CSV Med', 5)
+    other_supplier = make_supplier('Bulk CSV Supplier')
+    csv_text = f'id,price,supplier_id,expiry_date,quantity\n{medicine_id},12.5,{other_supplier},2031-01-31,+5\n'
+    response = client.post('/api/medicines/bulk-edit', data={'file': (io.BytesIO(csv_text.encode()), 'c.csv'),
+                                                            'apply': '1'})
+    assert response.get_json()['count'] == 1
+    with app.app_context():
+        medicine = db.session.get(Medicine, medicine_id)
+        assert (medicine.price, medicine.supplier_id, medicine.expiry_date, medicine.quantity) == \
+            (12.5, other_supplier, date(2031, 1, 31), 10)
+
+
+def test_invalid_edits_are_rejected(client):
+    medicine_id = add_medicine(client, 'Bulk Reject Med', 1)
+    response = client.post('/api/medicines/bulk-edit', json={'changes': [{'id': medicine_id, 'quantity': '-5'}]})
+    assert response.status_code == 400
+    assert client.post('/api/medicines/bulk-edit', json={'set': {'price': '*2'}}).status_code == 400
+    with app.app_context():
+        assert db.session.get(Medicine, medicine_id).quantity == 1
+
+
+def test_malformed_payloads_are_rejected(client):
+    for payload in ([1, 2], 'price', {'changes': 'all'}, {'filter': ['ids'], 'set': {'price': '1'}},
+                    {'filter': {'ids': ['x']}, 'set': {'price': '1'}},
+                    {'filter': {'ids': 7}, 'set': {'price': '1'}},
+                    {'filter': {'supplier_id': 'acme'}, 'set': {'price': '1'}}):
+        response = client.post('/api/medicines/bulk-edit', json=payload)
+        assert response.status_code == 400 and response.get_json()['error'], payload
@@ -0,0 +1,70 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import cache
+from app import app, app_cache, db, Medicine, create_sale
+
+
+def test_memory_cache_evicts_least_recently_used():
+    store = cache.MemoryCache(max_entries=2)
+    store.set('a', 1)
+    store.set('b', 2)
+    assert store.get('a') == 1  # 'b' is now the least recently used
+    store.set('c', 3)
+    assert store.get('b') is None and store.get('a') == 1 and store.get('c') == 3
+    info = store.info()
+    assert (info['hits'], info['misses'], info['sets'], info['evictions'], info['entries']) == (3, 1, 3, 1, 2)
+
+
+def test_sqlite_cache_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    # Two instances on one file stand in for two worker processes
+    first, second = cache.SQLiteCache(path), cache.SQLiteCache(path)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return {'total': len(calls)}
+
+    assert first.cached(['main:sales'], 'kpis', factory) == {'total': 1}
+    assert second.cached(['main:sales'], 'kpis', factory) == {'total': 1}
+    second.bump('main:sales')
+    assert first.cached(['main:sales'], 'kpis', factory) == {'total': 2}
+    assert first.versions(['main:sales', 'main:catalog']) == {'main:sales': 1, 'main:catalog': 0}
+
+    first.set('short', 'value', ttl=0.05)
+    time.sleep(0.1)
+    assert second.get('short') is None
+
+    small = cache.SQLiteCache(path, max_entries=2)
+    small.set_many({'x': 1, 'y': 2, 'z': 3})
+    assert len(small) == 2 and small.info()['evictions'] > 0
+
+
+def test_sale_invalidates_cached_dashboard_and_lookups(client):
+    with app.app_context():
+        medicine = Medicine(name='Cached Med', quantity=40, price=2.5,
+                            expiry_date=(datetime.utcnow() + timedelta(days=200)).date())
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+        app_cache().cached_many(['main:catalog'], [str(medicine_id)], lambda missing: {key: 'old' for key in missing})
+
+    assert 'Cached Customer' not in client.get('/dashboard').get_data(as_text=True)
+    hits = app_cache().info()['hits']
+    client.get('/dashboard')
+    assert app_cache().info()['hits'] == hits + 1
+
+    with app.app_context():
+        create_sale('Cached Customer', '', [(medicine_id, 3, None)])
+        db.session.commit()
+        row = app_cache().cached_many(['main:catalog'], [str(medicine_id)], lambda missing: {})
+    assert 'Cached Customer' in client.get('/dashboard').get_data(as_text=True)
+    # The sale changed the stock, so the catalog entry was invalidated too
+    assert row == {}
+
+    stats = client.get('/admin/cache').get_json()
+    assert stats['backend'] == 'sqlite' and stats['entries'] > 0
+    assert client.post('/admin/cache').get_json()['entries'] == 0
+    assert os.path.exists(app.config['CACHE_PATH'])
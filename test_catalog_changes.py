@@ -0,0 +1,90 @@
+from datetime import date
+
+from werkzeug.datastructures import MultiDict
+
+from app import app, db, CatalogChange, Medicine
+from test_stock_ledger import add_medicine
+
+
+def changes_since(version):
+    with app.app_context():
+        return [(row.medicine_id, row.change_type)
+                for row in CatalogChange.query.filter(CatalogChange.id > version).order_by(CatalogChange.id)]
+
+
+def latest_version():
+    with app.app_context():
+        return db.session.query(db.func.max(CatalogChange.id)).scalar() or 0
+
+
+def sell(client, medicine_id, quantity):
+    client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Catalog Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', str(quantity)), ('price[]', '10')]))
+
+
+def test_flushes_log_every_medicine_change(client):
+    version = latest_version()
+    medicine_id = add_medicine(client, 'Logged Med', 10)
+    # Once per flush: the insert, then its opening stock
+    assert set(changes_since(version)) == {(medicine_id, 'upsert')}
+
+    version = latest_version()
+    with app.app_context():
+        medicine = db.session.get(Medicine, medicine_id)
+        medicine.price = 11.0
+        medicine.description = 'Tablets'
+        db.session.commit()
+    # One row per flush, however many columns changed
+    assert changes_since(version) == [(medicine_id, 'upsert')]
+
+    # The stock decrement of a sale is a change too
+    version = latest_version()
+    sell(client, medicine_id, 4)
+    assert changes_since(version) == [(medicine_id, 'upsert')]
+
+    # A newer medicine, so SQLite does not hand the deleted id out again
+    add_medicine(client, 'Logged Neighbour Med', 1)
+    version = latest_version()
+    client.post(f'/medicine/{medicine_id}/delete')
+    assert changes_since(version) == [(medicine_id, 'delete')]
+
+    # A rolled back write leaves no row behind
+    version = latest_version()
+    with app.app_context():
+        db.session.add(Medicine(name='Rolled Back Med', quantity=1, price=1.0, expiry_date=date(2030, 1, 1)))
+        db.session.flush()
+        db.session.rollback()
+    assert changes_since(version) == []
+
+
+def test_feed_returns_deltas_since_a_version(client):
+    kept_id = add_medicine(client, 'Feed Kept Med', 20)
+    gone_id = add_medicine(client, 'Feed Gone Med', 20)
+    sold_id = add_medicine(client, 'Feed Sold Med', 20)
+
+    snapshot = client.get('/api/catalog/changes?since=0').get_json()
+    fields = snapshot['fields']
+    rows = {row[0]: dict(zip(fields, row)) for row in snapshot['upserts']}
+    assert snapshot['full'] is True and snapshot['deletes'] == []
+    assert {kept_id, sold_id, gone_id} <= set(rows)
+    assert rows[sold_id]['stock'] == 20 and rows[sold_id]['name'] == 'Feed Sold Med'
+    assert snapshot['version'] == latest_version()
+
+    sell(client, sold_id, 5)
+    client.post(f'/medicine/{gone_id}/delete')
+    delta = client.get(f'/api/catalog/changes?since={snapshot["version"]}').get_json()
+    assert delta['full'] is False and delta['version'] > snapshot['version']
+    assert [dict(zip(fields, row))['stock'] for row in delta['upserts']] == [15]
+    assert [row[0] for row in delta['upserts']] == [sold_id]
+    assert delta['deletes'] == [gone_id]
+
+    # Up to date: nothing to send
+    latest = client.get(f'/api/catalog/changes?since={delta["version"]}').get_json()
+    assert (latest['full'], latest['upserts'], latest['deletes']) == (False, [], [])
+
+    # A version the server never handed out (e.g. a restored database) gets
+    # a full snapshot, without the deleted medicine
+    full = client.get(f'/api/catalog/changes?since={delta["version"] + 100}').get_json()
+    ids = {row[0] for row in full['upserts']}
+    assert full['full'] is True and kept_id in ids and gone_id not in ids
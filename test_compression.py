@@ -0,0 +1,78 @@
+import gzip
+from datetime import datetime, timedelta
+
+import compression
+from app import app, db, Medicine
+
+
+def wsgi_app(body, content_type='text/plain', length=True):
+    """A tiny WSGI app returning ``body`` (a list of chunks)."""
+    def application(environ, start_response):
+        headers = [('Content-Type', content_type)]
+        if length:
+            headers.append(('Content-Length', str(sum(len(chunk) for chunk in body))))
+        start_response('200 OK', headers)
+        return iter(body)
+    return application
+
+
+def call(application, accept='gzip'):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'], captured['headers'] = status, dict(headers)
+
+    body = b''.join(application({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept}, start_response))
+    return captured['headers'], body
+
+
+def test_negotiation():
+    assert compression.negotiate('gzip, deflate') == 'gzip'
+    assert compression.negotiate('gzip;q=0, identity') is None
+    assert compression.negotiate('') is None
+    assert compression.negotiate('br;q=1.0, gzip;q=0.5', available=('br', 'gzip')) == 'br'
+    assert compression.negotiate('*', available=('br', 'gzip')) == 'br'
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    chunks = [f'row {n},value\n'.encode() * 20 for n in range(200)]
+    middleware = compression.CompressionMiddleware(wsgi_app(chunks, 'text/csv', length=False), min_size=500)
+    headers, body = call(middleware)
+    assert headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in headers
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == b''.join(chunks)
+    assert len(body) * 5 < len(b''.join(chunks))
+
+
+def test_small_and_precompressed_bodies_pass_through():
+    small = compression.CompressionMiddleware(wsgi_app([b'tiny'], length=False), min_size=500)
+    headers, body = call(small)
+    assert 'Content-Encoding' not in headers and body == b'tiny'
+
+    png = compression.CompressionMiddleware(wsgi_app([b'\x89PNG' * 1000], 'image/png'), min_size=500)
+    headers, body = call(png)
+    assert 'Content-Encoding' not in headers and body == b'\x89PNG' * 1000
+
+    plain = compression.CompressionMiddleware(wsgi_app([b'x' * 1000]), min_size=500)
+    headers, body = call(plain, accept='identity')
+    assert 'Content-Encoding' not in headers and body == b'x' * 1000
+
+
+def test_pages_and_exports_are_compressed(client):
+    with app.app_context():
+        db.session.add_all(Medicine(name=f'Compressed Med {n}', quantity=n, price=1.5,
+                                    expiry_date=(datetime.utcnow() + timedelta(days=90)).date()) for n in range(50))
+        db.session.commit()
+
+    response = client.get('/reports/export?type=inventory', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).startswith(b'ID,Name,Description')
+
+    response = client.get('/medicines', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and b'</html>' in gzip.decompress(response.data)
+
+    response = client.get('/static/logo.png', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+
+    assert 'Content-Encoding' not in client.get('/medicines').headers
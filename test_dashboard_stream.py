@@ -0,0 +1,90 @@
+import json
+import re
+from datetime import datetime, timedelta
+
+from app import app, db, DashboardEvent, Medicine, create_sale, dashboard_version
+
+
+def read_events(response):
+    """``(last event id, [(event, data), ...])`` of an SSE response."""
+    events, last_id = [], None
+    for message in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+            last_id = fields.get('id', last_id)
+    return last_id, events
+
+
+def add_medicine(name, quantity):
+    with app.app_context():
+        medicine = Medicine(name=name, quantity=quantity, price=3.0,
+                            expiry_date=(datetime.utcnow() + timedelta(days=200)).date())
+        db.session.add(medicine)
+        db.session.commit()
+        return medicine.id
+
+
+def test_committed_writes_reach_the_dashboard(client):
+    page = client.get('/dashboard').get_data(as_text=True)
+    since = int(re.search(r'/dashboard/stream\?since=(\d+)', page).group(1))
+    with app.app_context():
+        assert since == dashboard_version()
+
+    medicine_id = add_medicine('Live Med', 12)
+    response = client.get(f'/dashboard/stream?since={since}')
+    assert response.mimetype == 'text/event-stream' and 'retry: ' in response.get_data(as_text=True)
+    last_id, events = read_events(response)
+    assert events == [('delta', {'sales_total': 0.0, 'medicines': 1, 'low_stock': 0, 'sales': [],
+                                 'low_items': [], 'restocked': []})]
+
+    with app.app_context():
+        invoice = create_sale('Live Customer', '', [(medicine_id, 5, None)]).invoice_number
+        db.session.commit()
+    # The browser comes back with the id of the last event it saw
+    _, events = read_events(client.get('/dashboard/stream', headers={'Last-Event-ID': last_id}))
+    assert len(events) == 1
+    event, delta = events[0]
+    assert event == 'delta' and delta['sales_total'] == 15.0 and delta['low_stock'] == 1
+    assert delta['sales'][0]['invoice_number'] == invoice
+    assert delta['low_items'] == [{'id': medicine_id, 'name': 'Live Med', 'quantity': 7}]
+    # Nothing new: an empty response, no reload
+    with app.app_context():
+        version = dashboard_version()
+    assert read_events(client.get(f'/dashboard/stream?since={version}'))[1] == []
+
+
+def test_rolled_back_savepoints_leave_no_delta(client):
+    with app.app_context():
+        since = dashboard_version()
+        try:
+            with db.session.begin_nested():
+                db.session.add(Medicine(name='Savepoint Med', quantity=50, price=1.0,
+                                        expiry_date=(datetime.utcnow() + timedelta(days=99)).date()))
+                db.session.flush()
+                raise ValueError
+        except ValueError:
+            pass
+        db.session.add(Medicine(name='Kept Med', quantity=2, price=1.0,
+                                expiry_date=(datetime.utcnow() + timedelta(days=99)).date()))
+        db.session.commit()
+    _, events = read_events(client.get(f'/dashboard/stream?since={since}'))
+    assert [(delta['medicines'], delta['low_stock']) for _, delta in events] == [(1, 1)]
+
+
+def test_pages_that_missed_events_reload(client):
+    add_medicine('Reload Med', 40)
+    with app.app_context():
+        version = dashboard_version()
+    # Restored database: the page is ahead of the log
+    assert read_events(client.get(f'/dashboard/stream?since={version + 5}'))[1] == [('reload', {})]
+
+    app.config['DASHBOARD_EVENT_RETENTION'] = 1
+    try:
+        with app.app_context():
+            db.session.execute(DashboardEvent.__table__.delete().where(DashboardEvent.id < version))
+            db.session.commit()
+        # Events it needs were pruned
+        assert read_events(client.get(f'/dashboard/stream?since={version - 2}'))[1] == [('reload', {})]
+    finally:
+        app.config['DASHBOARD_EVENT_RETENTION'] = 1000
@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import forecasting
+from app import app, db, Medicine, Sale, SaleItem, Supplier, ReorderSuggestion, generate_reorder_suggestions
+
+
+def test_demand_matrix_accumulates_grouped_rows():
+    start = date(2024, 1, 1)
+    history = [
+        (2, '2024-01-01', 3),
+        (2, '2024-01-01 00:00:00', 2),
+        (9, date(2024, 1, 3), 4),
+        (7, '2024-01-02', 1),   # unknown medicine
+        (5, '2024-02-01', 1),   # outside the window
+    ]
+    matrix = forecasting.demand_matrix([5, 2, 9], history, start, 3)
+    assert matrix.tolist() == [[0, 0, 0], [5, 0, 0], [0, 0, 4]]
+
+
+def test_exponential_smoothing_matches_recursive_definition():
+    matrix = np.array([[4.0, 0.0, 2.0, 6.0], [0.0, 0.0, 0.0, 3.0]])
+    alpha = 0.3
+    expected = []
+    for row in matrix:
+        level = row[0]
+        for x in row:
+            level = alpha * x + (1 - alpha) * level
+        expected.append(level)
+    assert np.allclose(forecasting.exponential_smoothing(matrix, alpha), expected)
+
+
+def test_reorder_plan_covers_lead_time_and_review_period():
+    cover, reorder = forecasting.reorder_plan([2.0, 0.0, 1.0], [10, 5, 100], lead_time_days=7, cover_days=14)
+    assert cover[0] == 5 and np.isinf(cover[1]) and cover[2] == 100
+    assert reorder.tolist() == [32, 0, 0]
+
+
+def test_generate_reorder_suggestions_groups_by_supplier(client):
+    with app.app_context():
+        supplier = Supplier(name='Forecast Pharma', contact='F')
+        db.session.add(supplier)
+        db.session.flush()
+        fast = Medicine(name='Fast Mover', quantity=5, price=10, supplier_id=supplier.id,
+                        expiry_date=date.today() + timedelta(days=365))
+        slow = Medicine(name='Slow Mover', quantity=500, price=10, supplier_id=supplier.id,
+                        expiry_date=date.today() + timedelta(days=365))
+        db.session.add_all([fast, slow])
+        db.session.flush()
+        for day in range(10):
+            sale = Sale(invoice_number=f'FC-{day}', customer_name='C', total_amount=40,
+                        sale_date=datetime.utcnow() - timedelta(days=day))
+            db.session.add(sale)
+            db.session.flush()
+            db.session.add(SaleItem(sale_id=sale.id, medicine_id=fast.id, quantity=4,
+                                    unit_price=10, total_price=40))
+        db.session.commit()
+
+        generate_reorder_suggestions()
+        suggestions = {s.medicine_id: s for s in ReorderSuggestion.query.all()}
+        assert fast.id in suggestions and slow.id not in suggestions
+        assert suggestions[fast.id].supplier_id == supplier.id
+        assert suggestions[fast.id].reorder_quantity > 0
+
+    response = client.get('/reports/reorder')
+    assert response.status_code == 200
+    assert b'Forecast Pharma' in response.data
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app import app, db, Medicine, Sale, SaleError, sale_writer
+
+
+@pytest.fixture
+def group_commit():
+    app.config.update(SALE_GROUP_COMMIT=True, SALE_GROUP_COMMIT_MAX_WAIT_MS=200)
+    yield
+    app.config.update(SALE_GROUP_COMMIT=False, SALE_GROUP_COMMIT_MAX_WAIT_MS=5)
+
+
+def add_medicine(name, quantity):
+    with app.app_context():
+        medicine = Medicine(name=name, quantity=quantity, price=5.0, batch_number='GC',
+                            expiry_date=(datetime.utcnow() + timedelta(days=200)).date())
+        db.session.add(medicine)
+        db.session.commit()
+        return medicine.id
+
+
+def test_concurrent_sales_share_commits(group_commit):
+    medicine_id = add_medicine('Group Commit Med', 20)
+    with app.app_context():
+        writer = sale_writer()
+    batches = writer.batches
+
+    def sell(n):
+        try:
+            return writer.submit(f'Group Customer {n}', '', [(medicine_id, 10 if n == 0 else 2, None)])
+        except SaleError as e:
+            return e
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(sell, range(8)))
+
+    # Whichever sales come after stock runs out are rejected on their own
+    sale_ids = [result for result in results if isinstance(result, int)]
+    rejected = [result for result in results if isinstance(result, SaleError)]
+    assert len(sale_ids) + len(rejected) == 8 and rejected
+    assert writer.batches - batches < len(sale_ids)
+    with app.app_context():
+        sales = Sale.query.filter(Sale.id.in_(sale_ids)).all()
+        assert len(sales) == len(sale_ids)
+        sold = sum(item.quantity for sale in sales for item in sale.items)
+        assert db.session.get(Medicine, medicine_id).quantity == 20 - sold >= 0
+
+
+def test_new_sale_route_waits_for_the_writer(client, group_commit):
+    medicine_id = add_medicine('Group Route Med', 5)
+    page = client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Group Route Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', '2'), ('price[]', '5')]))
+    assert page.status_code == 302 and '/sale/' in page.headers['Location']
+    with app.app_context():
+        assert db.session.get(Medicine, medicine_id).quantity == 3
+
+    page = client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Group Route Customer'), ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)), ('quantity[]', '9'), ('price[]', '5')]), follow_redirects=True)
+    assert 'Not enough stock for Group Route Med' in page.get_data(as_text=True)
+
+
+def test_malformed_sales_never_reach_the_writer(client, group_commit):
+    medicine_id = add_medicine('Group Malformed Med', 5)
+    with app.app_context():
+        writer = sale_writer()
+    batches = writer.batches
+    for row in [('', '1', '5'), (str(medicine_id), 'two', '5'), (str(medicine_id), '1', 'abc')]:
+        page = client.post('/sale/new', data=MultiDict([
+            ('customer_name', 'Group Malformed Customer'), ('medicine_id[]', row[0]),
+            ('quantity[]', row[1]), ('price[]', row[2])]), follow_redirects=True)
+        assert 'Every item needs a medicine' in page.get_data(as_text=True)
+    page = client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Group Malformed Customer'), ('medicine_id[]', str(medicine_id)),
+        ('quantity[]', '1'), ('price[]', '5'), ('discount', '150')]), follow_redirects=True)
+    assert 'between 0 and 100%' in page.get_data(as_text=True)
+    assert writer.batches == batches
+
+
+def test_a_failing_sale_does_not_fail_its_batch(group_commit):
+    medicine_id = add_medicine('Group Savepoint Med', 10)
+    with app.app_context():
+        writer = sale_writer()
+
+    def sell(n):
+        # Every other sale carries a price create_sale() cannot parse
+        try:
+            return writer.submit(f'Savepoint Customer {n}', '', [(medicine_id, 1, 'abc' if n % 2 else None)])
+        except ValueError as e:
+            return e
+
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(sell, range(6)))
+    assert [isinstance(result, int) for result in results] == [True, False] * 3
+    with app.app_context():
+        assert db.session.get(Medicine, medicine_id).quantity == 7
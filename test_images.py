@@ -0,0 +1,128 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+import app as app_module
+from app import app, db, Medicine
+
+
+def picture(size=(1200, 800), color='teal', fmt='PNG'):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, fmt)
+    return out.getvalue()
+
+
+def wait_for_renders():
+    # One renderer thread: once this runs, earlier renders are recorded
+    app_module._image_renderer.submit(lambda: None).result()
+
+
+def add_medicine(client, name, data, filename='photo.png'):
+    expiry = (datetime.utcnow() + timedelta(days=300)).strftime('%Y-%m-%d')
+    return client.post('/add_medicine', data={
+        'name': name, 'description': '', 'quantity': '0', 'price': '4.5', 'expiry_date': expiry,
+        'batch_number': 'IMG', 'image': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+
+
+def medicine_named(name):
+    with app.app_context():
+        return Medicine.query.filter_by(name=name).one_or_none()
+
+
+def test_upload_renders_cached_variants(client):
+    add_medicine(client, 'Image Med A', picture())
+    wait_for_renders()
+    medicine = medicine_named('Image Med A')
+    assert medicine.image_source and medicine.image_thumb and medicine.image_preview
+
+    response = client.get(f'/images/{medicine.image_thumb}.jpg')
+    assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(response.data)).size == (96, 96)
+    assert 'immutable' in response.headers['Cache-Control']
+    assert f'max-age={app.config["IMAGE_CACHE_SECONDS"]}' in response.headers['Cache-Control']
+    preview = client.get(f'/images/{medicine.image_preview}.jpg')
+    assert Image.open(io.BytesIO(preview.data)).size == (640, 427)
+
+    assert f'/images/{medicine.image_thumb}.jpg' in client.get('/medicines?search=Image+Med+A').get_data(as_text=True)
+    feed = client.get('/api/catalog/changes?since=0').get_json()
+    row = next(row for row in feed['upserts'] if row[0] == medicine.id)
+    assert row[feed['fields'].index('thumb')] == medicine.image_thumb
+    assert client.get('/images/not-a-digest.jpg').status_code == 404
+
+
+def test_same_picture_is_stored_once(client):
+    data = picture(color='navy')
+    add_medicine(client, 'Image Med B', data)
+    wait_for_renders()
+    first = medicine_named('Image Med B')
+    add_medicine(client, 'Image Med C', picture(color='olive'))
+    wait_for_renders()
+    second = medicine_named('Image Med C')
+
+    # The second medicine takes the first one's picture: no new rendering
+    client.post(f'/medicine/{second.id}/edit', data={
+        'name': second.name, 'description': '', 'price': '4.5', 'batch_number': 'IMG', 'supplier_id': '',
+        'expiry_date': second.expiry_date.strftime('%Y-%m-%d'), 'image': (io.BytesIO(data), 'again.jpg')},
+        content_type='multipart/form-data')
+    second = medicine_named('Image Med C')
+    assert (second.image_source, second.image_thumb, second.image_preview) == \
+        (first.image_source, first.image_thumb, first.image_preview)
+    originals = app_module.image_originals()
+    assert originals.exists(first.image_source) and originals.get(first.image_source) == data
+
+
+def test_unreadable_uploads_are_refused(client):
+    response = add_medicine(client, 'Image Med D', b'not an image', 'broken.png')
+    assert response.status_code == 302 and medicine_named('Image Med D') is None
+    add_medicine(client, 'Image Med E', picture(), 'photo.bmp')
+    assert medicine_named('Image Med E') is None
+
+
+def test_rethumbnail_uses_current_sizes(client):
+    add_medicine(client, 'Image Med F', picture(color='maroon'))
+    wait_for_renders()
+    old_thumb = medicine_named('Image Med F').image_thumb
+    variants = app.config['IMAGE_VARIANTS']
+    app.config['IMAGE_VARIANTS'] = dict(variants, thumb=(48, 48, 'crop'))
+    try:
+        with app.app_context():
+            rendered, failed = app_module.rethumbnail_images()
+            db.session.commit()
+    finally:
+        app.config['IMAGE_VARIANTS'] = variants
+    assert rendered >= 1 and failed == 0
+    thumb = medicine_named('Image Med F').image_thumb
+    assert thumb != old_thumb
+    path = app_module.image_variants().path(thumb)
+    assert os.path.exists(path) and Image.open(path).size == (48, 48)
+
+
+def test_failed_renders_are_logged_and_recorded(client, monkeypatch, caplog):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    def crashed(*args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+        return future
+
+    monkeypatch.setattr(app_module.images, 'render_in_pool', crashed)
+    add_medicine(client, 'Image Med G', picture(color='purple'))
+    wait_for_renders()
+    medicine = medicine_named('Image Med G')
+    # The original is kept for rethumbnail_images.py --missing
+    assert medicine.image_source and medicine.image_preview is None
+    assert 'BrokenProcessPool' in medicine.image_error
+    assert 'Rendering image' in caplog.text and 'BrokenProcessPool' in caplog.text
+    assert 'could not be processed' in client.get(f'/medicine/{medicine.id}').get_data(as_text=True)
+
+    monkeypatch.undo()
+    with app.app_context():
+        assert app_module.rethumbnail_images(missing_only=True)[0] >= 1
+        db.session.commit()
+    medicine = medicine_named('Image Med G')
+    assert medicine.image_preview and medicine.image_error is None
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+from app import (app, db, Medicine, Purchase, PurchaseItem, SaleItem, Supplier, archive_sales, bulk_edit_medicines,
+                 create_sale, margin_report, rebuild_sale_costs)
+
+
+def stock_medicine(name, lots):
+    """A medicine bought in ``lots`` of ``(days_ago, quantity, unit_cost)``."""
+    supplier = Supplier(name=f'{name} Supplier', contact='000')
+    medicine = Medicine(name=name, quantity=sum(quantity for _, quantity, _ in lots), price=10.0,
+                        expiry_date=(datetime.utcnow() + timedelta(days=300)).date())
+    db.session.add_all([supplier, medicine])
+    db.session.flush()
+    medicine.supplier_id = supplier.id
+    for n, (days_ago, quantity, cost) in enumerate(lots):
+        purchase = Purchase(supplier_id=supplier.id, invoice_number=f'{name}-LOT-{n}', total_amount=quantity * cost,
+                            purchase_date=(datetime.utcnow() - timedelta(days=days_ago)).date())
+        db.session.add(purchase)
+        db.session.flush()
+        db.session.add(PurchaseItem(purchase_id=purchase.id, medicine_id=medicine.id, quantity=quantity,
+                                    unit_price=cost, expiry_date=medicine.expiry_date))
+    db.session.commit()
+    return medicine
+
+
+def test_sales_are_costed_fifo_across_lots():
+    with app.app_context():
+        medicine = stock_medicine('Fifo Med', [(20, 5, 2.0), (10, 10, 3.0)])
+        sale = create_sale('Fifo Customer', '', [(medicine.id, 7, None)])
+        db.session.commit()
+        item = sale.items[0]
+        # 5 units from the older lot at 2.00, then 2 at 3.00
+        assert (item.cost_amount, item.unmatched_quantity) == (16.0, 0)
+        remaining = [lot.remaining_quantity for lot in
+                     PurchaseItem.query.filter_by(medicine_id=medicine.id).order_by(PurchaseItem.id)]
+        assert remaining == [0, 8]
+
+        # Units beyond the lots are costed at the last purchase price
+        medicine.quantity += 5
+        db.session.commit()
+        item = create_sale('Fifo Customer', '', [(medicine.id, 10, None)]).items[0]
+        db.session.commit()
+        assert (item.cost_amount, item.unmatched_quantity) == (30.0, 2)
+
+
+def test_backfill_replays_history_like_the_live_engine():
+    with app.app_context():
+        medicine = stock_medicine('Replay Med', [(30, 4, 1.5), (5, 6, 2.5)])
+        first = create_sale('Replay Customer', '', [(medicine.id, 3, None)])
+        second = create_sale('Replay Customer', '', [(medicine.id, 4, None)])
+        db.session.commit()
+        live = [(item.cost_amount, item.unmatched_quantity) for item in first.items + second.items]
+
+        SaleItem.query.filter(SaleItem.sale_id.in_([first.id, second.id])).update({'cost_amount': None})
+        PurchaseItem.query.filter_by(medicine_id=medicine.id).update({'remaining_quantity': None})
+        rebuild_sale_costs()
+        db.session.commit()
+        replayed = [(item.cost_amount, item.unmatched_quantity)
+                    for item in SaleItem.query.filter(SaleItem.sale_id.in_([first.id, second.id]))
+                    .order_by(SaleItem.id)]
+        assert replayed == live == [(4.5, 0), (1.5 + 7.5, 0)]
+        assert sorted(lot.remaining_quantity for lot in
+                      PurchaseItem.query.filter_by(medicine_id=medicine.id)) == [0, 3]
+
+
+def test_backfill_keeps_archived_sales_out_of_the_lots():
+    with app.app_context():
+        medicine = stock_medicine('Archived Lot Med', [(800, 5, 2.0), (10, 10, 3.0)])
+        old = create_sale('Archived Lot Customer', '', [(medicine.id, 3, None)])
+        old.sale_date = datetime.utcnow() - timedelta(days=700)
+        create_sale('Archived Lot Customer', '', [(medicine.id, 4, None)])
+        db.session.commit()
+        lots = PurchaseItem.query.filter_by(medicine_id=medicine.id).order_by(PurchaseItem.id)
+        assert [lot.remaining_quantity for lot in lots] == [0, 8]
+
+        assert archive_sales(older_than_days=365)
+        rebuild_sale_costs()
+        db.session.commit()
+        assert [lot.remaining_quantity for lot in lots] == [0, 8]
+
+
+def test_margins_include_archived_sales():
+    with app.app_context():
+        medicine = stock_medicine('Archived Margin Med', [(900, 10, 2.0)])
+        old = create_sale('Archived Margin Customer', '', [(medicine.id, 3, None)])
+        sold_on = datetime.utcnow() - timedelta(days=800)
+        old.sale_date = sold_on
+        create_sale('Archived Margin Customer', '', [(medicine.id, 1, None)])
+        db.session.commit()
+        assert archive_sales(older_than_days=365)
+
+        start, end = sold_on - timedelta(days=1), sold_on + timedelta(days=1)
+        row = next(row for row in margin_report('medicine', start, end) if row['label'] == 'Archived Margin Med')
+        assert (row['quantity'], row['revenue'], row['cost'], row['margin'], row['uncosted']) == (3, 30.0, 6.0, 24.0, 0)
+        supplier_row = next(row for row in margin_report('supplier', start, end)
+                            if row['label'] == 'Archived Margin Med Supplier')
+        assert supplier_row['margin'] == 24.0
+        assert sold_on.strftime('%Y-%m') in [row['key'] for row in margin_report('month', start, end)]
+
+
+def test_bulk_stock_removals_drain_the_oldest_lots():
+    def remaining(medicine):
+        return [lot.remaining_quantity for lot in
+                PurchaseItem.query.filter_by(medicine_id=medicine.id).order_by(PurchaseItem.id)]
+
+    with app.app_context():
+        by_row = stock_medicine('Bulk Lot Med', [(20, 4, 1.0), (10, 6, 2.0)])
+        by_filter = [stock_medicine(f'Bulk Filter Lot Med {n}', [(20, 3, 1.0), (10, 5, 2.0)]) for n in range(2)]
+        bulk_edit_medicines({'changes': [{'id': by_row.id, 'quantity': 3}]}, apply=True)
+        bulk_edit_medicines({'filter': {'name': 'Bulk Filter Lot Med'}, 'set': {'quantity': '-5'}}, apply=True)
+        db.session.commit()
+        live = [remaining(by_row)] + [remaining(medicine) for medicine in by_filter]
+        assert live == [[0, 3], [0, 3], [0, 3]]
+        # The backfill replays the same adjustments to the same balances
+        rebuild_sale_costs()
+        db.session.commit()
+        assert [remaining(by_row)] + [remaining(medicine) for medicine in by_filter] == live
+
+
+def test_margin_report_groups_stored_costs(client):
+    with app.app_context():
+        medicine = stock_medicine('Margin Med', [(3, 20, 4.0)])
+        create_sale('Margin Customer', '', [(medicine.id, 5, None)])
+        db.session.commit()
+        today = datetime.utcnow().date()
+        start, end = datetime.combine(today, datetime.min.time()), datetime.utcnow() + timedelta(days=1)
+        row = next(row for row in margin_report('medicine', start, end) if row['label'] == 'Margin Med')
+        assert (row['quantity'], row['revenue'], row['cost'], row['margin']) == (5, 50.0, 20.0, 30.0)
+        assert row['margin_percent'] == 60.0
+        supplier_row = next(row for row in margin_report('supplier', start, end)
+                            if row['label'] == 'Margin Med Supplier')
+        assert supplier_row['margin'] == 30.0
+        assert [row['key'] for row in margin_report('day', start, end)] == [today.strftime('%Y-%m-%d')]
+
+    for group in ('medicine', 'supplier', 'day', 'month'):
+        page = client.get(f'/reports/margins?group={group}')
+        assert page.status_code == 200
+    assert 'Margin Med' in client.get('/reports/margins').get_data(as_text=True)
+    export = client.get('/reports/margins?group=medicine&format=csv')
+    assert 'Margin Med,5,50.00,20.00,30.00,60.0,0' in export.get_data(as_text=True)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import MultiDict
+
+from app import app, db, Medicine, Supplier, medicine_facets, medicine_filters
+
+
+def add_catalog():
+    today = datetime.utcnow().date()
+    with app.app_context():
+        acme, zen = Supplier(name='Facet Acme', contact='1'), Supplier(name='Facet Zen', contact='2')
+        db.session.add_all([acme, zen])
+        db.session.flush()
+        db.session.add_all([
+            Medicine(name='Facet Alpha', quantity=5, price=60.0, supplier_id=acme.id, batch_number='FX-1',
+                     expiry_date=today + timedelta(days=10)),
+            Medicine(name='Facet Beta', quantity=15, price=150.0, supplier_id=acme.id, batch_number='FX-2',
+                     expiry_date=today + timedelta(days=120)),
+            Medicine(name='Facet Gamma', quantity=150, price=20.0, supplier_id=zen.id, batch_number='FX-3',
+                     expiry_date=today + timedelta(days=45)),
+            Medicine(name='Facet Delta', quantity=0, price=600.0, supplier_id=None, batch_number='FX-4',
+                     expiry_date=today - timedelta(days=3)),
+        ])
+        db.session.commit()
+        return acme.id, zen.id
+
+
+def facets_for(**args):
+    with app.test_request_context():
+        return medicine_facets(medicine_filters(MultiDict(dict(args, batch='FX-'))))
+
+
+def test_facet_counts_ignore_their_own_filter():
+    acme, zen = add_catalog()
+    total, facets = facets_for(supplier=str(acme), stock_max='20')
+    assert total == 2
+    # Supplier counts still apply the stock filter but not the supplier one
+    assert {name: count for _, name, count in facets['supplier']} == {'Facet Acme': 2, 'No supplier': 1}
+    # Stock counts apply the supplier filter only
+    assert [count for _, _, count in facets['stock']] == [0, 2, 0, 0]
+    assert [count for _, _, count in facets['expiry']] == [0, 1, 0, 1]
+    assert facets['price'][1] == ('₹50 to ₹199.99', {'price_min': 50, 'price_max': 199.99}, 2)
+
+    total, facets = facets_for(supplier=['none', str(zen)])
+    assert total == 2
+    assert [count for _, _, count in facets['price']] == [1, 0, 0, 1]
+
+
+def test_medicine_list_filters_and_sorts(client):
+    add_catalog()
+    today = datetime.utcnow().date()
+    page = client.get('/medicines', query_string={
+        'batch': 'FX-', 'stock_max': 20, 'price_min': 50, 'price_max': 200,
+        'expiry_to': (today + timedelta(days=200)).strftime('%Y-%m-%d'), 'sort': 'price', 'dir': 'desc'})
+    html = page.get_data(as_text=True)
+    assert page.status_code == 200
+    assert html.index('Facet Beta') < html.index('Facet Alpha')
+    assert 'Facet Gamma' not in html and 'Facet Delta' not in html
+
+    # Bad values are ignored rather than failing the page
+    page = client.get('/medicines?batch=FX-&stock_min=lots&expiry_from=soon&supplier=x&sort=evil')
+    assert page.status_code == 200
+    assert 'Facet Delta' in page.get_data(as_text=True)
@@ -0,0 +1,48 @@
+import pytest
+
+import profiler
+from app import app, save_profiler_settings
+
+
+@pytest.fixture
+def profiles():
+    folder = app.config['PROFILE_FOLDER']
+    profiler.prune_profiles(folder, 0)
+    yield folder
+    save_profiler_settings({'endpoints': [], 'sample_percent': 0.0, 'mode': 'cprofile'})
+    profiler.prune_profiles(folder, 0)
+
+
+@pytest.mark.parametrize('mode', profiler.MODES)
+def test_selected_routes_are_profiled(client, profiles, mode):
+    response = client.post('/admin/profiler', data={'endpoints[]': ['medicines', 'export_reports'],
+                                                    'sample_percent': '0', 'mode': mode})
+    assert response.status_code == 302
+
+    client.get('/dashboard')
+    client.get('/medicines')
+    # Streamed responses are saved once the body has been sent and closed
+    export = client.get('/reports/export?type=inventory')
+    assert export.status_code == 200 and export.data
+    export.close()
+
+    stored = profiler.list_profiles(profiles)
+    assert sorted(record['endpoint'] for record in stored) == ['export_reports', 'medicines']
+    medicines = next(record for record in stored if record['endpoint'] == 'medicines')
+    assert medicines['mode'] == mode and medicines['sql_count'] >= 1 and medicines['sql_time'] > 0
+
+    detail = client.get(f'/admin/profiler/{medicines["id"]}')
+    assert detail.status_code == 200
+    assert client.get('/admin/profiler').status_code == 200
+    assert (client.get(f'/admin/profiler/{medicines["id"]}/pstats').status_code == 200) == (mode == 'cprofile')
+
+
+def test_single_request_profile_and_collapsed_stacks(client, profiles):
+    client.get('/medicines?_profile=1')
+    record, = profiler.list_profiles(profiles)
+    full = profiler.load_profile(profiles, record['id'])
+    assert any('medicines' in row[0] for row in full['functions'])
+
+    collapsed = client.get(f'/admin/profiler/{record["id"]}/collapsed').data.decode().splitlines()
+    assert collapsed and all(line.rsplit(' ', 1)[1].isdigit() for line in collapsed)
+    assert any('app.py:medicines' in line for line in collapsed)
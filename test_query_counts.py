@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, app_cache, db, Medicine, Supplier, Sale, SaleItem
+
+ROUTES = ['/reports', '/reports/export?type=sales', '/reports/export?type=inventory',
+          '/export/report/sales', '/export/report/inventory', '/sales']
+
+
+def add_rows(count, tag):
+    with app.app_context():
+        supplier = Supplier(name=f'Counting Supplier {tag}', contact='000')
+        db.session.add(supplier)
+        db.session.flush()
+        medicines = [Medicine(name=f'Counting {tag} {n}', quantity=n % 8, price=2.0, supplier_id=supplier.id,
+                              expiry_date=(datetime.utcnow() + timedelta(days=300)).date()) for n in range(count)]
+        db.session.add_all(medicines)
+        db.session.flush()
+        sales = [Sale(invoice_number=f'CNT-{tag}-{n}', customer_name='Counter', total_amount=4.0, discount=0.0,
+                      tax_amount=0.0, payment_method='Cash', sale_date=datetime.utcnow()) for n in range(count)]
+        db.session.add_all(sales)
+        db.session.flush()
+        db.session.add_all(SaleItem(sale_id=sale.id, medicine_id=medicine.id, quantity=2, unit_price=2.0,
+                                    total_price=4.0) for sale, medicine in zip(sales, medicines))
+        db.session.commit()
+        return sales[0].id, medicines[0].id, supplier.id
+
+
+def query_count(client, max_queries, url):
+    app_cache().clear()  # measure the uncached render
+    with max_queries(10_000) as statements:
+        assert client.get(url).status_code == 200
+    return len(statements)
+
+
+def test_query_count_does_not_grow_with_rows(client, max_queries):
+    add_rows(20, 'small')
+    # Warm up once-per-process work such as opening the reporting engine
+    for url in ROUTES:
+        client.get(url)
+    before = {url: query_count(client, max_queries, url) for url in ROUTES}
+    add_rows(400, 'large')
+    after = {url: query_count(client, max_queries, url) for url in ROUTES}
+    assert after == before
+
+
+@pytest.mark.parametrize('route, limit', [
+    ('/reports', 6), ('/reports/export?type=sales', 3), ('/reports/export?type=inventory', 2),
+    ('/sales', 5), ('/sale/{sale}', 3), ('/medicine/{medicine}', 4), ('/supplier/{supplier}', 5),
+])
+def test_route_query_budget(client, max_queries, route, limit):
+    sale, medicine, supplier = add_rows(30, f'budget-{limit}-{route}')
+    client.get(route.format(sale=sale, medicine=medicine, supplier=supplier))
+    with max_queries(limit) as statements:
+        assert client.get(route.format(sale=sale, medicine=medicine, supplier=supplier)).status_code == 200
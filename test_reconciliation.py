@@ -0,0 +1,36 @@
+from werkzeug.datastructures import MultiDict
+
+from app import app, db, CatalogChange, Medicine, StockMovement, reconcile_stock
+from test_stock_ledger import add_medicine
+
+
+def test_drift_is_found_and_corrected(client):
+    medicine_id = add_medicine(client, 'Drifting Med', 20)
+    client.post('/sale/new', data=MultiDict([
+        ('customer_name', 'Drift Customer'),
+        ('payment_method', 'Cash'),
+        ('medicine_id[]', str(medicine_id)),
+        ('quantity[]', '3'),
+        ('price[]', '10'),
+    ]))
+    client.post(f'/medicine/{medicine_id}/adjust', data={'movement_type': 'write-off', 'quantity': '2'})
+
+    with app.app_context():
+        # An edit that bypasses the ledger
+        db.session.get(Medicine, medicine_id).quantity = 40
+        db.session.commit()
+        drift, _ = reconcile_stock(medicine_ids={medicine_id})
+        assert [(row.actual, row.expected, row.difference) for row in drift] == [(40, 15, -25)]
+        version = db.session.query(db.func.max(CatalogChange.id)).scalar()
+
+    response = client.get('/admin/reconciliation')
+    assert b'Drifting Med' in response.data
+    client.post('/admin/reconciliation', data={'medicine_id[]': str(medicine_id)})
+
+    with app.app_context():
+        assert db.session.get(Medicine, medicine_id).quantity == 15
+        assert reconcile_stock(medicine_ids={medicine_id})[0] == []
+        correction = StockMovement.query.filter_by(medicine_id=medicine_id, movement_type='reconciliation').one()
+        assert correction.quantity == -25
+        assert CatalogChange.query.filter(CatalogChange.id > version,
+                                          CatalogChange.medicine_id == medicine_id).count() == 1
@@ -0,0 +1,45 @@
+import pickle
+from datetime import datetime, timedelta
+
+from app import (app, db, Medicine, MedicineRecord, Supplier, catalog_row, medicine_records,
+                 medicine_select)
+
+
+def add_supplier_medicines():
+    with app.app_context():
+        supplier = Supplier(name='Record Supplier', contact='000')
+        db.session.add(supplier)
+        db.session.flush()
+        db.session.add_all([Medicine(name=f'Record Med {n}', quantity=n, price=2.5, batch_number=f'RB{n}',
+                                     supplier_id=supplier.id,
+                                     expiry_date=(datetime.utcnow() + timedelta(days=90)).date())
+                            for n in range(3)])
+        db.session.commit()
+        return supplier.id
+
+
+def test_records_skip_the_identity_map():
+    supplier_id = add_supplier_medicines()
+    with app.app_context():
+        records = list(medicine_records(medicine_select('id', 'name', 'quantity', 'supplier_name')
+                                        .where(Medicine.supplier_id == supplier_id).order_by(Medicine.name)))
+        assert len(db.session.identity_map) == 0
+        assert [(record.name, record.quantity, record.supplier_ref.name) for record in records] == [
+            (f'Record Med {n}', n, 'Record Supplier') for n in range(3)]
+        assert records[0].price is None and not hasattr(records[0], '__dict__')
+
+        medicine = db.session.get(Medicine, records[1].id)
+        record = next(medicine_records(medicine_select('id', 'name', 'batch_number', 'price', 'quantity',
+                                                       'expiry_date').where(Medicine.id == medicine.id)))
+        assert catalog_row(record) == catalog_row(medicine)
+        copy = pickle.loads(pickle.dumps(record))
+        assert isinstance(copy, MedicineRecord) and copy.name == 'Record Med 1' and copy.supplier_ref is None
+
+
+def test_pages_render_records(client):
+    supplier_id = add_supplier_medicines()
+    page = client.get(f'/supplier/{supplier_id}').get_data(as_text=True)
+    assert 'Record Med 2' in page and 'RB2' in page
+    assert 'Supplier: Record Supplier' in client.get('/reports').get_data(as_text=True)
+    export = client.get('/reports/export?type=inventory').get_data(as_text=True)
+    assert 'Record Med 1,,RB1,1,2.5,Record Supplier,' in export
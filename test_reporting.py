@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+from sqlalchemy.exc import OperationalError
+
+import app as app_module
+import backups
+from app import app, db, CatalogChange, Medicine, reporting_engine
+
+
+def reporting_bind():
+    # A fresh app context, so g holds no engine chosen by an earlier request
+    with app.app_context(), app.test_request_context('/reports'):
+        g.branch = None
+        g.reporting = True
+        return db.session.get_bind(mapper=Medicine.__mapper__, clause=db.select(Medicine))
+
+
+def test_report_reads_use_a_read_only_connection(client):
+    with app.app_context():
+        engine = reporting_engine(None)
+        assert engine.url.query.get('mode') == 'ro'
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            with pytest.raises(OperationalError):
+                conn.execute(CatalogChange.__table__.insert().values(medicine_id=0, change_type='upsert',
+                                                                     changed_at=datetime.utcnow()))
+    assert reporting_bind() is engine
+
+    assert client.get('/reports').status_code == 200
+    assert client.get('/reports/export?type=inventory').status_code == 200
+
+
+def test_lagging_replica_falls_back_to_primary(tmp_path):
+    replica_path = str(tmp_path / 'replica.db')
+    main = app.config['BRANCHES']['main']
+    with app.app_context():
+        backups.copy_database(db.engine.url.database, replica_path)
+        main['reporting_uri'] = f'sqlite:///{replica_path}'
+        app_module._reporting_engines.clear()
+        app_module._replica_lag.clear()
+        try:
+            assert reporting_bind().url.database == replica_path
+
+            newest = db.session.query(db.func.max(CatalogChange.changed_at)).scalar() or datetime.utcnow()
+            db.session.add(CatalogChange(medicine_id=0, change_type='upsert',
+                                         changed_at=newest + timedelta(seconds=app.config['REPORTING_MAX_STALENESS'] + 30)))
+            db.session.commit()
+            app_module._replica_lag.clear()
+            assert reporting_bind() is db.engine
+        finally:
+            main['reporting_uri'] = None
+            app_module._reporting_engines.pop(None).dispose()
+            app_module._replica_lag.clear()
+
+
+def test_low_stock_report_follows_the_threshold(client):
+    with app.app_context():
+        db.session.add(Medicine(name='Threshold Report Med', quantity=15, price=1.0,
+                                expiry_date=(datetime.utcnow() + timedelta(days=90)).date()))
+        db.session.commit()
+    assert 'Threshold Report Med' not in client.get('/reports').get_data(as_text=True)
+    app.config['LOW_STOCK_THRESHOLD'] = 20
+    try:
+        assert 'Threshold Report Med' in client.get('/reports').get_data(as_text=True)
+    finally:
+        app.config['LOW_STOCK_THRESHOLD'] = 10
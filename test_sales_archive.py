@@ -0,0 +1,104 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import sales_archive
+from app import app, db, Medicine, Sale, SaleItem, SaleArchive, archive_sales, archive_store
+
+
+def add_sale(invoice, sale_date, medicine, quantity=2, customer='Archive Customer'):
+    sale = Sale(invoice_number=invoice, customer_name=customer, total_amount=quantity * medicine.price,
+                discount=0.0, tax_amount=0.0, payment_method='Cash', sale_date=sale_date)
+    db.session.add(sale)
+    db.session.flush()
+    db.session.add(SaleItem(sale_id=sale.id, medicine_id=medicine.id, batch_number='A1', quantity=quantity,
+                            unit_price=medicine.price, total_price=quantity * medicine.price))
+    return sale
+
+
+def test_old_sales_move_to_yearly_archives(client):
+    with app.app_context():
+        medicine = Medicine(name='Archive Med', quantity=100, price=5.0,
+                            expiry_date=(datetime.utcnow() + timedelta(days=400)).date())
+        db.session.add(medicine)
+        db.session.flush()
+        old_ids = [add_sale(f'ARC-{year}-{n}', datetime(year, 6, 1 + n), medicine).id
+                   for year in (2021, 2022) for n in range(3)]
+        add_sale('ARC-LIVE', datetime.utcnow(), medicine)
+        db.session.commit()
+
+        assert archive_sales(older_than_days=365, chunk_size=4) == {2021: 3, 2022: 3}
+        assert Sale.query.filter(Sale.id.in_(old_ids)).count() == 0
+        assert SaleItem.query.filter(SaleItem.sale_id.in_(old_ids)).count() == 0
+        assert db.session.get(SaleArchive, 2021).sale_count == 3
+        assert archive_store().count(2022) == 3
+        # Re-running finds nothing left to move
+        assert archive_sales(older_than_days=365) == {}
+        # Closed years are kept gzipped
+        store = archive_store()
+        assert store.compressed(2021) and not os.path.exists(store.path(2021))
+        assert os.path.getsize(store.compressed_path(2021)) < 8192
+
+    # Ranges that stay in the live tables never show archived rows
+    response = client.get('/sales?customer=Archive+Customer')
+    assert b'ARC-LIVE' in response.data and b'ARC-2022-0' in response.data
+    response = client.get(f'/sales?start_date={datetime.utcnow():%Y-%m-%d}&customer=Archive+Customer')
+    assert b'ARC-LIVE' in response.data and b'ARC-2022' not in response.data
+    response = client.get('/sales?start_date=2022-01-01&end_date=2022-12-31')
+    assert b'ARC-2022-2' in response.data and b'ARC-2021' not in response.data
+
+    response = client.get(f'/sale/{old_ids[0]}')
+    assert response.status_code == 200 and b'Archive Med' in response.data
+
+    export = client.get('/reports/export?type=sales&start_date=2021-01-01&end_date=2021-12-31').data.decode()
+    assert 'ARC-2021-0' in export and 'ARC-2022' not in export and 'ARC-LIVE' not in export
+
+
+def test_compressed_years_take_backdated_sales(client):
+    with app.app_context():
+        medicine = Medicine(name='Backdated Med', quantity=100, price=4.0,
+                            expiry_date=(datetime.utcnow() + timedelta(days=400)).date())
+        db.session.add(medicine)
+        db.session.flush()
+        add_sale('BACK-2019-0', datetime(2019, 3, 1), medicine)
+        add_sale('BACK-LIVE-0', datetime.utcnow(), medicine)
+        db.session.commit()
+        assert archive_sales(older_than_days=365) == {2019: 1}
+        store = archive_store()
+        # Another worker process, reading the compressed year
+        other = type(store)(store.folder)
+        assert store.compressed(2019) and other.count(2019) == 1
+        # Both processes read the one copy unpacked next to the archives
+        assert store.count(2019) == 1
+        assert len([name for name in os.listdir(store.unpacked_folder()) if name.startswith('sales_2019.')]) == 1
+
+        backdated_id = add_sale('BACK-2019-1', datetime(2019, 3, 2), medicine, quantity=3).id
+        add_sale('BACK-LIVE-1', datetime.utcnow(), medicine)
+        db.session.commit()
+        assert archive_sales(older_than_days=365) == {2019: 1}
+        try:
+            assert store.compressed(2019) and store.count(2019) == 2
+            assert store.get(2019, backdated_id).items[0].quantity == 3
+            # Its unpacked copy is stale: the new file is unpacked again and
+            # replaces the old copy
+            assert other.count(2019) == 2
+            assert len([name for name in os.listdir(store.unpacked_folder()) if name.startswith('sales_2019.')]) == 1
+        finally:
+            other.close()
+
+
+def test_archives_written_before_costing_gain_the_cost_columns(tmp_path):
+    with sqlite3.connect(tmp_path / 'sales_2018.db') as conn:
+        conn.execute('CREATE TABLE sale_item (id INTEGER PRIMARY KEY, sale_id INTEGER NOT NULL, '
+                     'medicine_id INTEGER NOT NULL, medicine_name VARCHAR(100), batch_number VARCHAR(50), '
+                     'quantity INTEGER NOT NULL, unit_price FLOAT NOT NULL, total_price FLOAT NOT NULL)')
+        conn.execute("INSERT INTO sale_item VALUES (1, 1, 7, 'Old Med', 'B', 2, 5.0, 10.0)")
+    store = sales_archive.ArchiveStore(str(tmp_path))
+    try:
+        store.write(2018, [{'id': 1, 'invoice_number': 'OLD-1', 'customer_name': 'Old', 'total_amount': 10.0,
+                            'sale_date': datetime(2018, 5, 1), 'item_count': 2}], [])
+        row, = store.margins(2018, 'medicine', datetime(2018, 1, 1), datetime(2019, 1, 1))
+        # Revenue is there, the cost was never recorded
+        assert row == (7, 'Old Med', 2, 10.0, 0, None, 1)
+    finally:
+        store.close()
@@ -0,0 +1,44 @@
+from werkzeug.datastructures import MultiDict
+
+from app import app, db, Medicine, Purchase, Supplier, SupplierStats, rebuild_supplier_stats
+
+
+def stats_tuple(supplier_id):
+    stats = db.session.get(SupplierStats, supplier_id)
+    return (stats.sku_count, round(stats.stock_value, 2), round(stats.total_purchased, 2), round(stats.outstanding_amount, 2))
+
+
+def test_supplier_stats_track_writes_incrementally(client):
+    with app.app_context():
+        supplier = Supplier(name='Stats Pharma', contact='S')
+        other = Supplier(name='Other Pharma', contact='O')
+        db.session.add_all([supplier, other])
+        db.session.commit()
+        supplier_id, other_id = supplier.id, other.id
+
+    for i in range(3):
+        client.post('/add_medicine', data={'name': f'Stats Med {i}', 'quantity': '10', 'price': '2',
+                                           'supplier_id': str(supplier_id), 'expiry_date': '2030-01-01'})
+    with app.app_context():
+        medicine_id = Medicine.query.filter_by(name='Stats Med 0').one().id
+        db.session.add(Purchase(supplier_id=supplier_id, invoice_number='STATS-PENDING', total_amount=99.5))
+        db.session.commit()
+
+    client.post('/sale/new', data=MultiDict([('customer_name', 'C'), ('payment_method', 'Cash'),
+                                             ('medicine_id[]', str(medicine_id)), ('quantity[]', '4'), ('price[]', '2')]))
+    client.post(f'/medicine/{medicine_id}/edit', data={'name': 'Stats Med 0', 'price': '3',
+                                                      'supplier_id': str(other_id), 'expiry_date': '2030-01-01'})
+
+    with app.app_context():
+        incremental = {sid: stats_tuple(sid) for sid in (supplier_id, other_id)}
+        assert incremental[supplier_id] == (2, 40.0, 159.5, 99.5)
+        assert incremental[other_id] == (1, 18.0, 0.0, 0.0)
+
+        rebuild_supplier_stats()
+        db.session.commit()
+        assert {sid: stats_tuple(sid) for sid in (supplier_id, other_id)} == incremental
+
+    response = client.get(f'/supplier/{supplier_id}')
+    assert response.status_code == 200
+    assert b'Stats Med 1' in response.data
+    assert client.post(f'/supplier/{supplier_id}/delete').get_json()['success'] is False
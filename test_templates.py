@@ -0,0 +1,24 @@
+import os
+
+from app import app
+from run_checks import precompile_templates
+
+
+def test_precompiled_templates_are_loaded_from_the_bytecode_cache():
+    folder = app.config['TEMPLATE_CACHE_FOLDER']
+    assert precompile_templates() == []
+    cached = [name for name in os.listdir(folder) if name.endswith('.cache')]
+    assert len(cached) >= len([name for name in app.jinja_env.list_templates() if name.endswith('.html')])
+
+    # A fresh environment reads the stored code instead of compiling
+    env = app.create_jinja_environment()
+    compiled = []
+    original = env.compile
+    env.compile = lambda *args, **kwargs: compiled.append(args) or original(*args, **kwargs)
+    env.get_template('login.html')
+    assert compiled == []
+
+
+def test_auto_reload_follows_debug_mode():
+    assert app.config['TEMPLATES_AUTO_RELOAD'] is None
+    assert app.jinja_env.auto_reload is app.debug